@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Shared pytest fixtures: every test starts and ends with the process-wide caches empty
+"""
+
+import pytest
+
+from services_enhanced import (
+    GeminiService, analysis_result_cache, drive_change_feed, drive_client_pool, folder_name_index, folder_tree_cache,
+    hub_file_index, naming_rules_cache, single_flight
+)
+
+
+def clear_shared_state():
+    # The feed first, so its poller stops before the caches it feeds are emptied
+    drive_change_feed.clear()
+    hub_file_index.clear()
+    folder_tree_cache.clear()
+    folder_name_index.clear()
+    naming_rules_cache.clear()
+    analysis_result_cache.clear()
+    drive_client_pool.clear()
+    single_flight.clear()
+    GeminiService.clear_tier_stats()
+
+
+@pytest.fixture(autouse=True)
+def shared_state():
+    ttl_seconds = folder_tree_cache.ttl_seconds
+    clear_shared_state()
+    yield
+    clear_shared_state()
+    folder_tree_cache.ttl_seconds = ttl_seconds
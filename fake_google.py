@@ -0,0 +1,475 @@
+"""
+Local fakes of the Google Drive client used by the tests and benchmarks.
+FakeDrive mimics the subset of googleapiclient's `files()` / `changes()` / `about()` surface
+that services_enhanced uses, counts every call, and can inject latency.
+FakeResumableUploadServer is a local HTTP endpoint for the resumable upload protocol.
+"""
+
+import io
+import re
+import json
+import socket
+import time
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from services_enhanced import DriveService
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+
+class FakeRequest:
+    """Deferred call, executed like googleapiclient's HttpRequest"""
+
+    def __init__(self, drive, method, handler):
+        self._drive = drive
+        self._method = method
+        self._handler = handler
+
+    def execute(self, num_retries=0):
+        self._drive._record(self._method)
+        if self._drive.latency:
+            time.sleep(self._drive.latency)
+        error = self._drive._next_failure(self._method)
+        if error:
+            raise error
+        return self._handler()
+
+
+class FakeFiles:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def list(self, q='', fields=None, pageSize=100, pageToken=None, orderBy=None, **kwargs):
+        return FakeRequest(self._drive, 'files.list',
+                           lambda: self._drive._list(q, pageSize, pageToken, orderBy))
+
+    def get(self, fileId, fields=None, **kwargs):
+        return FakeRequest(self._drive, 'files.get', lambda: dict(self._drive._item(fileId)))
+
+    def export(self, fileId, mimeType=None, **kwargs):
+        return FakeRequest(self._drive, 'files.export',
+                           lambda: self._drive._item(fileId).get('content', '').encode('utf-8'))
+
+
+class FakeChanges:
+    """Drive Changes feed: page tokens are positions in the drive's change log"""
+
+    def __init__(self, drive):
+        self._drive = drive
+
+    def getStartPageToken(self, **kwargs):
+        return FakeRequest(self._drive, 'changes.getStartPageToken',
+                           lambda: {'startPageToken': str(len(self._drive.change_log))})
+
+    def list(self, pageToken, pageSize=100, fields=None, **kwargs):
+        return FakeRequest(self._drive, 'changes.list', lambda: self._drive._changes(pageToken, pageSize))
+
+
+class FakeAbout:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def get(self, fields=None, **kwargs):
+        return FakeRequest(self._drive, 'about.get',
+                           lambda: {'user': {'emailAddress': 'tester@skylarkdrones.com'}})
+
+
+class FakeDrive:
+    """In-memory Drive with folders, files and per-method call counters"""
+
+    def __init__(self, latency=0.0, max_page_size=1000):
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.items = {}
+        self.calls = Counter()
+        self.failures = []
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._clock = 0
+        self.change_log = []
+
+    def files(self):
+        return FakeFiles(self)
+
+    def changes(self):
+        return FakeChanges(self)
+
+    def about(self):
+        return FakeAbout(self)
+
+    # ----- tree building helpers -----
+
+    def add_folder(self, name, parent_id=None, folder_id=None):
+        return self._add(name, parent_id, FOLDER_MIME_TYPE, folder_id)
+
+    def add_file(self, name, parent_id, mime_type='application/pdf', file_id=None, **extra):
+        return self._add(name, parent_id, mime_type, file_id, **extra)
+
+    def touch(self, item_id):
+        """Bump modifiedTime the way Drive does when an item changes"""
+        self.items[item_id]['modifiedTime'] = self._timestamp()
+        self._log_change(item_id)
+
+    def update(self, item_id, **fields):
+        """Change an item's metadata (name, parents, trashed, ...) and log it on the Changes feed"""
+        self.items[item_id].update(fields)
+        self.touch(item_id)
+
+    def delete(self, item_id):
+        """Permanently delete an item; the Changes feed reports it as removed"""
+        del self.items[item_id]
+        self._log_change(item_id, removed=True)
+
+    def fail_next(self, method, error, times=1):
+        """Make the next `times` calls to method raise error"""
+        with self._lock:
+            self.failures.extend([(method, error)] * times)
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def _add(self, name, parent_id, mime_type, item_id=None, **extra):
+        with self._lock:
+            self._next_id += 1
+            item_id = item_id or f"fake{self._next_id:05d}"
+        item = {
+            'id': item_id,
+            'name': name,
+            'mimeType': mime_type,
+            'parents': [parent_id] if parent_id else [],
+            'modifiedTime': self._timestamp(),
+            'trashed': False
+        }
+        item.update(extra)
+        self.items[item_id] = item
+        self._log_change(item_id)
+        return item_id
+
+    def _timestamp(self):
+        self._clock += 1
+        # One second per change from 2024-01-01, so timestamps compare like Drive's
+        return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(1704067200 + self._clock))
+
+    def _record(self, method):
+        with self._lock:
+            self.calls[method] += 1
+
+    def _next_failure(self, method):
+        with self._lock:
+            for index, (failing_method, error) in enumerate(self.failures):
+                if failing_method == method:
+                    del self.failures[index]
+                    return error
+        return None
+
+    # ----- query evaluation -----
+
+    def _log_change(self, item_id, removed=False):
+        with self._lock:
+            self.change_log.append((item_id, removed))
+
+    def _changes(self, page_token, page_size):
+        start = int(page_token)
+        page_size = min(page_size or 100, self.max_page_size)
+        page = self.change_log[start:start + page_size]
+        changes = []
+        for item_id, removed in page:
+            change = {'fileId': item_id, 'removed': removed or item_id not in self.items}
+            if not change['removed']:
+                change['file'] = dict(self.items[item_id])
+            changes.append(change)
+        result = {'changes': changes}
+        if start + page_size < len(self.change_log):
+            result['nextPageToken'] = str(start + page_size)
+        else:
+            result['newStartPageToken'] = str(len(self.change_log))
+        return result
+
+    def _item(self, item_id):
+        if item_id not in self.items:
+            raise KeyError(f"File not found: {item_id}")
+        return self.items[item_id]
+
+    def _list(self, q, page_size, page_token, order_by):
+        matches = self._query(q)
+        if order_by:
+            matches.sort(key=lambda item: item['name'])
+
+        page_size = min(page_size or 100, self.max_page_size)
+        start = int(page_token or 0)
+        page = matches[start:start + page_size]
+        result = {'files': [dict(item) for item in page]}
+        if start + page_size < len(matches):
+            result['nextPageToken'] = str(start + page_size)
+        return result
+
+    def _query(self, q):
+        """Evaluate the subset of Drive query syntax the services use"""
+        parents = set(re.findall(r"'([^']+)' in parents", q))
+        names = {name.replace("\\'", "'") for name in re.findall(r"name\s*=\s*'((?:\\'|[^'])*)'", q)}
+        mime_equals = re.search(r"mimeType\s*=\s*'([^']+)'", q)
+        mime_not_equals = re.search(r"mimeType\s*!=\s*'([^']+)'", q)
+        skip_trashed = 'trashed=false' in q.replace(' ', '')
+        modified_after = re.search(r"modifiedTime\s*>\s*'([^']+)'", q)
+
+        matches = []
+        for item in list(self.items.values()):
+            if parents and not parents.intersection(item['parents']):
+                continue
+            if names and item['name'] not in names:
+                continue
+            if mime_equals and item['mimeType'] != mime_equals.group(1):
+                continue
+            if mime_not_equals and item['mimeType'] == mime_not_equals.group(1):
+                continue
+            if skip_trashed and item['trashed']:
+                continue
+            if modified_after and item['modifiedTime'] <= modified_after.group(1):
+                continue
+            matches.append(item)
+        return matches
+
+
+def http_error(status, reason, message='Error'):
+    """Build a googleapiclient HttpError the way Drive reports it"""
+    content = json.dumps({
+        'error': {'code': status, 'message': message, 'errors': [{'reason': reason, 'message': message}]}
+    }).encode('utf-8')
+    return HttpError(httplib2.Response({'status': status}), content)
+
+
+def rate_limit_error():
+    return http_error(403, 'rateLimitExceeded', 'Rate Limit Exceeded')
+
+
+def build_marketing_hub(drive, top_level=6, per_folder=4, depth=3):
+    """Populate drive with a Marketing Hub tree and return the root folder id"""
+    root_id = drive.add_folder('Marketing Hub', folder_id='hub-root')
+    parents = [root_id]
+    for level in range(depth):
+        next_parents = []
+        for parent_id in parents:
+            count = top_level if level == 0 else per_folder
+            for index in range(count):
+                next_parents.append(drive.add_folder(f"L{level + 1} Folder {index:02d}", parent_id))
+        parents = next_parents
+    return root_id
+
+
+def make_drive_service(drive):
+    """DriveService whose client, on every thread, is the given fake"""
+    drive_service = DriveService(None)
+    drive_service.service = drive
+    drive_service.service_factory = lambda: drive
+    return drive_service
+
+
+class SyntheticFile(io.RawIOBase):
+    """Seekable read-only stream of `size` deterministic bytes that never materialises the whole file"""
+
+    BLOCK = bytes(range(256)) * 4096  # 1 MB repeating pattern
+
+    def __init__(self, size):
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer)
+        count = min(len(view), max(0, self.size - self.position))
+        written = 0
+        while written < count:
+            offset = (self.position + written) % len(self.BLOCK)
+            piece = min(count - written, len(self.BLOCK) - offset)
+            view[written:written + piece] = self.BLOCK[offset:offset + piece]
+            written += piece
+        self.position += count
+        return count
+
+
+class FakeResumableUploadServer:
+    """Local HTTP server speaking Drive's resumable upload protocol
+    
+    Uploaded bytes are counted and discarded, so arbitrarily large uploads cost no memory here.
+    Pass a FakeDrive to have completed uploads appear in it as files.
+    """
+
+    READ_BLOCK = 64 * 1024
+
+    def __init__(self, drive=None):
+        self.drive = drive
+        self.sessions = {}
+        self.files = {}
+        self.chunk_requests = 0
+        self.chunk_offsets = []
+        self.get_requests = 0
+        # Seconds to stall before answering metadata GETs, to exercise client timeouts
+        self.response_delay = 0
+        self._drop_after = None
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def drop_next_chunk(self, after_bytes):
+        """Cut the connection after reading part of the next chunk; nothing from it is kept"""
+        self._drop_after = after_bytes
+
+    def http(self):
+        """httplib2 client that talks to this server (googleapiclient forces https on upload URLs)"""
+        return _PlainHttp()
+
+    def drive_service(self):
+        """Real discovery-built Drive client pointed at this server"""
+        from googleapiclient.discovery import build
+        return build('drive', 'v3', http=self.http(), static_discovery=True,
+                     client_options={'api_endpoint': self.url + '/'})
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                metadata = json.loads(self._read_body() or b'{}')
+                with server._lock:
+                    upload_id = f"session{len(server.sessions) + 1:04d}"
+                    server.sessions[upload_id] = {
+                        'metadata': metadata, 'headers': dict(self.headers), 'received': 0, 'total': None
+                    }
+                location = f"{server.url}/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}"
+                self._respond(200, headers={'Location': location})
+
+            def do_GET(self):
+                # Enough of the metadata API for transport tests: about.get answers, the rest 404
+                with server._lock:
+                    server.get_requests += 1
+                if server.response_delay:
+                    time.sleep(server.response_delay)
+                if urlparse(self.path).path.endswith('/about'):
+                    return self._respond(200, {'user': {'emailAddress': 'tester@skylarkdrones.com'}})
+                self._respond(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+            def do_PUT(self):
+                upload_id = parse_qs(urlparse(self.path).query).get('upload_id', [''])[0]
+                upload = server.sessions.get(upload_id)
+                if upload is None:
+                    self._read_body(discard=True)
+                    return self._respond(404, {'error': {'code': 404, 'message': 'Upload session not found'}})
+
+                start, total = self._content_range()
+                length = int(self.headers.get('Content-Length', 0))
+                if start is not None and start != upload['received']:
+                    self._read_body(discard=True)
+                    return self._respond(400, {'error': {'code': 400, 'message': 'Unexpected chunk offset'}})
+
+                if length:
+                    server.chunk_offsets.append(start)
+                if length and server._drop_after is not None:
+                    self.rfile.read(min(length, server._drop_after))
+                    server._drop_after = None
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+
+                self._read_body(discard=True)
+                with server._lock:
+                    server.chunk_requests += 1
+                    upload['received'] += length
+                    if total is not None:
+                        upload['total'] = total
+
+                if upload['total'] is not None and upload['received'] >= upload['total']:
+                    file_id = f"uploaded-{upload_id}"
+                    server.files[file_id] = dict(upload['metadata'], id=file_id, size=upload['received'])
+                    if server.drive is not None:
+                        parents = upload['metadata'].get('parents') or [None]
+                        server.drive.add_file(upload['metadata'].get('name'), parents[0], file_id=file_id,
+                                              mime_type=upload['headers'].get('X-Upload-Content-Type'),
+                                              size=str(upload['received']))
+                    return self._respond(200, {'id': file_id, 'name': upload['metadata'].get('name')})
+
+                headers = {'Range': f"bytes=0-{upload['received'] - 1}"} if upload['received'] else {}
+                self._respond(308, headers=headers)
+
+            def do_DELETE(self):
+                # Cancelling a session: Drive answers 499 and the session URI stops accepting bytes
+                upload_id = parse_qs(urlparse(self.path).query).get('upload_id', [''])[0]
+                with server._lock:
+                    upload = server.sessions.pop(upload_id, None)
+                self._respond(499 if upload is not None else 404)
+
+            def _content_range(self):
+                match = re.match(r"bytes (\*|(\d+)-\d+)/(\*|\d+)", self.headers.get('Content-Range', ''))
+                if not match:
+                    return None, None
+                start = int(match.group(2)) if match.group(2) else None
+                total = int(match.group(3)) if match.group(3) != '*' else None
+                return start, total
+
+            def _read_body(self, discard=False):
+                remaining = int(self.headers.get('Content-Length', 0))
+                chunks = []
+                while remaining:
+                    block = self.rfile.read(min(remaining, server.READ_BLOCK))
+                    if not block:
+                        break
+                    remaining -= len(block)
+                    if not discard:
+                        chunks.append(block)
+                return b''.join(chunks)
+
+            def _respond(self, status, payload=None, headers=None):
+                body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+class _PlainHttp(httplib2.Http):
+    def __init__(self):
+        super().__init__()
+        # Resumable uploads use 308 for "resume incomplete", as in googleapiclient.http.build_http
+        self.redirect_codes = self.redirect_codes - {308}
+
+    def request(self, uri, *args, **kwargs):
+        return super().request(uri.replace('https://127.0.0.1', 'http://127.0.0.1', 1), *args, **kwargs)
@@ -1,15 +1,19 @@
-from flask import Flask, request, jsonify, session, redirect, url_for, render_template_string, send_from_directory
+from flask import Flask, Response, request, jsonify, session, redirect, url_for, render_template_string, send_from_directory
 from flask_cors import CORS
 import os
+import re
+import time
+import threading
 import secrets
 import requests
 from urllib.parse import urlencode
 import base64
 import json
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from services_enhanced import GeminiService, DriveService, NamingConventionService, IntelligentWorkflowOrchestrator
+from googleapiclient.errors import HttpError
+from services_enhanced import GeminiService, DriveService, NamingConventionService, IntelligentWorkflowOrchestrator, FolderPathIndex, folder_tree_cache, analysis_result_cache, naming_rules_cache, folder_name_index, hub_file_index, drive_change_feed, drive_client_pool, google_http_transport, gemini_runner, single_flight
 
 app = Flask(__name__)
 CORS(app)
@@ -21,10 +25,41 @@ GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET', "GOCSPX-wyn5Mc2Ql-
 MARKETING_HUB_FOLDER_ID = os.environ.get('MARKETING_HUB_FOLDER_ID', "1FM66Jay8G6gpXsP-pLGwW64-FmqJszLa")
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 NAMING_CONVENTION_DOC_ID = os.environ.get('NAMING_CONVENTION_DOC_ID', "1IqpsMdfAjGx3H2l6SyRWcRH3red40c6AosMORn0oQes")
+SSE_KEEPALIVE_SECONDS = float(os.environ.get('SSE_KEEPALIVE_SECONDS', '15'))
+# Analysis jobs run off the request threads; the browser polls them every ANALYSIS_POLL_INTERVAL_MS.
+# A job thread only waits on gemini_runner, so keep enough that the runner's semaphore, not this
+# pool, is what limits concurrent Gemini calls
+ANALYSIS_JOB_WORKERS = int(os.environ.get('ANALYSIS_JOB_WORKERS', str(max(32, 2 * gemini_runner.max_concurrency))))
+ANALYSIS_JOB_TTL = int(os.environ.get('ANALYSIS_JOB_TTL', '600'))
+ANALYSIS_POLL_INTERVAL_MS = int(os.environ.get('ANALYSIS_POLL_INTERVAL_MS', '500'))
+# 'poll': the page polls /api/gemini/analyze/jobs; 'stream': it reads /api/gemini/analyze/stream
+ANALYSIS_PROGRESS_MODE = os.environ.get('ANALYSIS_PROGRESS_MODE', 'poll')
+# Resumable upload chunk size; Drive requires a multiple of 256 KB
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+# 'direct': the browser PUTs file bytes straight to a Drive resumable session;
+# 'chunked': the browser PUTs chunks to /api/upload/chunk, which relays them to the session;
+# 'proxy': the whole file is posted to /api/upload/upload
+UPLOAD_MODE = os.environ.get('UPLOAD_MODE', 'direct')
+UPLOAD_RELAY_TIMEOUT = int(os.environ.get('UPLOAD_RELAY_TIMEOUT', '300'))
+# Uploads the browser keeps in flight at once; the rest wait in its queue
+UPLOAD_CONCURRENCY = max(1, int(os.environ.get('UPLOAD_CONCURRENCY', '3')))
+DRIVE_UPLOAD_URL = os.environ.get('DRIVE_UPLOAD_URL', 'https://www.googleapis.com/upload/drive/v3/files')
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', str(24 * 3600)))
+# Largest file the browser MD5-hashes for the duplicate check (about 3 s at 80 MB/s)
+DUPLICATE_HASH_MAX_BYTES = int(os.environ.get('DUPLICATE_HASH_MAX_BYTES', str(256 * 1024 * 1024)))
 
 # Initialize services
 gemini_service = GeminiService(GEMINI_API_KEY)
 
+# Browser-direct uploads waiting for /api/upload/finalize, keyed by upload token
+pending_uploads = {}
+pending_uploads_lock = threading.Lock()
+
+# Single-file analysis workflows, keyed by job id; the workers mostly wait on the Gemini event loop
+analysis_jobs = {}
+analysis_jobs_lock = threading.Lock()
+analysis_job_executor = ThreadPoolExecutor(max_workers=ANALYSIS_JOB_WORKERS, thread_name_prefix='analysis-job')
+
 # HTML template (enhanced version with better UI)
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -411,6 +446,17 @@ HTML_TEMPLATE = """
             display: none;
         }
         
+        .upload-queue-summary {
+            display: none;
+            margin-top: 24px;
+            padding: 12px 16px;
+            border-radius: 12px;
+            background: rgba(37, 99, 235, 0.06);
+            color: var(--skylark-dark);
+            font-size: 14px;
+            font-weight: 600;
+        }
+        
         .file-list {
             margin-top: 32px;
             max-width: 100%;
@@ -1040,6 +1086,7 @@ HTML_TEMPLATE = """
                 
                 <input type="file" id="fileInput" class="file-input" multiple accept=".pdf,.doc,.docx,.ppt,.pptx,.xls,.xlsx,.jpg,.jpeg,.png,.gif">
                 
+                <div class="upload-queue-summary" id="uploadQueueSummary"></div>
                 <div class="file-list" id="fileList"></div>
             </div>
             {% endif %}
@@ -1056,12 +1103,121 @@ HTML_TEMPLATE = """
         </div>
     </div>
     
+    <script type="text/js-worker" id="md5WorkerSource">
+        // MD5 of a dropped file, computed off the main thread so the page stays responsive.
+        // Matches Drive's md5Checksum, so renamed copies of hub files are caught as duplicates.
+        const HASH_SLICE_BYTES = 4 * 1024 * 1024;
+        const SHIFTS = [7, 12, 17, 22, 5, 9, 14, 20, 4, 11, 16, 23, 6, 10, 15, 21];
+        const CONSTANTS = new Int32Array(64);
+        for (let i = 0; i < 64; i++) {
+            CONSTANTS[i] = Math.floor(Math.abs(Math.sin(i + 1)) * 4294967296) | 0;
+        }
+        
+        class Md5 {
+            constructor() {
+                this.state = new Int32Array([0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476]);
+                this.buffer = new Uint8Array(64);
+                this.buffered = 0;
+                this.length = 0;
+                this.words = new Int32Array(16);
+            }
+            
+            update(bytes) {
+                let offset = 0;
+                this.length += bytes.length;
+                if (this.buffered > 0) {
+                    offset = Math.min(64 - this.buffered, bytes.length);
+                    this.buffer.set(bytes.subarray(0, offset), this.buffered);
+                    this.buffered += offset;
+                    if (this.buffered < 64) return;
+                    this.block(this.buffer, 0);
+                    this.buffered = 0;
+                }
+                for (; offset + 64 <= bytes.length; offset += 64) {
+                    this.block(bytes, offset);
+                }
+                this.buffer.set(bytes.subarray(offset), 0);
+                this.buffered = bytes.length - offset;
+            }
+            
+            block(bytes, offset) {
+                const words = this.words;
+                for (let i = 0; i < 16; i++) {
+                    const j = offset + i * 4;
+                    words[i] = bytes[j] | (bytes[j + 1] << 8) | (bytes[j + 2] << 16) | (bytes[j + 3] << 24);
+                }
+                let a = this.state[0], b = this.state[1], c = this.state[2], d = this.state[3];
+                for (let i = 0; i < 64; i++) {
+                    let f, g;
+                    if (i < 16) {
+                        f = (b & c) | (~b & d);
+                        g = i;
+                    } else if (i < 32) {
+                        f = (d & b) | (~d & c);
+                        g = (5 * i + 1) % 16;
+                    } else if (i < 48) {
+                        f = b ^ c ^ d;
+                        g = (3 * i + 5) % 16;
+                    } else {
+                        f = c ^ (b | ~d);
+                        g = (7 * i) % 16;
+                    }
+                    const shift = SHIFTS[(i >> 4) * 4 + (i % 4)];
+                    const sum = (a + f + CONSTANTS[i] + words[g]) | 0;
+                    a = d;
+                    d = c;
+                    c = b;
+                    b = (b + ((sum << shift) | (sum >>> (32 - shift)))) | 0;
+                }
+                this.state[0] += a;
+                this.state[1] += b;
+                this.state[2] += c;
+                this.state[3] += d;
+            }
+            
+            hex() {
+                const bitLength = this.length * 8;
+                const padding = new Uint8Array((this.buffered < 56 ? 56 : 120) - this.buffered + 8);
+                padding[0] = 0x80;
+                const view = new DataView(padding.buffer);
+                view.setUint32(padding.length - 8, bitLength >>> 0, true);
+                view.setUint32(padding.length - 4, Math.floor(bitLength / 4294967296), true);
+                this.update(padding);
+                
+                const digest = new Uint8Array(this.state.buffer);
+                return Array.from(digest, byte => byte.toString(16).padStart(2, '0')).join('');
+            }
+        }
+        
+        self.onmessage = async (event) => {
+            const { id, file } = event.data;
+            try {
+                const md5 = new Md5();
+                for (let offset = 0; offset < file.size; offset += HASH_SLICE_BYTES) {
+                    const slice = await file.slice(offset, offset + HASH_SLICE_BYTES).arrayBuffer();
+                    md5.update(new Uint8Array(slice));
+                }
+                self.postMessage({ id, md5: md5.hex() });
+            } catch (error) {
+                self.postMessage({ id, md5: null, error: String(error) });
+            }
+        };
+    </script>
     <script>
         // File upload functionality
         const uploadZone = document.getElementById('uploadZone');
         const fileInput = document.getElementById('fileInput');
         const fileList = document.getElementById('fileList');
         let uploadedFiles = [];
+        const UPLOAD_MODE = '{{ upload_mode }}';
+        const UPLOAD_MAX_RETRIES = 5;
+        const UPLOAD_CONCURRENCY = {{ upload_concurrency }};
+        const DUPLICATE_HASH_MAX_BYTES = {{ duplicate_hash_max_bytes }};
+        const ANALYSIS_POLL_INTERVAL_MS = {{ analysis_poll_interval_ms }};
+        const ANALYSIS_PROGRESS_MODE = '{{ analysis_progress_mode }}';
+        let hashWorker = null;
+        const pendingHashes = new Map();
+        let nextHashId = 0;
         
         // Click to browse files
         uploadZone.addEventListener('click', () => {
@@ -1091,6 +1247,7 @@ HTML_TEMPLATE = """
         
         // Handle selected files
         function handleFiles(files) {
+            const batch = [];
             Array.from(files).forEach((file, index) => {
                 const fileId = Date.now() + index;
                 uploadedFiles.push({
@@ -1100,7 +1257,47 @@ HTML_TEMPLATE = """
                 });
                 
                 displayFile(file, fileId);
-                analyzeFileWithGemini(file, fileId);
+                batch.push({ file, fileId });
+            });
+            
+            // Multi-file drops share one folder snapshot, rules fetch and duplicate query
+            if (batch.length > 1) {
+                analyzeFilesInBatch(batch);
+            } else {
+                batch.forEach(({ file, fileId }) => analyzeFileWithGemini(file, fileId));
+            }
+        }
+        
+        // MD5 of a file from the hashing worker, or null when the file is too large to hash in the
+        // browser or workers are unavailable (the server then falls back to name and size)
+        function hashFile(file) {
+            if (!window.Worker || file.size > DUPLICATE_HASH_MAX_BYTES) {
+                return Promise.resolve(null);
+            }
+            try {
+                if (!hashWorker) {
+                    const source = document.getElementById('md5WorkerSource').textContent;
+                    hashWorker = new Worker(URL.createObjectURL(new Blob([source], { type: 'text/javascript' })));
+                    hashWorker.onmessage = (event) => {
+                        const resolve = pendingHashes.get(event.data.id);
+                        pendingHashes.delete(event.data.id);
+                        if (resolve) resolve(event.data.md5);
+                    };
+                    hashWorker.onerror = (error) => {
+                        console.warn('Hashing worker failed:', error);
+                        pendingHashes.forEach(resolve => resolve(null));
+                        pendingHashes.clear();
+                        hashWorker = null;
+                    };
+                }
+            } catch (error) {
+                console.warn('Hashing worker unavailable:', error);
+                return Promise.resolve(null);
+            }
+            return new Promise(resolve => {
+                const id = ++nextHashId;
+                pendingHashes.set(id, resolve);
+                hashWorker.postMessage({ id, file });
             });
         }
         
@@ -1166,124 +1363,239 @@ HTML_TEMPLATE = """
             fileList.appendChild(fileItem);
         }
         
-        // Analyze file with Gemini AI
+        // Analyze file with Gemini AI, rendering workflow progress as it streams in
         async function analyzeFileWithGemini(file, fileId) {
             try {
-                // Start spinning animation
+                startSpinner(fileId);
+                const md5 = await hashFile(file);
+                const body = JSON.stringify({
+                    filename: file.name,
+                    fileType: file.type,
+                    fileSize: file.size,
+                    md5: md5
+                });
+                
+                const result = ANALYSIS_PROGRESS_MODE === 'stream'
+                    ? await streamAnalysis(body, update => showProgressUpdate(fileId, update))
+                    : await runAnalysisJob(body, update => showProgressUpdate(fileId, update));
+                
+                // Hide step indicator when complete
                 const stepIndicator = document.getElementById(`step-indicator-${fileId}`);
                 if (stepIndicator) {
-                    const progressCircle = stepIndicator.querySelector('.progress-circle');
-                    if (progressCircle) {
-                        progressCircle.classList.add('spinning');
+                    stepIndicator.style.display = 'none';
+                }
+                
+                showAnalysisResult(fileId, result);
+                
+            } catch (error) {
+                console.error('Analysis error:', error);
+                showAnalysisError(fileId);
+            }
+        }
+        
+        // Start an analysis job and poll it to completion
+        async function runAnalysisJob(body, onProgress) {
+            const response = await fetch('/api/gemini/analyze/jobs', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: body
+            });
+            
+            if (!response.ok) {
+                throw new Error(`Analysis request failed (${response.status})`);
+            }
+            
+            const job = await response.json();
+            return pollAnalysisJob(job.job_id, job.poll_interval_ms || ANALYSIS_POLL_INTERVAL_MS, onProgress);
+        }
+        
+        // Run an analysis over one Server-Sent Events response, passing each progress update to onProgress
+        async function streamAnalysis(body, onProgress) {
+            const response = await fetch('/api/gemini/analyze/stream', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream'
+                },
+                body: body
+            });
+            
+            if (!response.ok || !response.body) {
+                throw new Error(`Analysis request failed (${response.status})`);
+            }
+            
+            let result = null;
+            await readEventStream(response, (event, payload) => {
+                if (event === 'progress') {
+                    onProgress(payload);
+                } else if (event === 'result') {
+                    result = payload;
+                } else if (event === 'error') {
+                    throw new Error(payload.error || 'Analysis failed');
+                }
+            });
+            
+            if (!result) {
+                throw new Error('Analysis stream ended without a result');
+            }
+            return result;
+        }
+        
+        // Parse a Server-Sent Events response body, calling onEvent(event, data) per message
+        async function readEventStream(response, onEvent) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                
+                let boundary;
+                while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                    const message = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    
+                    let event = 'message';
+                    const dataLines = [];
+                    message.split('\\n').forEach(line => {
+                        if (line.startsWith('event:')) {
+                            event = line.slice(6).trim();
+                        } else if (line.startsWith('data:')) {
+                            dataLines.push(line.slice(5).trim());
+                        }
+                    });
+                    if (dataLines.length > 0) {
+                        onEvent(event, JSON.parse(dataLines.join('\\n')));
                     }
                 }
+            }
+        }
+        
+        // Poll an analysis job until it finishes, passing each new progress update to onProgress
+        async function pollAnalysisJob(jobId, intervalMs, onProgress) {
+            let after = 0;
+            while (true) {
+                const response = await fetch(`/api/gemini/analyze/jobs/${encodeURIComponent(jobId)}?after=${after}`);
+                if (!response.ok) {
+                    throw new Error(`Analysis status request failed (${response.status})`);
+                }
                 
-                const response = await fetch('/api/gemini/analyze', {
+                const job = await response.json();
+                job.events.forEach(onProgress);
+                after = job.next;
+                if (job.status === 'done') {
+                    return job.result;
+                }
+                if (job.status === 'error') {
+                    throw new Error(job.error || 'Analysis failed');
+                }
+                await new Promise(resolve => setTimeout(resolve, intervalMs));
+            }
+        }
+        
+        // Move the step indicator and status text for one progress update
+        function showProgressUpdate(fileId, update) {
+            const analysisElement = document.getElementById(`analysis-${fileId}`);
+            const destinationElement = document.getElementById(`destination-${fileId}`);
+            const stepIndicator = document.getElementById(`step-indicator-${fileId}`);
+            if (!stepIndicator) return;
+            
+            const progressFill = stepIndicator.querySelector('.progress-fill');
+            const stepText = stepIndicator.querySelector('.step-text');
+            
+            progressFill.style.setProperty('--progress', `${Math.round(update.progress * 3.6)}deg`);
+            stepText.textContent = `Step ${update.step} of 3`;
+            if (update.step === 1) {
+                analysisElement.innerHTML = `${update.message}`;
+            } else {
+                destinationElement.innerHTML = `${update.message}`;
+            }
+        }
+        
+        // Analyze several dropped files with one batch request
+        async function analyzeFilesInBatch(batch) {
+            batch.forEach(({ fileId }) => startSpinner(fileId));
+            
+            try {
+                const hashes = await Promise.all(batch.map(({ file }) => hashFile(file)));
+                const response = await fetch('/api/gemini/analyze/batch', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
                     },
                     body: JSON.stringify({
-                        filename: file.name,
-                        fileType: file.type,
-                        fileSize: file.size
+                        files: batch.map(({ file }, index) => ({
+                            filename: file.name,
+                            fileType: file.type,
+                            fileSize: file.size,
+                            md5: hashes[index]
+                        }))
                     })
                 });
                 
-                const result = await response.json();
-                
-                // Display progress updates if available
-                if (result.progress_updates && result.progress_updates.length > 0) {
-                    const analysisElement = document.getElementById(`analysis-${fileId}`);
-                    const destinationElement = document.getElementById(`destination-${fileId}`);
-                    const stepIndicator = document.getElementById(`step-indicator-${fileId}`);
-                    
-                    // Show progress step by step
-                    for (let i = 0; i < result.progress_updates.length; i++) {
-                        const update = result.progress_updates[i];
-                        
-                        // Update step indicator
-                        if (stepIndicator) {
-                            const progressFill = stepIndicator.querySelector('.progress-fill');
-                            const stepText = stepIndicator.querySelector('.step-text');
-                            
-                            if (update.step === 1) {
-                                progressFill.style.setProperty('--progress', '120deg');
-                                stepText.textContent = 'Step 1 of 3';
-                                analysisElement.innerHTML = `${update.message}`;
-                            } else if (update.step === 2) {
-                                progressFill.style.setProperty('--progress', '240deg');
-                                stepText.textContent = 'Step 2 of 3';
-                                destinationElement.innerHTML = `${update.message}`;
-                            } else if (update.step === 3) {
-                                progressFill.style.setProperty('--progress', '360deg');
-                                stepText.textContent = 'Step 3 of 3';
-                                destinationElement.innerHTML = `${update.message}`;
-                            }
-                        }
-                        
-                        // Small delay to show progress
-                        if (i < result.progress_updates.length - 1) {
-                            await new Promise(resolve => setTimeout(resolve, 500));
-                        }
-                    }
-                    
-                    // Hide step indicator when complete
-                    setTimeout(() => {
-                        if (stepIndicator) {
-                            stepIndicator.style.display = 'none';
-                        }
-                    }, 1000);
+                const data = await response.json();
+                if (!response.ok || !data.results) {
+                    throw new Error(data.error || 'Batch analysis failed');
                 }
                 
-                // Update UI with final analysis results
-                document.getElementById(`analysis-${fileId}`).innerHTML = result.summary;
-                document.getElementById(`details-${fileId}`).innerHTML = result.details;
-                document.getElementById(`destination-${fileId}`).innerHTML = result.destination;
-                
-                // Update status based on result type
-                const statusElement = document.querySelector(`#file-${fileId} .file-status`);
-                
-                if (result.is_duplicate) {
-                    statusElement.className = 'file-status status-warning';
-                    statusElement.textContent = 'Duplicate';
-                    
-                    // Don't show action buttons for duplicates
-                    const actionButtons = document.getElementById(`action-buttons-${fileId}`);
-                    if (actionButtons) {
-                        actionButtons.style.display = 'none';
-                    }
-                } else {
-                    statusElement.className = 'file-status status-ready';
-                    statusElement.textContent = 'Ready';
-                    
-                    // Show action buttons after analysis is complete
-                    const actionButtons = document.getElementById(`action-buttons-${fileId}`);
-                    if (actionButtons) {
-                        actionButtons.style.display = 'block';
-                    }
-                    
-                    // Stop spinning animation
+                batch.forEach(({ fileId }, index) => {
                     const stepIndicator = document.getElementById(`step-indicator-${fileId}`);
                     if (stepIndicator) {
-                        const progressCircle = stepIndicator.querySelector('.progress-circle');
-                        if (progressCircle) {
-                            progressCircle.classList.remove('spinning');
-                        }
+                        stepIndicator.style.display = 'none';
                     }
+                    showAnalysisResult(fileId, data.results[index]);
+                });
+                
+            } catch (error) {
+                console.error('Batch analysis error:', error);
+                batch.forEach(({ fileId }) => showAnalysisError(fileId));
+            }
+        }
+        
+        function startSpinner(fileId) {
+            const stepIndicator = document.getElementById(`step-indicator-${fileId}`);
+            if (stepIndicator) {
+                const progressCircle = stepIndicator.querySelector('.progress-circle');
+                if (progressCircle) {
+                    progressCircle.classList.add('spinning');
                 }
+            }
+        }
+        
+        // Render a finished analysis (single or batch) into the file card
+        function showAnalysisResult(fileId, result) {
+            // Update UI with final analysis results
+            document.getElementById(`analysis-${fileId}`).innerHTML = result.summary;
+            document.getElementById(`details-${fileId}`).innerHTML = result.details;
+            document.getElementById(`destination-${fileId}`).innerHTML = result.destination;
+            
+            // Update status based on result type
+            const statusElement = document.querySelector(`#file-${fileId} .file-status`);
+            
+            if (result.is_duplicate) {
+                statusElement.className = 'file-status status-warning';
+                statusElement.textContent = 'Duplicate';
                 
-                // Update file object
-                const fileObj = uploadedFiles.find(f => f.id === fileId);
-                if (fileObj) {
-                    fileObj.status = result.is_duplicate ? 'duplicate' : 'ready';
-                    fileObj.analysis = result;
+                // Don't show action buttons for duplicates
+                const actionButtons = document.getElementById(`action-buttons-${fileId}`);
+                if (actionButtons) {
+                    actionButtons.style.display = 'none';
                 }
+            } else {
+                statusElement.className = 'file-status status-ready';
+                statusElement.textContent = 'Ready';
                 
-            } catch (error) {
-                console.error('Analysis error:', error);
+                // Show action buttons after analysis is complete
+                const actionButtons = document.getElementById(`action-buttons-${fileId}`);
+                if (actionButtons) {
+                    actionButtons.style.display = 'block';
+                }
                 
-                // Stop spinning animation on error
+                // Stop spinning animation
                 const stepIndicator = document.getElementById(`step-indicator-${fileId}`);
                 if (stepIndicator) {
                     const progressCircle = stepIndicator.querySelector('.progress-circle');
@@ -1291,37 +1603,192 @@ HTML_TEMPLATE = """
                         progressCircle.classList.remove('spinning');
                     }
                 }
-                
-                // Show error state
-                document.getElementById(`analysis-${fileId}`).innerHTML = 
-                    '<strong>Analysis Error</strong><br>Unable to analyze file. Using fallback organization.';
-                
-                // Update status to error
-                const statusElement = document.querySelector(`#file-${fileId} .file-status`);
-                if (statusElement) {
-                    statusElement.className = 'file-status status-warning';
-                    statusElement.textContent = 'Error';
-                }
-                
-                // Show action buttons even on error (fallback mode)
-                const actionButtons = document.getElementById(`action-buttons-${fileId}`);
-                if (actionButtons) {
-                    actionButtons.style.display = 'block';
+            }
+            
+            // Update file object
+            const fileObj = uploadedFiles.find(f => f.id === fileId);
+            if (fileObj) {
+                fileObj.status = result.is_duplicate ? 'duplicate' : 'ready';
+                fileObj.analysis = result;
+            }
+        }
+        
+        // Show the fallback state when analysis fails
+        function showAnalysisError(fileId) {
+            // Stop spinning animation on error
+            const stepIndicator = document.getElementById(`step-indicator-${fileId}`);
+            if (stepIndicator) {
+                const progressCircle = stepIndicator.querySelector('.progress-circle');
+                if (progressCircle) {
+                    progressCircle.classList.remove('spinning');
                 }
             }
+            
+            // Show error state
+            document.getElementById(`analysis-${fileId}`).innerHTML = 
+                '<strong>Analysis Error</strong><br>Unable to analyze file. Using fallback organization.';
+            
+            // Update status to error
+            const statusElement = document.querySelector(`#file-${fileId} .file-status`);
+            if (statusElement) {
+                statusElement.className = 'file-status status-warning';
+                statusElement.textContent = 'Error';
+            }
+            
+            // Show action buttons even on error (fallback mode)
+            const actionButtons = document.getElementById(`action-buttons-${fileId}`);
+            if (actionButtons) {
+                actionButtons.style.display = 'block';
+            }
         }
         
-        // Accept and upload file
-        async function acceptAndUpload(fileId) {
+        // Accept and upload file: queue it; the scheduler starts it when an upload slot is free
+        function acceptAndUpload(fileId) {
             const fileObj = uploadedFiles.find(f => f.id === fileId);
-            if (!fileObj) return;
+            if (!fileObj || fileObj.status === 'queued' || fileObj.status === 'uploading') return;
             
-            // Immediate visual feedback - hide buttons and show uploading state
+            // Immediate visual feedback - hide buttons and show queued state
             const actionButtons = document.getElementById(`action-buttons-${fileId}`);
             if (actionButtons) {
                 actionButtons.style.display = 'none';
             }
             
+            const statusElement = document.querySelector(`#file-${fileId} .file-status`);
+            statusElement.className = 'file-status status-uploading';
+            statusElement.textContent = 'Queued';
+            
+            uploadScheduler.enqueue(fileObj);
+        }
+        
+        // Upload queue: at most UPLOAD_CONCURRENCY uploads in flight, smallest files first,
+        // failed uploads retried with exponential backoff (resuming their session), aggregate MB/s and ETA
+        const uploadScheduler = {
+            queue: [],
+            active: 0,
+            waiting: 0,
+            files: [],
+            startedAt: null,
+            
+            enqueue(fileObj) {
+                fileObj.status = 'queued';
+                fileObj.attempts = 0;
+                fileObj.sentBytes = 0;
+                if (!this.files.includes(fileObj)) {
+                    this.files.push(fileObj);
+                }
+                if (this.startedAt === null) {
+                    this.startedAt = performance.now();
+                }
+                this.push(fileObj);
+            },
+            
+            push(fileObj) {
+                this.queue.push(fileObj);
+                this.queue.sort((a, b) => a.file.size - b.file.size);
+                // Start on a microtask so files accepted together are sorted before any begins
+                queueMicrotask(() => this.pump());
+            },
+            
+            pump() {
+                while (this.active < UPLOAD_CONCURRENCY && this.queue.length > 0) {
+                    const fileObj = this.queue.shift();
+                    this.active += 1;
+                    this.run(fileObj).finally(() => {
+                        this.active -= 1;
+                        this.pump();
+                        this.updateSummary();
+                    });
+                }
+                this.updateSummary();
+            },
+            
+            async run(fileObj) {
+                try {
+                    await runUpload(fileObj, (fraction) => this.reportProgress(fileObj, fraction));
+                    this.reportProgress(fileObj, 1);
+                } catch (error) {
+                    fileObj.attempts += 1;
+                    if (isRetryableUploadError(error) && fileObj.attempts <= UPLOAD_MAX_RETRIES) {
+                        const delay = Math.min(1000 * 2 ** fileObj.attempts, 30000);
+                        console.warn(`Upload of ${fileObj.file.name} failed, retrying in ${delay / 1000}s:`, error);
+                        showUploadRetry(fileObj, delay);
+                        this.reportProgress(fileObj, 0);
+                        this.waiting += 1;
+                        setTimeout(() => {
+                            this.waiting -= 1;
+                            this.push(fileObj);
+                        }, delay);
+                    } else {
+                        abortUploadSession(fileObj);
+                        showUploadFailure(fileObj, error);
+                    }
+                }
+            },
+            
+            reportProgress(fileObj, fraction) {
+                fileObj.sentBytes = Math.round(fileObj.file.size * fraction);
+                this.updateSummary();
+            },
+            
+            updateSummary() {
+                const summary = document.getElementById('uploadQueueSummary');
+                if (!summary || this.startedAt === null) return;
+                
+                const totalBytes = this.files.reduce((sum, f) => sum + f.file.size, 0);
+                const sentBytes = this.files.reduce((sum, f) => sum + (f.sentBytes || 0), 0);
+                const seconds = (performance.now() - this.startedAt) / 1000;
+                const rate = seconds > 0 ? sentBytes / seconds : 0;
+                const done = this.files.filter(f => f.status === 'completed' || f.status === 'error').length;
+                const mbPerSecond = (rate / (1024 * 1024)).toFixed(1);
+                
+                summary.style.display = 'block';
+                if (this.active === 0 && this.waiting === 0 && this.queue.length === 0) {
+                    summary.textContent = `✅ ${done} of ${this.files.length} uploads finished · ` +
+                        `${formatFileSize(sentBytes)} in ${formatDuration(seconds)} (${mbPerSecond} MB/s)`;
+                    // The next accepted file starts a new queue measurement
+                    this.files = [];
+                    this.startedAt = null;
+                    return;
+                }
+                
+                const eta = rate > 0 ? formatDuration((totalBytes - sentBytes) / rate) : 'estimating…';
+                summary.textContent = `📤 Uploading ${this.active} · ${this.queue.length + this.waiting} queued · ` +
+                    `${done}/${this.files.length} done · ${mbPerSecond} MB/s · ETA ${eta}`;
+            }
+        };
+        
+        // Cancel the file's unfinished server session, if any, so its reserved vNN is freed
+        async function abortUploadSession(fileObj) {
+            const uploadSession = fileObj.uploadSession;
+            fileObj.uploadSession = null;
+            if (!uploadSession) return;
+            try {
+                await fetch('/api/upload/abort', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ upload_token: uploadSession.upload_token })
+                });
+            } catch (error) {
+                console.warn('Could not abort upload session:', error);
+            }
+        }
+        
+        // Auth, permission and missing-folder errors fail the same way on every attempt
+        function isRetryableUploadError(error) {
+            return !error.status || error.status >= 500 || [408, 410, 429].includes(error.status);
+        }
+        
+        function formatDuration(seconds) {
+            if (seconds < 60) return `${Math.ceil(seconds)}s`;
+            const minutes = Math.floor(seconds / 60);
+            return `${minutes}m ${Math.ceil(seconds % 60)}s`;
+        }
+        
+        // Upload one file, reporting byte-level progress; throws so the scheduler can retry
+        async function runUpload(fileObj, reportProgress) {
+            const fileId = fileObj.id;
+            fileObj.status = 'uploading';
+            
             // Update status immediately
             const statusElement = document.querySelector(`#file-${fileId} .file-status`);
             statusElement.className = 'file-status status-uploading';
@@ -1339,50 +1806,34 @@ HTML_TEMPLATE = """
                 `;
             }
             
-            // Simulate upload progress
-            let progress = 0;
-            const progressInterval = setInterval(() => {
-                progress += Math.random() * 15;
-                if (progress > 85) progress = 85;
-                
-                const progressFill = progressBar.querySelector('.upload-progress-fill');
-                if (progressFill) {
-                    progressFill.style.width = progress + '%';
-                }
-            }, 300);
+            // Simulated progress for proxied uploads, which report nothing until the server responds
+            let progressInterval = null;
+            if (UPLOAD_MODE === 'proxy') {
+                let progress = 0;
+                progressInterval = setInterval(() => {
+                    progress += Math.random() * 15;
+                    if (progress > 85) progress = 85;
+                    setUploadProgress(progressBar, progress / 100);
+                }, 300);
+            }
             
             try {
-                // Upload API call
-                const formData = new FormData();
-                formData.append('file', fileObj.file);
-                formData.append('analysis', JSON.stringify(fileObj.analysis));
-                
-                const response = await fetch('/api/upload/upload', {
-                    method: 'POST',
-                    body: formData
-                });
-                
-                // Check if response is JSON
-                const contentType = response.headers.get('content-type');
-                if (!contentType || !contentType.includes('application/json')) {
-                    const htmlText = await response.text();
-                    console.error('Non-JSON response:', htmlText);
-                    throw new Error('Server returned HTML instead of JSON. Please check authentication.');
-                }
-                
-                const result = await response.json();
-                
-                // Check if response indicates an error
-                if (!response.ok || result.status === 'error') {
-                    throw new Error(result.message || `HTTP ${response.status}: ${response.statusText}`);
+                const onProgress = (fraction) => {
+                    setUploadProgress(progressBar, fraction);
+                    reportProgress(fraction);
+                };
+                let result;
+                if (UPLOAD_MODE === 'direct') {
+                    result = await uploadDirectToDrive(fileObj, onProgress);
+                } else if (UPLOAD_MODE === 'chunked') {
+                    result = await uploadInChunksViaServer(fileObj, onProgress);
+                } else {
+                    result = await uploadViaServer(fileObj);
                 }
                 
                 // Complete progress
                 clearInterval(progressInterval);
-                const progressFill = progressBar.querySelector('.upload-progress-fill');
-                if (progressFill) {
-                    progressFill.style.width = '100%';
-                }
+                setUploadProgress(progressBar, 1);
                 
                 // Update status
                 statusElement.className = 'file-status status-completed';
@@ -1410,44 +1861,260 @@ HTML_TEMPLATE = """
                     `;
                 }
                 
-                // Hide action buttons after successful upload
-                const actionButtons = document.getElementById(`action-buttons-${fileId}`);
-                if (actionButtons) {
-                    actionButtons.style.display = 'none';
-                }
-                
                 // Update file object
-                if (fileObj) {
-                    fileObj.status = 'completed';
-                    fileObj.uploadResult = result;
-                }
+                fileObj.status = 'completed';
+                fileObj.uploadSession = null;
+                fileObj.uploadResult = result;
                 
             } catch (error) {
-                console.error('Upload error:', error);
-                
-                // Stop progress animation
+                // Stop progress animation; the scheduler decides between retry and failure
                 clearInterval(progressInterval);
-                
-                // Update status to error
-                statusElement.className = 'file-status status-error';
-                statusElement.textContent = 'Upload Failed';
-                
-                // Hide progress bar and show error message
-                if (progressBar) {
-                    progressBar.innerHTML = `
-                        <div style="color: var(--error-red); font-size: 12px; margin-top: 8px;">
-                            ❌ Upload failed: ${error.message}
-                        </div>
-                    `;
+                throw error;
+            }
+        }
+        
+        function showUploadRetry(fileObj, delay) {
+            const statusElement = document.querySelector(`#file-${fileObj.id} .file-status`);
+            statusElement.className = 'file-status status-warning';
+            statusElement.textContent = `Retrying in ${Math.round(delay / 1000)}s`;
+            fileObj.status = 'queued';
+        }
+        
+        function showUploadFailure(fileObj, error) {
+            const fileId = fileObj.id;
+            console.error('Upload error:', error);
+            fileObj.status = 'error';
+            
+            // Update status to error
+            const statusElement = document.querySelector(`#file-${fileId} .file-status`);
+            statusElement.className = 'file-status status-error';
+            statusElement.textContent = 'Upload Failed';
+            
+            // Hide progress bar and show error message
+            const progressBar = document.getElementById(`progress-${fileId}`);
+            if (progressBar) {
+                progressBar.innerHTML = `
+                    <div style="color: var(--error-red); font-size: 12px; margin-top: 8px;">
+                        ❌ Upload failed: ${error.message}
+                    </div>
+                `;
+            }
+            
+            // Restore action buttons so user can try again
+            const actionButtons = document.getElementById(`action-buttons-${fileId}`);
+            if (actionButtons) {
+                actionButtons.style.display = 'flex';
+            }
+            
+            alert(`Upload failed: ${error.message}`);
+        }
+        
+        // Upload through the app server (multipart POST to /api/upload/upload)
+        async function uploadViaServer(fileObj) {
+            const formData = new FormData();
+            formData.append('file', fileObj.file);
+            formData.append('analysis', JSON.stringify(fileObj.analysis));
+            
+            const response = await fetch('/api/upload/upload', {
+                method: 'POST',
+                body: formData
+            });
+            return readUploadResponse(response);
+        }
+        
+        // Upload straight to Drive: the server opens a resumable session, the browser PUTs the chunks
+        async function uploadDirectToDrive(fileObj, onProgress) {
+            return resumeOrStartUpload('/api/upload/session', fileObj, async (uploadSession, resume) => {
+                const driveFile = await sendDirectToDrive(fileObj.file, uploadSession, onProgress, resume);
+                const finalizeResponse = await fetch('/api/upload/finalize', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({
+                        upload_token: uploadSession.upload_token,
+                        file_id: driveFile.id
+                    })
+                });
+                return readUploadResponse(finalizeResponse);
+            });
+        }
+        
+        async function sendDirectToDrive(file, uploadSession, onProgress, resume) {
+            // Drive answers 308 with the acknowledged Range while incomplete, and the file JSON when done
+            const readDriveResponse = async (response, fallbackOffset) => {
+                if (response.status === 308) {
+                    const range = response.headers.get('Range');
+                    return { offset: range ? parseInt(range.split('-')[1], 10) + 1 : fallbackOffset };
                 }
-                
-                // Restore action buttons so user can try again
-                const actionButtons = document.getElementById(`action-buttons-${fileId}`);
-                if (actionButtons) {
-                    actionButtons.style.display = 'flex';
+                if (!response.ok) {
+                    const error = new Error(`Drive rejected upload chunk (HTTP ${response.status})`);
+                    error.status = response.status;
+                    throw error;
+                }
+                return { result: await response.json() };
+            };
+            
+            return sendChunksWithResume(file, uploadSession.chunk_size, onProgress,
+                async (offset, end) => readDriveResponse(await fetch(uploadSession.upload_url, {
+                    method: 'PUT',
+                    headers: {
+                        'Content-Range': file.size === 0 ? 'bytes */0' : `bytes ${offset}-${end - 1}/${file.size}`
+                    },
+                    body: file.slice(offset, end)
+                }), end),
+                async () => readDriveResponse(await fetch(uploadSession.upload_url, {
+                    method: 'PUT',
+                    headers: {
+                        'Content-Range': `bytes */${file.size}`
+                    }
+                }), 0),
+                resume
+            );
+        }
+        
+        // Upload in chunks relayed by the app server to the Drive session it holds
+        async function uploadInChunksViaServer(fileObj, onProgress) {
+            return resumeOrStartUpload('/api/upload/chunk/start', fileObj, (uploadSession, resume) =>
+                sendChunksViaServer(fileObj.file, uploadSession, onProgress, resume)
+            );
+        }
+        
+        async function sendChunksViaServer(file, uploadSession, onProgress, resume) {
+            // The server answers every chunk with the offset Drive confirmed, or the final upload result
+            const readChunkResponse = async (response) => {
+                const result = await readUploadResponse(response);
+                return result.status === 'incomplete' ? { offset: result.offset } : { result };
+            };
+            
+            return sendChunksWithResume(file, uploadSession.chunk_size, onProgress,
+                async (offset, end) => readChunkResponse(await fetch('/api/upload/chunk', {
+                    method: 'PUT',
+                    headers: {
+                        'X-Upload-Token': uploadSession.upload_token,
+                        'Content-Range': file.size === 0 ? 'bytes */0' : `bytes ${offset}-${end - 1}/${file.size}`
+                    },
+                    body: file.slice(offset, end)
+                })),
+                async () => readChunkResponse(await fetch(
+                    `/api/upload/chunk/status?upload_token=${encodeURIComponent(uploadSession.upload_token)}`
+                )),
+                resume
+            );
+        }
+        
+        // A retry reuses the session of the file's earlier attempt, so it resumes from the offset Drive
+        // acknowledged and keeps its reserved vNN. Only a session the server or Drive no longer knows
+        // (404/410) is abandoned, explicitly, for a new one.
+        async function resumeOrStartUpload(url, fileObj, upload) {
+            if (fileObj.uploadSession) {
+                try {
+                    return await upload(fileObj.uploadSession, true);
+                } catch (error) {
+                    if (![404, 410].includes(error.status)) {
+                        throw error;
+                    }
+                    console.warn(`Upload session for ${fileObj.file.name} is gone, starting a new one`);
+                    await abortUploadSession(fileObj);
+                }
+            }
+            return upload(await startUploadSession(url, fileObj), false);
+        }
+        
+        async function startUploadSession(url, fileObj) {
+            const response = await fetch(url, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    filename: fileObj.file.name,
+                    fileType: fileObj.file.type,
+                    fileSize: fileObj.file.size,
+                    analysis: fileObj.analysis
+                })
+            });
+            const uploadSession = await readUploadResponse(response);
+            fileObj.uploadSession = uploadSession;
+            return uploadSession;
+        }
+        
+        // Send file slices until sendChunk reports a result. After a failed chunk (network drop,
+        // server error) wait with exponential backoff, ask queryStatus for the acknowledged offset
+        // and continue from there, so completed chunks are never sent twice. With resume, the
+        // session is an earlier attempt's and sending starts from its acknowledged offset.
+        async function sendChunksWithResume(file, chunkSize, onProgress, sendChunk, queryStatus, resume = false) {
+            let offset = 0;
+            let failures = 0;
+            
+            if (resume) {
+                const outcome = await queryStatus();
+                if (outcome.result) {
+                    onProgress(1);
+                    return outcome.result;
+                }
+                offset = outcome.offset;
+                onProgress(file.size ? offset / file.size : 0);
+            }
+            
+            while (true) {
+                const end = Math.min(offset + chunkSize, file.size);
+                let outcome;
+                try {
+                    outcome = await sendChunk(offset, end);
+                    failures = 0;
+                } catch (error) {
+                    // A 4xx like 400, 403 or 409 fails the same way again; let the scheduler report it now
+                    if (error.status && !isRetryableUploadError(error)) {
+                        throw error;
+                    }
+                    failures += 1;
+                    if (failures > UPLOAD_MAX_RETRIES) {
+                        throw error;
+                    }
+                    console.warn(`Chunk at byte ${offset} failed (attempt ${failures}), resuming:`, error);
+                    await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** (failures - 1)));
+                    try {
+                        outcome = await queryStatus();
+                    } catch (statusError) {
+                        continue;
+                    }
                 }
                 
-                alert(`Upload failed: ${error.message}`);
+                if (outcome.result) {
+                    onProgress(1);
+                    return outcome.result;
+                }
+                offset = outcome.offset;
+                onProgress(file.size ? offset / file.size : 0);
+            }
+        }
+        
+        // Parse an upload API response, raising the server's message on failure
+        async function readUploadResponse(response) {
+            // Check if response is JSON
+            const contentType = response.headers.get('content-type');
+            if (!contentType || !contentType.includes('application/json')) {
+                const htmlText = await response.text();
+                console.error('Non-JSON response:', htmlText);
+                throw new Error('Server returned HTML instead of JSON. Please check authentication.');
+            }
+            
+            const result = await response.json();
+            
+            // Check if response indicates an error
+            if (!response.ok || result.status === 'error') {
+                const error = new Error(result.message || `HTTP ${response.status}: ${response.statusText}`);
+                error.status = response.status;
+                throw error;
+            }
+            return result;
+        }
+        
+        function setUploadProgress(progressBar, fraction) {
+            const progressFill = progressBar && progressBar.querySelector('.upload-progress-fill');
+            if (progressFill) {
+                progressFill.style.width = `${Math.round(fraction * 100)}%`;
             }
         }
         
@@ -1501,7 +2168,8 @@ def health_check():
                 "has_google_client_secret": bool(GOOGLE_CLIENT_SECRET),
                 "has_gemini_api_key": bool(GEMINI_API_KEY),
                 "has_marketing_hub_folder_id": bool(MARKETING_HUB_FOLDER_ID)
-            }
+            },
+            "naming_rules_cache": naming_rules_cache.stats()
         })
     except Exception as e:
         return jsonify({
@@ -1516,7 +2184,12 @@ def home():
     return render_template_string(HTML_TEMPLATE, 
                                 user_info=user_info,
                                 naming_convention_doc_id=NAMING_CONVENTION_DOC_ID,
-                                marketing_hub_folder_id=MARKETING_HUB_FOLDER_ID)
+                                marketing_hub_folder_id=MARKETING_HUB_FOLDER_ID,
+                                upload_mode=UPLOAD_MODE,
+                                upload_concurrency=UPLOAD_CONCURRENCY,
+                                duplicate_hash_max_bytes=DUPLICATE_HASH_MAX_BYTES,
+                                analysis_poll_interval_ms=ANALYSIS_POLL_INTERVAL_MS,
+                                analysis_progress_mode=ANALYSIS_PROGRESS_MODE)
 
 @app.route('/static/<path:filename>')
 def static_files(filename):
@@ -1557,7 +2230,7 @@ def auth_callback():
         'redirect_uri': redirect_uri
     }
     
-    token_response = requests.post(token_url, data=token_data)
+    token_response = google_http_transport.session.post(token_url, data=token_data, timeout=30)
     token_json = token_response.json()
     
     if 'access_token' not in token_json:
@@ -1565,7 +2238,7 @@ def auth_callback():
     
     # Get user info
     user_info_url = f"https://www.googleapis.com/oauth2/v2/userinfo?access_token={token_json['access_token']}"
-    user_response = requests.get(user_info_url)
+    user_response = google_http_transport.session.get(user_info_url, timeout=30)
     user_data = user_response.json()
     
     # Store user info and tokens in session
@@ -1602,7 +2275,22 @@ def api_status():
             "drive_integration": True,
             "naming_convention_reader": True,
             "folder_structure_mapping": True
-        }
+        },
+        "caches": {
+            "folder_tree": folder_tree_cache.stats(),
+            "gemini_results": analysis_result_cache.stats(),
+            "drive_clients": drive_client_pool.stats(),
+            "naming_rules": naming_rules_cache.stats(),
+            "folder_names": folder_name_index.stats(),
+            "hub_files": hub_file_index.stats()
+        },
+        "drive_changes": drive_change_feed.stats(),
+        "gemini_calls": gemini_runner.stats(),
+        "coalesced_calls": single_flight.stats(),
+        "gemini_circuit_breaker": gemini_runner.breaker.stats(),
+        "gemini_tiers": GeminiService.tier_stats(),
+        "analysis_jobs": analysis_job_stats(),
+        "transport": google_http_transport.stats()
     })
 
 @app.route('/api/config')
@@ -1612,9 +2300,58 @@ def api_config():
         "client_id": GOOGLE_CLIENT_ID,
         "marketing_hub_folder_id": MARKETING_HUB_FOLDER_ID,
         "naming_convention_doc_id": NAMING_CONVENTION_DOC_ID,
-        "gemini_enabled": gemini_service.is_available()
+        "gemini_enabled": gemini_service.is_available(),
+        "upload_mode": UPLOAD_MODE,
+        "upload_chunk_size": UPLOAD_CHUNK_SIZE,
+        "upload_concurrency": UPLOAD_CONCURRENCY,
+        "duplicate_hash_max_bytes": DUPLICATE_HASH_MAX_BYTES,
+        "analysis_poll_interval_ms": ANALYSIS_POLL_INTERVAL_MS,
+        "analysis_progress_mode": ANALYSIS_PROGRESS_MODE
     })
 
+def get_session_credentials():
+    """Build OAuth credentials from the session, refreshing an expired access token"""
+    access_token = session.get('access_token')
+    refresh_token = session.get('refresh_token')
+    credentials = None
+    
+    if access_token:
+        try:
+            # Create proper credentials with all OAuth data
+            credentials = Credentials(
+                token=access_token,
+                refresh_token=refresh_token,
+                token_uri='https://oauth2.googleapis.com/token',
+                client_id=GOOGLE_CLIENT_ID,
+                client_secret=GOOGLE_CLIENT_SECRET,
+                scopes=['https://www.googleapis.com/auth/drive']
+            )
+            
+            # Check if token needs refresh and refresh if necessary
+            if credentials.expired and credentials.refresh_token:
+                print("🔄 Access token expired, attempting refresh...")
+                try:
+                    credentials.refresh(google_http_transport.auth_request())
+                    # Update session with new token
+                    session['access_token'] = credentials.token
+                    print("✅ Token refreshed successfully")
+                except Exception as refresh_error:
+                    print(f"❌ Token refresh failed: {refresh_error}")
+                    # Clear invalid credentials but continue with fallback
+                    credentials = None
+                    session.pop('access_token', None)
+                    session.pop('refresh_token', None)
+                    print("⚠️ Continuing with fallback analysis due to auth failure")
+            
+            print(f"✅ Created credentials with token: {access_token[:20]}...")
+        except Exception as e:
+            print(f"❌ Error creating credentials: {e}")
+            credentials = None
+    else:
+        print("❌ No access token found in session")
+    
+    return credentials
+
 @app.route('/api/gemini/analyze', methods=['POST'])
 def gemini_analyze():
     """Analyze file using enhanced Gemini AI with naming convention and folder structure"""
@@ -1622,51 +2359,19 @@ def gemini_analyze():
     if not user_info:
         return jsonify({"error": "Not authenticated"}), 401
     
-    data = request.get_json()
+    data = request.get_json() or {}
     filename = data.get('filename', '')
     file_type = data.get('fileType', '')
-    file_size = data.get('fileSize', 0)
+    file_size = parse_file_size(data.get('fileSize', 0))
+    if file_size is None:
+        return jsonify({"error": "fileSize must be a non-negative integer"}), 400
+    file_md5 = parse_md5(data.get('md5'))
+    # Optional per-request workflow mode: 'standard' (two Gemini calls) or 'fused' (one)
+    workflow_mode = data.get('mode')
     
     try:
         # Initialize services with user credentials
-        access_token = session.get('access_token')
-        refresh_token = session.get('refresh_token')
-        credentials = None
-        
-        if access_token:
-            try:
-                # Create proper credentials with all OAuth data
-                credentials = Credentials(
-                    token=access_token,
-                    refresh_token=refresh_token,
-                    token_uri='https://oauth2.googleapis.com/token',
-                    client_id=GOOGLE_CLIENT_ID,
-                    client_secret=GOOGLE_CLIENT_SECRET,
-                    scopes=['https://www.googleapis.com/auth/drive']
-                )
-                
-                # Check if token needs refresh and refresh if necessary
-                if credentials.expired and credentials.refresh_token:
-                    print("🔄 Access token expired, attempting refresh...")
-                    try:
-                        credentials.refresh(Request())
-                        # Update session with new token
-                        session['access_token'] = credentials.token
-                        print("✅ Token refreshed successfully")
-                    except Exception as refresh_error:
-                        print(f"❌ Token refresh failed: {refresh_error}")
-                        # Clear invalid credentials but continue with fallback
-                        credentials = None
-                        session.pop('access_token', None)
-                        session.pop('refresh_token', None)
-                        print("⚠️ Continuing with fallback analysis due to auth failure")
-                
-                print(f"✅ Created credentials with token: {access_token[:20]}...")
-            except Exception as e:
-                print(f"❌ Error creating credentials: {e}")
-                credentials = None
-        else:
-            print("❌ No access token found in session")
+        credentials = get_session_credentials()
         
         drive_service = DriveService(credentials)
         naming_service = NamingConventionService(drive_service, NAMING_CONVENTION_DOC_ID)
@@ -1695,7 +2400,9 @@ def gemini_analyze():
             filename=filename,
             file_type=file_type,
             file_size=file_size,
-            marketing_hub_folder_id=MARKETING_HUB_FOLDER_ID
+            marketing_hub_folder_id=MARKETING_HUB_FOLDER_ID,
+            mode=workflow_mode,
+            file_md5=file_md5
         )
         
         # Add progress updates to result
@@ -1753,6 +2460,216 @@ def gemini_analyze():
                               <div class="suggested-name">📝 Suggested: <code>MA-GEN_{filename.split('.')[0] if '.' in filename else filename}_{current_date}_v01.{filename.split('.')[-1] if '.' in filename else 'pdf'}</code></div>'''
         })
 
+@app.route('/api/gemini/analyze/stream', methods=['POST'])
+def gemini_analyze_stream():
+    """Analyze a file and stream workflow progress as Server-Sent Events, ending with the result"""
+    user_info = session.get('user_info')
+    if not user_info:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    data = request.get_json() or {}
+    if parse_file_size(data.get('fileSize', 0)) is None:
+        return jsonify({"error": "fileSize must be a non-negative integer"}), 400
+    job = start_analysis_job(data)
+    
+    def generate():
+        delivered = 0
+        while True:
+            events, status = wait_for_analysis_job(job, delivered, SSE_KEEPALIVE_SECONDS)
+            if not events and status == 'running':
+                # Comment line keeps proxies from closing an idle stream during long Gemini calls
+                yield ": keep-alive\n\n"
+                continue
+            for payload in events:
+                yield format_sse('progress', payload)
+            delivered += len(events)
+            if status == 'done':
+                yield format_sse('result', job['result'])
+                break
+            if status == 'error':
+                yield format_sse('error', {"error": job['error']})
+                break
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/gemini/analyze/jobs', methods=['POST'])
+def gemini_analyze_job_start():
+    """Start analyzing a file and return at once; the browser polls the job instead of holding a request thread"""
+    user_info = session.get('user_info')
+    if not user_info:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    data = request.get_json() or {}
+    if parse_file_size(data.get('fileSize', 0)) is None:
+        return jsonify({"error": "fileSize must be a non-negative integer"}), 400
+    job = start_analysis_job(data)
+    return jsonify({"job_id": job['id'], "poll_interval_ms": ANALYSIS_POLL_INTERVAL_MS}), 202
+
+@app.route('/api/gemini/analyze/jobs/<job_id>')
+def gemini_analyze_job_status(job_id):
+    """Progress updates after ?after=N, plus the result or error once the job has finished"""
+    user_info = session.get('user_info')
+    if not user_info:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    with analysis_jobs_lock:
+        job = analysis_jobs.get(job_id)
+    if not job or job['owner'] != user_info.get('email'):
+        return jsonify({"error": "Unknown analysis job"}), 404
+    
+    after = max(0, request.args.get('after', 0, type=int))
+    with job['changed']:
+        payload = {
+            "job_id": job_id,
+            "status": job['status'],
+            "events": job['events'][after:],
+            "next": len(job['events'])
+        }
+        if job['status'] == 'done':
+            payload['result'] = job['result']
+        elif job['status'] == 'error':
+            payload['error'] = job['error']
+    return jsonify(payload)
+
+def start_analysis_job(data):
+    """Queue the analysis workflow for one file and return its job record
+    
+    Must be called inside the request: credentials and the owner come from the session, while
+    the workflow itself runs on analysis_job_executor. The caller has checked fileSize.
+    """
+    drive_service = DriveService(get_session_credentials())
+    naming_service = NamingConventionService(drive_service, NAMING_CONVENTION_DOC_ID)
+    workflow_orchestrator = IntelligentWorkflowOrchestrator(
+        gemini_service, drive_service, naming_service
+    )
+    workflow_kwargs = {
+        'filename': data.get('filename', ''),
+        'file_type': data.get('fileType', ''),
+        'file_size': parse_file_size(data.get('fileSize', 0)),
+        'marketing_hub_folder_id': MARKETING_HUB_FOLDER_ID,
+        # Optional per-request workflow mode: 'standard' (two Gemini calls) or 'fused' (one)
+        'mode': data.get('mode'),
+        'file_md5': parse_md5(data.get('md5'))
+    }
+    job = {
+        'id': secrets.token_urlsafe(16),
+        'owner': session['user_info'].get('email'),
+        'status': 'running',
+        'events': [],
+        'result': None,
+        'error': None,
+        'created_at': time.time(),
+        'finished_at': None,
+        'changed': threading.Condition()
+    }
+    
+    def progress_callback(step, progress, message):
+        """Record each progress update for pollers and wake any stream waiting on the job"""
+        with job['changed']:
+            job['events'].append({
+                'step': step,
+                'progress': progress,
+                'message': message,
+                'timestamp': datetime.now().isoformat()
+            })
+            job['changed'].notify_all()
+    
+    def run_workflow():
+        try:
+            outcome = {'status': 'done', 'result': workflow_orchestrator.execute_intelligent_workflow(**workflow_kwargs)}
+        except Exception as e:
+            print(f"Analysis job error: {e}")
+            outcome = {'status': 'error', 'error': f"Analysis failed: {str(e)}"}
+        with job['changed']:
+            job.update(outcome, finished_at=time.time())
+            job['changed'].notify_all()
+    
+    workflow_orchestrator.set_progress_callback(progress_callback)
+    now = time.time()
+    with analysis_jobs_lock:
+        for job_id in [job_id for job_id, existing in analysis_jobs.items()
+                       if existing['finished_at'] and now - existing['finished_at'] > ANALYSIS_JOB_TTL]:
+            del analysis_jobs[job_id]
+        analysis_jobs[job['id']] = job
+    analysis_job_executor.submit(run_workflow)
+    return job
+
+def wait_for_analysis_job(job, after, timeout):
+    """Block until the job has updates past index `after` or has finished; returns (new updates, status)"""
+    with job['changed']:
+        job['changed'].wait_for(lambda: len(job['events']) > after or job['status'] != 'running', timeout=timeout)
+        return job['events'][after:], job['status']
+
+def analysis_job_stats():
+    with analysis_jobs_lock:
+        jobs = list(analysis_jobs.values())
+    return {
+        'running': sum(1 for job in jobs if job['status'] == 'running'),
+        'retained': len(jobs),
+        'workers': ANALYSIS_JOB_WORKERS
+    }
+
+def parse_md5(value):
+    """Lower-case hex MD5 from the browser's hashing worker, or None if absent or malformed"""
+    if isinstance(value, str) and re.fullmatch(r'[0-9a-fA-F]{32}', value):
+        return value.lower()
+    return None
+
+def parse_file_size(value):
+    """File size in bytes from a JSON body, or None unless it is a non-negative integer"""
+    if isinstance(value, bool):
+        return None
+    try:
+        file_size = int(value)
+    except (TypeError, ValueError):
+        return None
+    if file_size < 0 or (file_size != value and not isinstance(value, str)):
+        return None
+    return file_size
+
+def format_sse(event, payload):
+    """Encode one Server-Sent Event with a JSON data line"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/api/gemini/analyze/batch', methods=['POST'])
+def gemini_analyze_batch():
+    """Analyze a multi-file drop with shared folder structure, naming rules and duplicate check"""
+    user_info = session.get('user_info')
+    if not user_info:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    data = request.get_json() or {}
+    files = [
+        {
+            'filename': item.get('filename', ''),
+            'file_type': item.get('fileType', ''),
+            'file_size': parse_file_size(item.get('fileSize', 0)),
+            'md5': parse_md5(item.get('md5'))
+        }
+        for item in data.get('files', [])
+    ]
+    if not files:
+        return jsonify({"error": "No files provided"}), 400
+    if any(file_info['file_size'] is None for file_info in files):
+        return jsonify({"error": "fileSize must be a non-negative integer"}), 400
+    
+    try:
+        drive_service = DriveService(get_session_credentials())
+        naming_service = NamingConventionService(drive_service, NAMING_CONVENTION_DOC_ID)
+        workflow_orchestrator = IntelligentWorkflowOrchestrator(
+            gemini_service, drive_service, naming_service
+        )
+        
+        batch_result = workflow_orchestrator.execute_batch_workflow(files, MARKETING_HUB_FOLDER_ID)
+        return jsonify(batch_result)
+        
+    except Exception as e:
+        print(f"Batch analysis error: {e}")
+        return jsonify({"error": f"Batch analysis failed: {str(e)}"}), 500
+
 @app.route('/api/upload/upload', methods=['POST'])
 def upload_file():
     """Enhanced file upload with real Google Drive integration"""
@@ -1813,7 +2730,7 @@ def upload_file():
                 if credentials.expired and credentials.refresh_token:
                     print("🔄 Access token expired, attempting refresh...")
                     try:
-                        credentials.refresh(Request())
+                        credentials.refresh(google_http_transport.auth_request())
                         # Update session with new token
                         session['access_token'] = credentials.token
                         print("✅ Token refreshed successfully")
@@ -1848,48 +2765,27 @@ def upload_file():
         
         # Try to upload to Google Drive (with comprehensive fallback)
         file_id = None
-        folder_path = "Marketing Hub → General → Uploads"  # Default fallback
+        folder_path = DEFAULT_UPLOAD_FOLDER_PATH  # Default fallback
         
         print(f"🔍 Drive service available: {drive_service.is_available() if drive_service else False}")
         
         if drive_service and drive_service.is_available():
             try:
-                # Debug: Print the analysis data to see what we're getting
-                print(f"🔍 DEBUG: Full analysis data: {analysis}")
-                
-                # Get the folder recommendation from analysis
-                folder_recommendation = analysis.get('folder_data', {})
-                print(f"🔍 DEBUG: Folder recommendation data: {folder_recommendation}")
-                
-                recommended_folder_path = folder_recommendation.get('recommended_folder', folder_path)
-                print(f"🔍 DEBUG: Recommended folder path: {recommended_folder_path}")
-                
-                # Ensure the folder path uses the correct format (→ arrows)
-                if '/' in recommended_folder_path and '→' not in recommended_folder_path:
-                    # Convert slash format to arrow format
-                    recommended_folder_path = recommended_folder_path.replace('/', ' → ')
-                    print(f"🔄 Converted folder path format: {recommended_folder_path}")
-                
                 # Find the actual folder ID for the recommended path
-                target_folder_id = find_folder_by_path(drive_service.service, recommended_folder_path, MARKETING_HUB_FOLDER_ID)
+                target_folder_id, folder_path = resolve_upload_folder(drive_service, analysis)
                 
-                if not target_folder_id:
-                    print(f"⚠️ Could not find folder for path: {recommended_folder_path}")
-                    print(f"⚠️ Trying fallback folder: {folder_path}")
-                    target_folder_id = find_folder_by_path(drive_service.service, folder_path, MARKETING_HUB_FOLDER_ID)
-                    
-                    if not target_folder_id:
-                        print(f"⚠️ Fallback folder also not found, using Marketing Hub root")
-                        target_folder_id = MARKETING_HUB_FOLDER_ID
-                        folder_path = "Marketing Hub"
-                    else:
-                        print(f"✅ Using fallback folder: {folder_path}")
-                else:
-                    folder_path = recommended_folder_path
-                    print(f"✅ Using recommended folder: {folder_path}")
+                # Next free vNN for this name in the target folder
+                suggested_filename, reservation = naming_service.allocate_filename(
+                    file.filename, analysis.get('analysis_data', {}), target_folder_id, MARKETING_HUB_FOLDER_ID
+                )
                 
                 # Upload file to the correct folder
-                file_id = upload_to_drive(drive_service.service, file, suggested_filename, target_folder_id)
+                try:
+                    file_id = upload_to_drive(drive_service.service, file, suggested_filename, target_folder_id)
+                except Exception:
+                    folder_name_index.release(reservation)
+                    raise
+                folder_name_index.confirm(reservation)
                 
                 print(f"✅ File uploaded to Google Drive: {file_id} in folder: {folder_path}")
                 
@@ -1920,22 +2816,9 @@ def upload_file():
         if file_id:
             # Real Google Drive upload successful
             print(f"🔍 DEBUG: Generating success response with folder_path: {folder_path}")
-            upload_response = {
-                "status": "success",
-                "message": "File uploaded successfully to Marketing Hub",
-                "file_id": file_id,
-                "file_link": f"https://drive.google.com/file/d/{file_id}/view",
-                "original_name": file.filename,
-                "final_name": suggested_filename,
-                "folder_path": folder_path,
-                "upload_time": datetime.now().isoformat(),
-                "file_url": f"https://drive.google.com/file/d/{file_id}/view",
-                "ai_engine": "Google Gemini 2.5 Pro",
-                "file_size": file_size,
-                "content_type": file.content_type,
-                "analysis_confidence": analysis.get('folder_data', {}).get('confidence', '85') + '%',
-                "naming_convention_applied": True
-            }
+            upload_response = build_upload_response(
+                file_id, file.filename, suggested_filename, folder_path, file_size, file.content_type, analysis
+            )
         else:
             # Fallback response (file not actually uploaded but processed)
             print("⚠️ Drive service not available - generating fallback response")
@@ -1978,24 +2861,485 @@ def upload_file():
         }), 500
 
 
+DEFAULT_UPLOAD_FOLDER_PATH = "Marketing Hub → General → Uploads"
+
+
+def resolve_upload_folder(drive_service, analysis):
+    """Resolve the analysis' recommended folder to (folder_id, folder_path), falling back to General → Uploads, then the hub root"""
+    # Debug: Print the analysis data to see what we're getting
+    print(f"🔍 DEBUG: Full analysis data: {analysis}")
+    
+    # Get the folder recommendation from analysis
+    folder_recommendation = analysis.get('folder_data', {})
+    print(f"🔍 DEBUG: Folder recommendation data: {folder_recommendation}")
+    
+    recommended_folder_path = folder_recommendation.get('recommended_folder', DEFAULT_UPLOAD_FOLDER_PATH)
+    print(f"🔍 DEBUG: Recommended folder path: {recommended_folder_path}")
+    
+    # Ensure the folder path uses the correct format (→ arrows)
+    if '/' in recommended_folder_path and '→' not in recommended_folder_path:
+        # Convert slash format to arrow format
+        recommended_folder_path = recommended_folder_path.replace('/', ' → ')
+        print(f"🔄 Converted folder path format: {recommended_folder_path}")
+    
+    target_folder_id = find_folder_by_path(drive_service.service, recommended_folder_path, MARKETING_HUB_FOLDER_ID)
+    if target_folder_id:
+        print(f"✅ Using recommended folder: {recommended_folder_path}")
+        return target_folder_id, recommended_folder_path
+    
+    print(f"⚠️ Could not find folder for path: {recommended_folder_path}")
+    print(f"⚠️ Trying fallback folder: {DEFAULT_UPLOAD_FOLDER_PATH}")
+    target_folder_id = find_folder_by_path(drive_service.service, DEFAULT_UPLOAD_FOLDER_PATH, MARKETING_HUB_FOLDER_ID)
+    if target_folder_id:
+        print(f"✅ Using fallback folder: {DEFAULT_UPLOAD_FOLDER_PATH}")
+        return target_folder_id, DEFAULT_UPLOAD_FOLDER_PATH
+    
+    print(f"⚠️ Fallback folder also not found, using Marketing Hub root")
+    return MARKETING_HUB_FOLDER_ID, "Marketing Hub"
+
+
+def build_upload_response(file_id, original_name, final_name, folder_path, file_size, content_type, analysis):
+    """Success payload for a file that now exists in Drive"""
+    return {
+        "status": "success",
+        "message": "File uploaded successfully to Marketing Hub",
+        "file_id": file_id,
+        "file_link": f"https://drive.google.com/file/d/{file_id}/view",
+        "original_name": original_name,
+        "final_name": final_name,
+        "folder_path": folder_path,
+        "upload_time": datetime.now().isoformat(),
+        "file_url": f"https://drive.google.com/file/d/{file_id}/view",
+        "ai_engine": "Google Gemini 2.5 Pro",
+        "file_size": file_size,
+        "content_type": content_type,
+        "analysis_confidence": str(analysis.get('folder_data', {}).get('confidence', '85')) + '%',
+        "naming_convention_applied": True
+    }
+
+
+def create_resumable_upload_session(credentials, metadata, content_type, file_size, origin=None):
+    """Start a Drive resumable upload and return the session URI the browser can PUT chunks to
+    
+    Passing the page's Origin makes Drive allow cross-origin PUTs to the session URI.
+    """
+    headers = {
+        'Authorization': f"Bearer {credentials.token}",
+        'Content-Type': 'application/json; charset=UTF-8',
+        'X-Upload-Content-Type': content_type or 'application/octet-stream',
+        'X-Upload-Content-Length': str(file_size)
+    }
+    if origin:
+        headers['Origin'] = origin
+    
+    response = google_http_transport.session.post(
+        DRIVE_UPLOAD_URL,
+        params={'uploadType': 'resumable', 'fields': 'id,name'},
+        headers=headers,
+        data=json.dumps(metadata),
+        timeout=30
+    )
+    if response.status_code == 403:
+        raise PermissionError("You don't have permission to upload files to the Marketing Hub folder. Please contact your administrator for access.")
+    if response.status_code == 404:
+        raise FileNotFoundError("The target folder was not found. The Marketing Hub folder may have been moved or deleted.")
+    response.raise_for_status()
+    
+    upload_url = response.headers.get('Location')
+    if not upload_url:
+        raise Exception("Drive did not return a resumable session URI")
+    return upload_url
+
+
+def store_pending_upload(details):
+    """Remember a browser-direct upload until it is finalized; returns its upload token"""
+    upload_token = secrets.token_urlsafe(16)
+    now = time.time()
+    with pending_uploads_lock:
+        for token in [token for token, pending in pending_uploads.items()
+                      if now - pending['created_at'] > UPLOAD_SESSION_TTL]:
+            expired = pending_uploads.pop(token)
+            if not expired.get('result'):
+                folder_name_index.release(expired.get('reservation'))
+        # The lock serializes chunk, status and finalize requests for this upload
+        pending_uploads[upload_token] = dict(details, created_at=now, lock=threading.Lock())
+    return upload_token
+
+
+@app.route('/api/upload/session', methods=['POST'])
+def create_upload_session():
+    """Create a Drive resumable upload session so the browser can send file bytes directly to Drive"""
+    return start_resumable_upload(relay=False)
+
+
+@app.route('/api/upload/chunk/start', methods=['POST'])
+def start_chunked_upload():
+    """Create a Drive resumable upload session that the browser fills through /api/upload/chunk"""
+    return start_resumable_upload(relay=True)
+
+
+def start_resumable_upload(relay):
+    """Resolve folder and filename, open the Drive session and register the pending upload
+    
+    In relay mode the session URI stays on the server and chunks are forwarded by /api/upload/chunk;
+    otherwise it is handed to the browser.
+    """
+    if not session.get('user_info') and not session.get('access_token'):
+        return jsonify({"status": "error", "message": "Not authenticated - please log in again"}), 401
+    
+    data = request.get_json() or {}
+    original_name = data.get('filename', '')
+    content_type = data.get('fileType') or 'application/octet-stream'
+    file_size = parse_file_size(data.get('fileSize', 0))
+    analysis = data.get('analysis') or {}
+    if not original_name:
+        return jsonify({"status": "error", "message": "No filename provided"}), 400
+    if file_size is None:
+        return jsonify({"status": "error", "message": "fileSize must be a non-negative integer"}), 400
+    
+    credentials = get_session_credentials()
+    if not credentials:
+        return jsonify({
+            "status": "error",
+            "message": "Authentication expired. Please log in again.",
+            "error_type": "auth_expired"
+        }), 401
+    
+    try:
+        drive_service = DriveService(credentials)
+        naming_service = NamingConventionService(drive_service, NAMING_CONVENTION_DOC_ID)
+        target_folder_id, folder_path = resolve_upload_folder(drive_service, analysis)
+        final_name, reservation = naming_service.allocate_filename(
+            original_name, analysis.get('analysis_data', {}), target_folder_id, MARKETING_HUB_FOLDER_ID
+        )
+        
+        try:
+            upload_url = create_resumable_upload_session(
+                credentials,
+                {'name': final_name, 'parents': [target_folder_id]},
+                content_type,
+                file_size,
+                origin=None if relay else request.headers.get('Origin') or request.host_url.rstrip('/')
+            )
+        except Exception:
+            folder_name_index.release(reservation)
+            raise
+        print(f"📤 Resumable upload session created for {final_name} in {folder_path}")
+        
+        upload_token = store_pending_upload({
+            'original_name': original_name,
+            'final_name': final_name,
+            'folder_id': target_folder_id,
+            'folder_path': folder_path,
+            'file_size': file_size,
+            'content_type': content_type,
+            'analysis': analysis,
+            'upload_url': upload_url,
+            'reservation': reservation,
+            'owner': upload_owner(),
+            'received': 0,
+            'result': None
+        })
+        upload_session = {
+            "status": "success",
+            "upload_token": upload_token,
+            "chunk_size": UPLOAD_CHUNK_SIZE,
+            "final_name": final_name,
+            "folder_path": folder_path
+        }
+        if not relay:
+            upload_session["upload_url"] = upload_url
+        return jsonify(upload_session)
+        
+    except PermissionError as pe:
+        return jsonify({
+            "status": "error",
+            "message": str(pe),
+            "error_type": "permission_denied",
+            "suggested_action": "Contact your administrator to request access to the Marketing Hub folder"
+        }), 403
+    except FileNotFoundError as fe:
+        return jsonify({
+            "status": "error",
+            "message": str(fe),
+            "error_type": "folder_not_found",
+            "suggested_action": "Contact your administrator - the Marketing Hub folder may have been moved"
+        }), 404
+    except Exception as e:
+        print(f"❌ Upload session error: {e}")
+        return jsonify({"status": "error", "message": f"Could not start upload: {str(e)}"}), 500
+
+
+@app.route('/api/upload/finalize', methods=['POST'])
+def finalize_upload():
+    """Record a browser-direct upload once Drive has accepted the last chunk"""
+    if not session.get('user_info') and not session.get('access_token'):
+        return jsonify({"status": "error", "message": "Not authenticated - please log in again"}), 401
+    
+    data = request.get_json() or {}
+    file_id = data.get('file_id')
+    upload_token = data.get('upload_token', '')
+    pending = get_pending_upload(upload_token)
+    if not pending or not file_id:
+        return jsonify({"status": "error", "message": "Unknown or expired upload session"}), 404
+    
+    # The entry stays until it expires, so a finalize that fails transiently, or whose response was
+    # lost, can be retried and gets the same result
+    with pending['lock']:
+        if pending['result']:
+            return jsonify(pending['result'])
+        try:
+            # Confirm Drive really has the file where the session said it would go
+            drive_service = DriveService(get_session_credentials())
+            if drive_service.is_available():
+                uploaded = drive_service.get_thread_service().files().get(
+                    fileId=file_id, fields='id,name,parents,size'
+                ).execute()
+                if pending['folder_id'] not in uploaded.get('parents', []):
+                    discard_pending_upload(upload_token)
+                    return jsonify({"status": "error", "message": "Uploaded file is not in the expected folder"}), 409
+        
+        except HttpError as e:
+            if e.resp.status == 404:
+                discard_pending_upload(upload_token)
+                return jsonify({"status": "error", "message": "Uploaded file was not found in Drive"}), 404
+            print(f"❌ Upload finalize error: {e}")
+            return jsonify({"status": "error", "message": f"Could not confirm upload: {str(e)}"}), 502
+        except Exception as e:
+            print(f"❌ Upload finalize error: {e}")
+            return jsonify({"status": "error", "message": f"Could not confirm upload: {str(e)}"}), 502
+        
+        folder_name_index.confirm(pending.get('reservation'))
+        pending['result'] = build_upload_response(
+            file_id, pending['original_name'], pending['final_name'], pending['folder_path'],
+            pending['file_size'], pending['content_type'], pending['analysis']
+        )
+        print(f"✅ File uploaded to Google Drive: {file_id} in folder: {pending['folder_path']}")
+        return jsonify(pending['result'])
+
+
+@app.route('/api/upload/abort', methods=['POST'])
+def abort_upload():
+    """Cancel a pending upload the browser has given up on: end its Drive session and free its vNN"""
+    if not session.get('user_info') and not session.get('access_token'):
+        return jsonify({"status": "error", "message": "Not authenticated - please log in again"}), 401
+    
+    upload_token = (request.get_json() or {}).get('upload_token', '')
+    pending = get_pending_upload(upload_token)
+    if not pending:
+        return jsonify({"status": "error", "message": "Unknown or expired upload session"}), 404
+    
+    # Wait for a chunk relay or finalize in progress, so the upload isn't completed behind our back
+    with pending['lock']:
+        if pending['result']:
+            return jsonify({"status": "error", "message": "Upload already completed"}), 409
+        discard_pending_upload(upload_token)
+        try:
+            # Drive cancels a resumable session on DELETE; a session left alone just expires
+            google_http_transport.session.delete(pending['upload_url'], timeout=30)
+        except requests.RequestException as cancel_error:
+            print(f"⚠️ Could not cancel Drive upload session: {cancel_error}")
+    
+    print(f"🗑️ Upload aborted: {pending['final_name']} (version released)")
+    return jsonify({"status": "aborted", "final_name": pending['final_name']})
+
+
+@app.route('/api/upload/chunk', methods=['PUT'])
+def upload_chunk():
+    """Relay one Content-Range chunk of a pending upload to its Drive resumable session
+    
+    Responds with the offset Drive has confirmed, so the browser always continues from there;
+    the final chunk returns the same payload as /api/upload/upload.
+    """
+    if not session.get('user_info') and not session.get('access_token'):
+        return jsonify({"status": "error", "message": "Not authenticated - please log in again"}), 401
+    
+    upload_token = request.headers.get('X-Upload-Token', '')
+    pending = get_pending_upload(upload_token)
+    if not pending:
+        return jsonify({"status": "error", "message": "Unknown or expired upload session"}), 404
+    
+    start, end, total = parse_content_range(request.headers.get('Content-Range', ''))
+    if total is None:
+        return jsonify({"status": "error", "message": "Missing or invalid Content-Range header"}), 400
+    if total != pending['file_size']:
+        return jsonify({
+            "status": "error",
+            "message": f"Content-Range total {total} does not match the declared file size {pending['file_size']}"
+        }), 400
+    if start is not None and not start <= end < total:
+        return jsonify({
+            "status": "error",
+            "message": "Content-Range is outside the file",
+            "offset": pending['received']
+        }), 416
+    
+    # Chunks are buffered whole, so refuse anything larger than UPLOAD_CHUNK_SIZE before reading it
+    oversized = end is not None and end - start + 1 > UPLOAD_CHUNK_SIZE
+    if start is not None and (oversized or (request.content_length or 0) > UPLOAD_CHUNK_SIZE):
+        return jsonify({
+            "status": "error",
+            "message": f"Chunks may be at most {UPLOAD_CHUNK_SIZE} bytes",
+            "offset": pending['received']
+        }), 413
+    chunk = request.get_data(cache=False) if start is not None else b''
+    
+    # A second request for the same token waits here, then sees the offset the first one left
+    with pending['lock']:
+        if pending['result']:
+            # Final chunk was retried after Drive had already completed the file
+            return jsonify(pending['result'])
+        if start is None:
+            return relay_upload_status(upload_token, pending)
+        return relay_upload_chunk(upload_token, pending, chunk, start, end, total)
+
+
+def relay_upload_chunk(upload_token, pending, chunk, start, end, total):
+    """Forward one checked chunk to Drive; the caller holds the upload's lock"""
+    if len(chunk) != end - start + 1:
+        print(f"⚠️ Incomplete chunk for {pending['final_name']}: got {len(chunk)} of {end - start + 1} bytes")
+        return jsonify({
+            "status": "error",
+            "message": "Chunk was cut off in transit",
+            "offset": pending['received']
+        }), 400
+    if start != pending['received']:
+        return jsonify({
+            "status": "error",
+            "message": "Chunk does not start at the resume offset",
+            "offset": pending['received']
+        }), 409
+    
+    try:
+        response = google_http_transport.session.put(
+            pending['upload_url'],
+            data=chunk,
+            headers={'Content-Range': f"bytes {start}-{end}/{total}"},
+            timeout=UPLOAD_RELAY_TIMEOUT
+        )
+    except requests.RequestException as relay_error:
+        # Drive may have kept part of the chunk; ask it where to resume
+        print(f"⚠️ Chunk relay to Drive failed at offset {start}: {relay_error}")
+        return relay_upload_status(upload_token, pending)
+    
+    return record_drive_upload_response(upload_token, pending, response)
+
+
+@app.route('/api/upload/chunk/status')
+def upload_chunk_status():
+    """Report the byte offset Drive has confirmed for a pending upload, so the browser can resume"""
+    if not session.get('user_info') and not session.get('access_token'):
+        return jsonify({"status": "error", "message": "Not authenticated - please log in again"}), 401
+    
+    upload_token = request.args.get('upload_token', '')
+    pending = get_pending_upload(upload_token)
+    if not pending:
+        return jsonify({"status": "error", "message": "Unknown or expired upload session"}), 404
+    with pending['lock']:
+        if pending['result']:
+            return jsonify(pending['result'])
+        return relay_upload_status(upload_token, pending)
+
+
+def upload_owner():
+    """Who is asking, for matching uploads to the user that started them"""
+    return (session.get('user_info') or {}).get('email')
+
+
+def get_pending_upload(upload_token):
+    """The pending upload for this token if the current user started it, else None"""
+    with pending_uploads_lock:
+        pending = pending_uploads.get(upload_token)
+    if pending and pending.get('owner') != upload_owner():
+        return None
+    return pending
+
+
+def discard_pending_upload(upload_token):
+    """Forget an upload that can no longer complete and give back its reserved vNN"""
+    with pending_uploads_lock:
+        pending = pending_uploads.pop(upload_token, None)
+    if pending and not pending['result']:
+        folder_name_index.release(pending.get('reservation'))
+    return pending
+
+
+def parse_content_range(header):
+    """Parse 'bytes start-end/total' or 'bytes */total' into (start, end, total)"""
+    match = re.match(r"bytes (?:(\d+)-(\d+)|\*)/(\d+)$", header.strip())
+    if not match:
+        return None, None, None
+    start, end, total = match.groups()
+    if start is None:
+        return None, None, int(total)
+    return int(start), int(end), int(total)
+
+
+def relay_upload_status(upload_token, pending):
+    """Ask Drive how many bytes of the session it has (an empty PUT with 'bytes */total')"""
+    try:
+        response = google_http_transport.session.put(
+            pending['upload_url'],
+            data=b'',
+            headers={'Content-Range': f"bytes */{pending['file_size']}"},
+            timeout=UPLOAD_RELAY_TIMEOUT
+        )
+    except requests.RequestException as status_error:
+        print(f"❌ Upload status query failed: {status_error}")
+        return jsonify({"status": "error", "message": "Drive is unreachable, retry shortly"}), 502
+    return record_drive_upload_response(upload_token, pending, response)
+
+
+def record_drive_upload_response(upload_token, pending, response):
+    """Turn Drive's answer to a chunk or status PUT into the browser's resume offset or final result"""
+    if response.status_code == 308:
+        # Resume incomplete; Range is absent until Drive has stored the first bytes
+        byte_range = response.headers.get('Range')
+        pending['received'] = int(byte_range.split('-')[1]) + 1 if byte_range else 0
+        return jsonify({"status": "incomplete", "offset": pending['received']})
+    
+    if response.status_code in (200, 201):
+        file_id = response.json().get('id')
+        pending['received'] = pending['file_size']
+        folder_name_index.confirm(pending.get('reservation'))
+        pending['result'] = build_upload_response(
+            file_id, pending['original_name'], pending['final_name'], pending['folder_path'],
+            pending['file_size'], pending['content_type'], pending['analysis']
+        )
+        print(f"✅ File uploaded to Google Drive: {file_id} in folder: {pending['folder_path']}")
+        return jsonify(pending['result'])
+    
+    if response.status_code == 404:
+        # Drive sessions expire after a week; the browser has to start over
+        discard_pending_upload(upload_token)
+        return jsonify({"status": "error", "message": "Drive upload session expired, please upload again"}), 410
+    
+    print(f"❌ Drive rejected upload chunk: HTTP {response.status_code}")
+    return jsonify({
+        "status": "error",
+        "message": f"Drive rejected upload chunk (HTTP {response.status_code})",
+        "offset": pending['received']
+    }), 502
+
+
 def find_folder_by_path(drive_service, folder_path, root_folder_id):
     """Find folder ID by path like 'Marketing Hub → 01_Brand Assets → Company Profiles'"""
     try:
-        # Parse the folder path
-        if '→' not in folder_path:
-            return root_folder_id
+        # Resolve against the folder tree the analyze step already crawled (no network calls)
+        cached_folder_id = folder_tree_cache.resolve_path(root_folder_id, folder_path)
+        if cached_folder_id:
+            print(f"⚡ Resolved folder path from cached index: '{folder_path}' -> {cached_folder_id}")
+            return cached_folder_id
         
         # Split path and remove 'Marketing Hub' prefix
-        path_parts = [part.strip() for part in folder_path.split('→')]
-        if path_parts[0] == 'Marketing Hub':
-            path_parts = path_parts[1:]  # Remove 'Marketing Hub' prefix
+        path_parts = FolderPathIndex.split_path(folder_path)
         
         if not path_parts:
             return root_folder_id
         
         current_folder_id = root_folder_id
         
-        # Navigate through each folder level
+        # Cache miss: navigate through each folder level on Drive
         for folder_name in path_parts:
             print(f"🔍 Looking for folder: '{folder_name}' in {current_folder_id}")
             
@@ -2025,8 +3369,12 @@ def find_folder_by_path(drive_service, folder_path, root_folder_id):
         return None
 
 
-def upload_to_drive(drive_service, file, filename, parent_folder_id):
-    """Upload file to Google Drive and return file ID"""
+def upload_to_drive(drive_service, file, filename, parent_folder_id, chunk_size=None):
+    """Upload file to Google Drive in resumable chunks and return file ID
+    
+    The request stream (Werkzeug's spooled temp file) is handed straight to the uploader, so only
+    one chunk of the file is held in memory at a time regardless of file size.
+    """
     try:
         # Create file metadata
         file_metadata = {
@@ -2037,25 +3385,27 @@ def upload_to_drive(drive_service, file, filename, parent_folder_id):
         # Create media upload
         from googleapiclient.http import MediaIoBaseUpload
         from googleapiclient.errors import HttpError
-        import io
-        
-        # Read file content
-        file_content = file.read()
-        file.seek(0)  # Reset file pointer
         
-        # Create media upload object
+        file.stream.seek(0)
         media = MediaIoBaseUpload(
-            io.BytesIO(file_content),
-            mimetype=file.content_type,
+            file.stream,
+            mimetype=file.content_type or 'application/octet-stream',
+            chunksize=chunk_size or UPLOAD_CHUNK_SIZE,
             resumable=True
         )
         
-        # Upload file
-        uploaded_file = drive_service.files().create(
+        # Upload file chunk by chunk
+        upload_request = drive_service.files().create(
             body=file_metadata,
             media_body=media,
             fields='id'
-        ).execute()
+        )
+        uploaded_file = None
+        while uploaded_file is None:
+            status, uploaded_file = upload_request.next_chunk()
+            if status:
+                print(f"📤 Uploaded {status.resumable_progress / (1024 * 1024):.0f} MB "
+                      f"({int(status.progress() * 100)}%) of {filename}")
         
         return uploaded_file.get('id')
         
@@ -7,17 +7,95 @@ Implements 3-step intelligent workflow:
 """
 
 import os
+import copy
+import asyncio
+import functools
 import json
+import time
+import random
+import socket
+import sqlite3
+import hashlib
+import weakref
+import threading
+import httplib2
 import requests
+import google_auth_httplib2
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from datetime import datetime
 import google.generativeai as genai
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request as AuthRequest
+import inspect
 import re
 
 class GeminiService:
     """Handle Gemini AI integration for file analysis and folder recommendations"""
-    
+
+    # Values used when Gemini omits a field
+    CONTENT_ANALYSIS_DEFAULTS = {
+        'document_type': 'Business Document',
+        'content_category': 'GENERAL',
+        'product_line': 'MA',
+        'industry': 'General',
+        'target_audience': 'Business Team',
+        'business_impact': 'Medium',
+        'technical_complexity': 'Intermediate',
+        'content_description': 'Business document for organizational use',
+        'confidence_score': '95'
+    }
+    FOLDER_RECOMMENDATION_DEFAULTS = {
+        'recommended_folder': "Marketing Hub → General → Uploads",
+        'reasoning': "Default recommendation based on content analysis",
+        'confidence': "85"
+    }
+
+    # Multi-file drops: files per grouped prompt, and grouped prompts in flight at once per drop
+    BATCH_GROUP_SIZE = int(os.environ.get('GEMINI_BATCH_GROUP_SIZE', '5'))
+    BATCH_CONCURRENCY = int(os.environ.get('GEMINI_BATCH_CONCURRENCY', '3'))
+
+    # Model cascade, cheapest tier first. 'rules' answers from filename patterns without a model
+    # call; any other entry is a Gemini model name. A tier's answer is kept when its confidence
+    # reaches CASCADE_MIN_CONFIDENCE and its folder exists in the hub, otherwise the next tier is asked
+    PRO_MODEL = 'gemini-2.5-pro'
+    RULES_TIER = 'rules'
+    DEFAULT_MODEL_TIERS = f"{RULES_TIER},gemini-2.5-flash,{PRO_MODEL}"
+    CASCADE_MIN_CONFIDENCE = int(os.environ.get('GEMINI_CASCADE_MIN_CONFIDENCE', '80'))
+    # [(tier name, model or None for the rules tier)]; None sends every call to self.model
+    model_tiers = None
+
+    # Filename keywords for the rules tier: (keywords, document type, content category)
+    RULES_DOCUMENT_TYPES = (
+        (('manual', 'user guide', 'datasheet', 'data sheet', 'specification', 'technical', 'whitepaper'),
+         'Technical Manual', 'TECH'),
+        (('brochure', 'flyer', 'leaflet', 'catalogue', 'catalog'), 'Product Brochure', 'MARK'),
+        (('company profile', 'corporate profile', 'profile'), 'Corporate Profile', 'BRAND'),
+        (('logo', 'brand guide', 'brand guidelines', 'style guide'), 'Brand Asset', 'BRAND'),
+        (('sales deck', 'pitch', 'presentation', 'proposal'), 'Sales Presentation', 'SALES'),
+    )
+    RULES_PRODUCT_LINES = (
+        (('spectra',), 'SP'),
+        (('bharat',), 'BS'),
+        (('dmo', 'software platform'), 'DMO'),
+    )
+    RULES_INDUSTRIES = (
+        (('mining', 'quarry'), 'Mining'),
+        (('agriculture', 'agri', 'crop', 'farm'), 'Agriculture'),
+        (('solar', 'renewable'), 'Solar/Renewable Energy'),
+        (('infrastructure', 'highway', 'railway', 'construction'), 'Infrastructure'),
+        (('security', 'surveillance'), 'Security'),
+    )
+    RULES_AUDIENCES = {'TECH': 'Engineers', 'MARK': 'Customers', 'BRAND': 'Marketing', 'SALES': 'Sales Team'}
+
+    # Which tier answered, across every GeminiService in the process
+    _tier_stats_lock = threading.Lock()
+    _tier_stats = {'answered_by': {}, 'escalations': 0}
+
     def __init__(self, api_key=None):
         self.api_key = api_key or os.environ.get('GEMINI_API_KEY')
         self.model = None
@@ -25,11 +103,27 @@ class GeminiService:
         if self.api_key:
             try:
                 genai.configure(api_key=self.api_key)
-                self.model = genai.GenerativeModel('gemini-2.5-pro')
+                self.model = genai.GenerativeModel(self.PRO_MODEL)
                 print("✅ Gemini 2.5 Pro initialized successfully")
+                self.model_tiers = self._build_model_tiers(
+                    os.environ.get('GEMINI_MODEL_TIERS', self.DEFAULT_MODEL_TIERS)
+                )
+                print(f"✅ Gemini cascade: {' → '.join(tier for tier, _ in self.model_tiers)}")
             except Exception as e:
                 print(f"❌ Gemini initialization error: {e}")
                 self.model = None
+
+    def _build_model_tiers(self, tier_names):
+        """Parse 'rules,gemini-2.5-flash,gemini-2.5-pro' into (tier, model) pairs, reusing self.model for pro"""
+        tiers = []
+        for name in (part.strip() for part in tier_names.split(',')):
+            if name == self.RULES_TIER:
+                tiers.append((name, None))
+            elif name == self.PRO_MODEL:
+                tiers.append((name, self.model))
+            elif name:
+                tiers.append((name, genai.GenerativeModel(name)))
+        return tiers or None
     
     def is_available(self):
         """Check if Gemini API is available"""
@@ -40,68 +134,522 @@ class GeminiService:
             print("❌ Gemini API Available: False - API key or model initialization failed")
         return available
     
-    def analyze_file_content(self, filename, file_type, file_size, naming_convention_rules=None):
+    def analyze_file_content(self, filename, file_type, file_size, naming_convention_rules=None, rules_version=None):
         """Step 1: Analyze file content using Gemini AI"""
         if not self.is_available():
             print("❌ Step 1: Gemini not available, using fallback content analysis")
             return self._fallback_content_analysis(filename, file_type, file_size)
         
-        try:
-            print(f"🧠 Step 1: Gemini analyzing file content: {filename}")
-            
-            # Create content analysis prompt
-            prompt = self._create_content_analysis_prompt(filename, file_type, file_size, naming_convention_rules)
-            
-            # Call Gemini API for content analysis
-            response = self.model.generate_content(prompt)
-            
-            if not response or not response.text:
-                raise Exception("Empty response from Gemini API")
-            
-            analysis_text = response.text
-            
-            # Parse and structure the response
-            analysis_data = self._parse_content_analysis(analysis_text, filename, file_type)
-            print(f"✅ Step 1 Complete: Content analysis with {analysis_data.get('confidence_score', '95')}% confidence")
-            
+        cache_key = analysis_result_cache.make_key(
+            'analysis', filename, file_type, self._size_bucket(file_size),
+            rules_version or self._content_hash(naming_convention_rules)
+        )
+        cached = analysis_result_cache.get(cache_key)
+        if cached:
+            print(f"⚡ Step 1: Using cached content analysis for: {filename}")
+            return cached
+        
+        def analyze():
+            analysis_data = self._cascade(
+                "Step 1",
+                lambda: self._rules_content_analysis(filename, file_type),
+                lambda model: self._model_content_analysis(model, filename, file_type, file_size, naming_convention_rules),
+                self._analysis_escalation_reason
+            )
+            if self._worth_caching(analysis_data):
+                analysis_result_cache.put(cache_key, analysis_data)
             return analysis_data
+        
+        try:
+            # Identical requests in flight at the same time share one Gemini call
+            return copy.deepcopy(single_flight.do('gemini', cache_key, analyze))
             
         except Exception as e:
             print(f"❌ Step 1 Error: Gemini content analysis failed: {e}")
             print(f"   Error details: {str(e)}")
             return self._fallback_content_analysis(filename, file_type, file_size)
+
+    def _model_content_analysis(self, model, filename, file_type, file_size, naming_convention_rules):
+        print(f"🧠 Step 1: Gemini analyzing file content: {filename}")
+        
+        # Create content analysis prompt
+        prompt = self._create_content_analysis_prompt(filename, file_type, file_size, naming_convention_rules)
+        
+        # Call Gemini API for content analysis
+        response = self._generate(prompt, model=model)
+        
+        if not response or not response.text:
+            raise Exception("Empty response from Gemini API")
+        
+        analysis_text = response.text
+        
+        # Parse and structure the response
+        analysis_data = self._parse_content_analysis(analysis_text, filename, file_type)
+        print(f"✅ Step 1 Complete: Content analysis with {analysis_data.get('confidence_score', '95')}% confidence")
+        return analysis_data
     
-    def recommend_folder_with_structure(self, filename, content_analysis, folder_structure):
-        """Step 3: Use Gemini to recommend folder based on content analysis + real folder structure"""
+    def recommend_folder_with_structure(self, filename, content_analysis, folder_structure, path_index=None):
+        """Step 3: Use Gemini to recommend folder based on content analysis + real folder structure
+        
+        path_index (the hub's FolderPathIndex) lets the cascade escalate recommendations of folders
+        that do not exist.
+        """
         if not self.is_available():
             print("❌ Step 3: Gemini not available, using fallback folder recommendation")
             return self._fallback_folder_recommendation(filename, content_analysis)
         
-        try:
-            print(f"🎯 Step 3: Gemini recommending folder for: {filename}")
-            
-            # Create folder recommendation prompt with real structure
-            prompt = self._create_folder_recommendation_prompt(filename, content_analysis, folder_structure)
-            
-            # Call Gemini API for intelligent folder recommendation
-            response = self.model.generate_content(prompt)
-            
-            if not response or not response.text:
-                raise Exception("Empty response from Gemini API")
-            
-            recommendation_text = response.text
-            
-            # Parse the folder recommendation
-            folder_recommendation = self._parse_folder_recommendation(recommendation_text)
-            print(f"✅ Step 3 Complete: Intelligent folder recommendation generated")
-            
+        cache_key = analysis_result_cache.make_key(
+            'recommendation', filename, content_analysis, self._content_hash(folder_structure)
+        )
+        cached = analysis_result_cache.get(cache_key)
+        if cached:
+            print(f"⚡ Step 3: Using cached folder recommendation for: {filename}")
+            return cached
+        
+        def recommend():
+            folder_recommendation = self._cascade(
+                "Step 3",
+                lambda: self._rules_folder_recommendation(filename, content_analysis),
+                lambda model: self._model_folder_recommendation(model, filename, content_analysis, folder_structure),
+                lambda recommendation: self._recommendation_escalation_reason(recommendation, path_index)
+            )
+            if self._worth_caching(folder_recommendation):
+                analysis_result_cache.put(cache_key, folder_recommendation)
             return folder_recommendation
+        
+        try:
+            return copy.deepcopy(single_flight.do('gemini', cache_key, recommend))
             
         except Exception as e:
             print(f"❌ Step 3 Error: Gemini folder recommendation failed: {e}")
             print(f"   Error details: {str(e)}")
             return self._fallback_folder_recommendation(filename, content_analysis)
+
+    def _model_folder_recommendation(self, model, filename, content_analysis, folder_structure):
+        print(f"🎯 Step 3: Gemini recommending folder for: {filename}")
+        
+        # Create folder recommendation prompt with real structure
+        prompt = self._create_folder_recommendation_prompt(filename, content_analysis, folder_structure)
+        
+        # Call Gemini API for intelligent folder recommendation
+        response = self._generate(prompt, model=model)
+        
+        if not response or not response.text:
+            raise Exception("Empty response from Gemini API")
+        
+        recommendation_text = response.text
+        
+        # Parse the folder recommendation
+        folder_recommendation = self._parse_folder_recommendation(recommendation_text)
+        print(f"✅ Step 3 Complete: Intelligent folder recommendation generated")
+        return folder_recommendation
+    
+    def analyze_and_recommend(self, filename, file_type, file_size, naming_convention_rules, folder_structure,
+                              rules_version=None, path_index=None):
+        """Fused Steps 1+3: one structured Gemini call returning both content analysis and folder recommendation"""
+        if not self.is_available():
+            print("❌ Fused analysis: Gemini not available, using fallback analysis and recommendation")
+            content_analysis = self._fallback_content_analysis(filename, file_type, file_size)
+            return content_analysis, self._fallback_folder_recommendation(filename, content_analysis)
+
+        cache_key = self._fused_cache_key(
+            filename, file_type, file_size, naming_convention_rules, folder_structure, rules_version
+        )
+        cached = analysis_result_cache.get(cache_key)
+        if cached:
+            print(f"⚡ Fused analysis: Using cached result for: {filename}")
+            return cached['content_analysis'], cached['folder_recommendation']
+
+        def analyze_and_recommend():
+            content_analysis, folder_recommendation = self._cascade(
+                "Fused analysis",
+                lambda: self._rules_analysis_and_recommendation(filename, file_type),
+                lambda model: self._model_analysis_and_recommendation(
+                    model, filename, file_type, file_size, naming_convention_rules, folder_structure
+                ),
+                lambda answer: (self._analysis_escalation_reason(answer[0])
+                                or self._recommendation_escalation_reason(answer[1], path_index))
+            )
+            if self._worth_caching(content_analysis, folder_recommendation):
+                analysis_result_cache.put(cache_key, {
+                    'content_analysis': content_analysis,
+                    'folder_recommendation': folder_recommendation
+                })
+            return content_analysis, folder_recommendation
+
+        try:
+            return copy.deepcopy(single_flight.do('gemini', cache_key, analyze_and_recommend))
+
+        except Exception as e:
+            print(f"❌ Fused analysis error: {e}")
+            content_analysis = self._fallback_content_analysis(filename, file_type, file_size)
+            return content_analysis, self._fallback_folder_recommendation(filename, content_analysis)
+
+    def _model_analysis_and_recommendation(self, model, filename, file_type, file_size, naming_convention_rules,
+                                           folder_structure):
+        print(f"🧠 Fused analysis: single Gemini call for: {filename}")
+
+        prompt = self._create_fused_analysis_prompt(
+            filename, file_type, file_size, naming_convention_rules, folder_structure
+        )
+        response = self._generate(prompt, model=model, **self._json_generation_kwargs())
+
+        if not response or not response.text:
+            raise Exception("Empty response from Gemini API")
+
+        content_analysis, folder_recommendation = self._parse_fused_response(response.text)
+        print(f"✅ Fused analysis complete: {folder_recommendation.get('recommended_folder')}")
+        return content_analysis, folder_recommendation
+
+    def _cascade(self, step, answer_with_rules, answer_with_model, escalation_reason):
+        """Ask each tier in turn, cheapest first, until one gives an answer worth keeping
+        
+        escalation_reason(answer) returns why an answer is not good enough, or None. A model tier
+        that fails escalates too; the last tier's answer (or error) is final. The answering tier
+        is recorded in the answer's model_tier.
+        """
+        tiers = self.model_tiers or [(self.PRO_MODEL, self.model)]
+        escalations = 0
+        for position, (tier, model) in enumerate(tiers):
+            last = position == len(tiers) - 1
+            try:
+                answer = answer_with_rules() if model is None else answer_with_model(model)
+            except Exception as e:
+                if last:
+                    raise
+                reason = f"{type(e).__name__}: {e}"
+            else:
+                reason = None if last else escalation_reason(answer)
+                if reason is None:
+                    self._record_tier(tier, escalations)
+                    for part in (answer if isinstance(answer, tuple) else (answer,)):
+                        part['model_tier'] = tier
+                    return answer
+            escalations += 1
+            print(f"⤴️ {step}: escalating from {tier} to {tiers[position + 1][0]} ({reason})")
+
+    def _worth_caching(self, *answer_parts):
+        """False for rules-tier answers: they cost no model call, and the cache key doesn't carry the
+        tier configuration or hub folders that made the rules answer acceptable"""
+        return all(part.get('model_tier') != self.RULES_TIER for part in answer_parts)
+
+    def _analysis_escalation_reason(self, content_analysis):
+        confidence = self._confidence_value(content_analysis.get('confidence_score'))
+        if confidence < self.CASCADE_MIN_CONFIDENCE:
+            return f"analysis confidence {confidence} < {self.CASCADE_MIN_CONFIDENCE}"
+        return None
+
+    def _recommendation_escalation_reason(self, folder_recommendation, path_index):
+        confidence = self._confidence_value(folder_recommendation.get('confidence'))
+        if confidence < self.CASCADE_MIN_CONFIDENCE:
+            return f"folder confidence {confidence} < {self.CASCADE_MIN_CONFIDENCE}"
+        folder = folder_recommendation.get('recommended_folder') or ''
+        if path_index is not None and path_index.resolve(folder) is None:
+            return f"'{folder}' is not in the Marketing Hub"
+        return None
+
+    @staticmethod
+    def _confidence_value(value):
+        """Confidence as an int from '92', '92%' or 92; 0 when missing or unparseable"""
+        try:
+            return int(float(str(value).strip().rstrip('%')))
+        except (TypeError, ValueError):
+            return 0
+
+    @classmethod
+    def _record_tier(cls, tier, escalations):
+        with cls._tier_stats_lock:
+            answered_by = cls._tier_stats['answered_by']
+            answered_by[tier] = answered_by.get(tier, 0) + 1
+            cls._tier_stats['escalations'] += escalations
+
+    @classmethod
+    def tier_stats(cls):
+        """Return how many answers each cascade tier gave and how many escalations it took"""
+        with cls._tier_stats_lock:
+            return {'answered_by': dict(cls._tier_stats['answered_by']),
+                    'escalations': cls._tier_stats['escalations'],
+                    'min_confidence': cls.CASCADE_MIN_CONFIDENCE}
+
+    @classmethod
+    def clear_tier_stats(cls):
+        with cls._tier_stats_lock:
+            cls._tier_stats['answered_by'].clear()
+            cls._tier_stats['escalations'] = 0
+
+    def _rules_content_analysis(self, filename, file_type):
+        """Rules tier: content analysis from filename keywords, confident only when the name is explicit"""
+        name = ' '.join(re.split(r'[\s_\-.]+', filename.lower()))
+        document_type, content_category = self._match_keywords(
+            name, self.RULES_DOCUMENT_TYPES, ('Business Document', 'GENERAL')
+        )
+        product_line = self._match_keywords(name, self.RULES_PRODUCT_LINES, 'MA')
+        industry = self._match_keywords(name, self.RULES_INDUSTRIES, 'General')
+        
+        # Each signal the filename spells out adds confidence; a name with no document type stays low
+        confidence = 40
+        if content_category != 'GENERAL':
+            confidence += 30
+        if product_line != 'MA':
+            confidence += 15
+        if industry != 'General':
+            confidence += 10
+        
+        return {
+            'document_type': document_type,
+            'content_category': content_category,
+            'product_line': product_line,
+            'industry': industry,
+            'target_audience': self.RULES_AUDIENCES.get(content_category, 'Business Team'),
+            'business_impact': 'Medium',
+            'technical_complexity': 'Advanced' if content_category == 'TECH' else 'Intermediate',
+            'content_description': f"{document_type} identified from the filename",
+            'confidence_score': str(confidence)
+        }
+
+    def _rules_folder_recommendation(self, filename, content_analysis):
+        """Rules tier: the pattern folder for the analysis, as confident as the analysis when it is specific"""
+        folder = self._pattern_folder(filename, content_analysis)
+        specific = content_analysis.get('content_category') in self.RULES_AUDIENCES
+        confidence = self._confidence_value(content_analysis.get('confidence_score')) if specific else 50
+        return {
+            'recommended_folder': folder,
+            'reasoning': f"Filename rules: {content_analysis.get('document_type', 'document')} folder",
+            'confidence': str(min(confidence, 90))
+        }
+
+    def _rules_analysis_and_recommendation(self, filename, file_type):
+        content_analysis = self._rules_content_analysis(filename, file_type)
+        return content_analysis, self._rules_folder_recommendation(filename, content_analysis)
+
+    @staticmethod
+    def _match_keywords(name, table, default):
+        """First entry of (keywords, value...) table with a keyword in name, as its value(s)"""
+        padded = f" {name} "
+        for keywords, *values in table:
+            if any(f" {keyword} " in padded or (len(keyword) > 4 and keyword in name) for keyword in keywords):
+                return values[0] if len(values) == 1 else tuple(values)
+        return default
+
+    def analyze_files_batch(self, files, naming_convention_rules, folder_structure, rules_version=None):
+        """Grouped fused analysis for multi-file drops: N files per Gemini call, groups sent concurrently
+        
+        files is a list of dicts with filename, file_type and file_size. Returns a list of
+        (content_analysis, folder_recommendation) tuples in the same order.
+        """
+        if not self.is_available():
+            return [self._fallback_file_result(file_info) for file_info in files]
+        
+        results = [None] * len(files)
+        pending = []
+        
+        for index, file_info in enumerate(files):
+            cache_key = self._fused_cache_key(
+                file_info['filename'], file_info['file_type'], file_info['file_size'],
+                naming_convention_rules, folder_structure, rules_version
+            )
+            cached = analysis_result_cache.get(cache_key)
+            if cached:
+                results[index] = (cached['content_analysis'], cached['folder_recommendation'])
+            else:
+                pending.append((index, file_info, cache_key))
+        
+        groups = [pending[i:i + self.BATCH_GROUP_SIZE] for i in range(0, len(pending), self.BATCH_GROUP_SIZE)]
+        if groups:
+            print(f"🧠 Batch analysis: {len(pending)} files in {len(groups)} Gemini calls "
+                  f"({len(files) - len(pending)} cached)")
+            prompts = [
+                self._create_batch_analysis_prompt(
+                    [file_info for _, file_info, _ in group], naming_convention_rules, folder_structure
+                )
+                for group in groups
+            ]
+            responses = gemini_runner.generate_many(
+                self.model, prompts, limit=self.BATCH_CONCURRENCY, **self._json_generation_kwargs()
+            )
+            for group, response in zip(groups, responses):
+                for index, file_result in self._group_results(group, response):
+                    results[index] = file_result
+        
+        return results
+    
+    def _group_results(self, group, response):
+        """Split one grouped response (or the exception it raised) back into per-file results"""
+        try:
+            if isinstance(response, Exception):
+                raise response
+            if not response or not response.text:
+                raise Exception("Empty response from Gemini API")
+            
+            items = self._parse_batch_response(response.text)
+        except Exception as e:
+            print(f"❌ Batch analysis error for {len(group)} files: {e}")
+            items = {}
+        
+        group_results = []
+        for position, (index, file_info, cache_key) in enumerate(group, start=1):
+            item = items.get(position)
+            if item is None:
+                print(f"⚠️ No batch result for {file_info['filename']}, using fallback")
+                group_results.append((index, self._fallback_file_result(file_info)))
+                continue
+            content_analysis, folder_recommendation = self._fused_fields_to_results(item)
+            analysis_result_cache.put(cache_key, {
+                'content_analysis': content_analysis,
+                'folder_recommendation': folder_recommendation
+            })
+            group_results.append((index, (content_analysis, folder_recommendation)))
+        return group_results
+    
+    def _create_batch_analysis_prompt(self, files, naming_rules, folder_structure):
+        """Create one prompt that analyzes several files against the same rules and folder structure"""
+        file_lines = "\n".join(
+            f"        {position}. Filename: {file_info['filename']} | Type: {file_info['file_type']} | "
+            f"Size: {file_info['file_size']} bytes"
+            for position, file_info in enumerate(files, start=1)
+        )
+        prompt = f"""
+        Analyze each of these files for intelligent organization in Skylark Drones Marketing Hub and
+        recommend the BEST folder for each from the actual folder structure.
+
+        FILES:
+{file_lines}
+
+        NAMING CONVENTION RULES:
+        {naming_rules or "Standard business naming conventions"}
+
+        ACTUAL MARKETING HUB FOLDER STRUCTURE:
+        {folder_structure}
+
+        Respond with ONLY a JSON array containing one object per file, each with exactly these keys:
+        "file_index" (the number of the file above), "document_type", "content_category" (TECH, SALES,
+        MARK, BRAND, ...), "product_line" (SP, BS, DMO or MA), "industry", "target_audience",
+        "business_impact", "technical_complexity", "content_description", "confidence_score" (0-100),
+        "recommended_folder" (exact folder path from the structure above), "reasoning",
+        "confidence" (0-100), "alternative"
+        """
+        return prompt
     
+    def _parse_batch_response(self, response_text):
+        """Parse a grouped JSON array response into {file_index: fields}"""
+        start = response_text.find('[')
+        end = response_text.rfind(']')
+        if start == -1 or end == -1:
+            raise ValueError("No JSON array in batch Gemini response")
+        items = {}
+        for item in json.loads(response_text[start:end + 1]):
+            try:
+                items[int(item.get('file_index'))] = item
+            except (TypeError, ValueError, AttributeError):
+                continue
+        return items
+    
+    def _fallback_file_result(self, file_info):
+        content_analysis = self._fallback_content_analysis(
+            file_info['filename'], file_info['file_type'], file_info['file_size']
+        )
+        return content_analysis, self._fallback_folder_recommendation(file_info['filename'], content_analysis)
+    
+    def _generate(self, prompt, model=None, **kwargs):
+        """Blocking Gemini call (to self.model unless a cascade tier's model is given), sent from the
+        shared event loop under the global concurrency cap"""
+        return gemini_runner.generate(model or self.model, prompt, **self._deadline_kwargs(), **kwargs)
+
+    def _deadline_kwargs(self):
+        """Cap the HTTP timeout at the workflow step's remaining budget when the installed SDK accepts request_options"""
+        timeout = Deadline.thread_remaining()
+        if timeout is None or 'request_options' not in inspect.signature(genai.GenerativeModel.generate_content).parameters:
+            # Older SDKs: the runner cancels the call at the step deadline instead
+            return {}
+        return {'request_options': {'timeout': timeout}}
+
+    def _fused_cache_key(self, filename, file_type, file_size, naming_rules, folder_structure, rules_version):
+        return analysis_result_cache.make_key(
+            'fused', filename, file_type, self._size_bucket(file_size),
+            rules_version or self._content_hash(naming_rules), self._content_hash(folder_structure)
+        )
+
+    def _size_bucket(self, file_size):
+        """Power-of-two size bucket, so re-exports of the same file still share a cache entry"""
+        try:
+            return int(file_size).bit_length()
+        except (TypeError, ValueError):
+            return 0
+
+    def _content_hash(self, text):
+        """Stable short hash of prompt inputs (rules text, folder structure) for cache keys"""
+        return hashlib.sha256((text or '').encode('utf-8')).hexdigest()[:16]
+
+    def _json_generation_kwargs(self):
+        """Ask for application/json output when the installed SDK supports response_mime_type"""
+        if 'response_mime_type' in inspect.signature(genai.types.GenerationConfig).parameters:
+            return {'generation_config': genai.types.GenerationConfig(response_mime_type='application/json')}
+        # Older SDKs: the prompt itself pins the JSON shape and the parser tolerates code fences
+        return {}
+
+    def _create_fused_analysis_prompt(self, filename, file_type, file_size, naming_rules, folder_structure):
+        """Create a single prompt covering content analysis and folder recommendation"""
+        prompt = f"""
+        Analyze this file for intelligent organization in Skylark Drones Marketing Hub and recommend
+        the BEST folder for it from the actual folder structure.
+
+        FILE DETAILS:
+        - Filename: {filename}
+        - Type: {file_type}
+        - Size: {file_size} bytes
+
+        NAMING CONVENTION RULES:
+        {naming_rules or "Standard business naming conventions"}
+
+        ACTUAL MARKETING HUB FOLDER STRUCTURE:
+        {folder_structure}
+
+        Respond with ONLY a JSON object with exactly these keys:
+        {{
+          "document_type": "e.g. Product Brochure, Technical Manual, Corporate Profile",
+          "content_category": "TECH, SALES, MARK, BRAND, ...",
+          "product_line": "SP, BS, DMO or MA",
+          "industry": "Mining, Agriculture, Infrastructure, Solar/Renewable Energy, Security, General, ...",
+          "target_audience": "Engineers, Sales Team, Marketing, Management, Customers, Partners",
+          "business_impact": "High, Medium or Low",
+          "technical_complexity": "Basic, Intermediate or Advanced",
+          "content_description": "brief description of what this document contains",
+          "confidence_score": 0-100,
+          "recommended_folder": "exact folder path from the structure above",
+          "reasoning": "why this folder is the best match",
+          "confidence": 0-100,
+          "alternative": "second-best folder path, if any"
+        }}
+        """
+        return prompt
+
+    def _parse_fused_response(self, response_text):
+        """Split a fused JSON response into (content_analysis, folder_recommendation) dicts"""
+        # Tolerate ```json fences and chatter around the object
+        start = response_text.find('{')
+        end = response_text.rfind('}')
+        if start == -1 or end == -1:
+            raise ValueError("No JSON object in fused Gemini response")
+        return self._fused_fields_to_results(json.loads(response_text[start:end + 1]))
+
+    def _fused_fields_to_results(self, data):
+        """Map one fused JSON object onto content analysis and folder recommendation dicts"""
+        content_analysis = {
+            key: str(data[key]).strip() for key in self.CONTENT_ANALYSIS_DEFAULTS
+            if data.get(key) not in (None, '')
+        }
+        for key, default in self.CONTENT_ANALYSIS_DEFAULTS.items():
+            content_analysis.setdefault(key, default)
+
+        folder_recommendation = {
+            key: str(data[key]).strip() for key in ('recommended_folder', 'reasoning', 'confidence', 'alternative')
+            if data.get(key) not in (None, '')
+        }
+        for key, default in self.FOLDER_RECOMMENDATION_DEFAULTS.items():
+            folder_recommendation.setdefault(key, default)
+
+        return content_analysis, folder_recommendation
+
     def _create_content_analysis_prompt(self, filename, file_type, file_size, naming_rules):
         """Create comprehensive content analysis prompt for Gemini"""
         prompt = f"""
@@ -200,19 +748,7 @@ class GeminiService:
                     data[key] = match.group(1).strip().strip('"').strip("'")
             
             # Set defaults if not found
-            defaults = {
-                'document_type': 'Business Document',
-                'content_category': 'GENERAL',
-                'product_line': 'MA',
-                'industry': 'General',
-                'target_audience': 'Business Team',
-                'business_impact': 'Medium',
-                'technical_complexity': 'Intermediate',
-                'content_description': 'Business document for organizational use',
-                'confidence_score': '95'
-            }
-            
-            for key, default in defaults.items():
+            for key, default in self.CONTENT_ANALYSIS_DEFAULTS.items():
                 if key not in data or not data[key]:
                     data[key] = default
             
@@ -248,12 +784,8 @@ class GeminiService:
                 data['alternative'] = alternative_match.group(1).strip().strip('"').strip("'")
             
             # Set defaults
-            if 'recommended_folder' not in data:
-                data['recommended_folder'] = "Marketing Hub → General → Uploads"
-            if 'reasoning' not in data:
-                data['reasoning'] = "Default recommendation based on content analysis"
-            if 'confidence' not in data:
-                data['confidence'] = "85"
+            for key, default in self.FOLDER_RECOMMENDATION_DEFAULTS.items():
+                data.setdefault(key, default)
             
             return data
             
@@ -315,6 +847,14 @@ class GeminiService:
         """Fallback folder recommendation"""
         print("🔄 Using fallback folder recommendation")
         
+        return {
+            'recommended_folder': self._pattern_folder(filename, content_analysis),
+            'reasoning': 'Fallback recommendation based on content patterns',
+            'confidence': '70'
+        }
+
+    def _pattern_folder(self, filename, content_analysis):
+        """Hub folder for a content category / product line, by fixed pattern"""
         content_category = content_analysis.get('content_category', 'GENERAL')
         product_line = content_analysis.get('product_line', 'MA')
         filename_lower = filename.lower()
@@ -336,136 +876,2376 @@ class GeminiService:
             folder = "Marketing Hub → 02_Product Lines & Sub-Brands → Software Platform"
         else:
             folder = "Marketing Hub → General → Uploads"
-        
-        return {
-            'recommended_folder': folder,
-            'reasoning': 'Fallback recommendation based on content patterns',
-            'confidence': '70'
-        }
+        return folder
 
 
-class DriveService:
-    """Handle Google Drive API integration for folder structure reading"""
-    
-    def __init__(self, credentials=None):
-        self.credentials = credentials
-        self.service = None
-        
-        if credentials:
-            try:
-                # Ensure credentials have the required token
-                if hasattr(credentials, 'token') and credentials.token:
-                    self.service = build('drive', 'v3', credentials=credentials)
-                    print("✅ Drive API service initialized successfully with valid credentials")
-                else:
-                    print("❌ Drive API credentials missing token")
-            except Exception as e:
-                print(f"❌ Drive service initialization error: {e}")
-        else:
-            print("❌ No credentials provided for Drive API")
-    
-    def is_available(self):
-        """Check if Drive API is available"""
-        available = self.service is not None
-        if available:
-            # Test the connection by making a simple API call
-            try:
-                # Try to get user info to verify the connection works
-                about = self.service.about().get(fields="user").execute()
-                print(f"✅ Drive API Available: True (User: {about.get('user', {}).get('emailAddress', 'Unknown')})")
-                return True
-            except Exception as e:
-                print(f"❌ Drive API connection test failed: {e}")
-                self.service = None
-                return False
-        else:
-            print(f"❌ Drive API Available: False (No service initialized)")
-            return False
-    
-    def read_document(self, file_id):
-        """Read a Google Docs document content"""
-        if not self.is_available():
-            print("❌ Drive API not available for document reading")
-            return None
-        
+class Deadline:
+    """End-to-end time budget for one request, sliced into per-step deadlines
+
+    The deadline of the step a thread is running is bound to that thread, so the Drive HTTP
+    client and the Gemini runner can cap their own timeouts at the time the step has left.
+    """
+
+    _local = threading.local()
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def step_expiry(self, share):
+        """Expiry for a step allowed `share` of the total budget, never past the overall deadline"""
+        return min(self.expires_at, time.monotonic() + self.seconds * share)
+
+    @classmethod
+    @contextmanager
+    def bind(cls, expires_at):
+        """Make expires_at the current thread's step deadline for the duration of the block"""
+        previous = getattr(cls._local, 'expires_at', None)
+        cls._local.expires_at = expires_at
         try:
-            print(f"📖 Reading document: {file_id}")
-            result = self.service.files().export(
-                fileId=file_id,
-                mimeType='text/plain'
-            ).execute()
-            
-            content = result.decode('utf-8')
-            print(f"✅ Document read successfully: {len(content)} characters")
-            return content
-            
-        except Exception as e:
-            print(f"❌ Document read error: {e}")
+            yield
+        finally:
+            cls._local.expires_at = previous
+
+    @classmethod
+    def thread_remaining(cls):
+        """Seconds left on this thread's step deadline, or None outside a budgeted step"""
+        expires_at = getattr(cls._local, 'expires_at', None)
+        if expires_at is None:
             return None
-    
-    def get_real_folder_structure(self, folder_id, max_depth=3):
-        """Step 2: Get real folder structure from Marketing Hub"""
-        if not self.is_available():
-            print("❌ Step 2: Drive API not available, using fallback folder structure")
-            return self._fallback_folder_structure()
-        
+        return max(0.0, expires_at - time.monotonic())
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one in-flight operation
+
+    The first caller for a (namespace, key) runs the function; callers that arrive while it is
+    running wait and get the same result, or the same exception. Nothing is kept once the call
+    finishes, so caching stays with the caches. Counters are kept per namespace.
+
+    Waiters wait no longer than their own step deadline. A TimeoutError is the leader's deadline,
+    not theirs, so it isn't shared: waiters try again, one of them leading the new call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def do(self, namespace, key, fn):
+        """Run fn() for (namespace, key) unless an identical call is already in flight, then share its outcome"""
+        flight_key = (namespace, key)
+        with self._lock:
+            stats = self._stats.setdefault(namespace, {'calls': 0, 'executions': 0, 'coalesced': 0, 'errors': 0})
+            stats['calls'] += 1
+
+        while True:
+            with self._lock:
+                call = self._calls.get(flight_key)
+                leader = call is None
+                if leader:
+                    call = self._calls[flight_key] = {'done': threading.Event(), 'result': None, 'error': None}
+                    stats['executions'] += 1
+                else:
+                    stats['coalesced'] += 1
+            if leader:
+                break
+
+            if not call['done'].wait(Deadline.thread_remaining()):
+                raise TimeoutError(f"Workflow step deadline passed waiting for an in-flight {namespace} call")
+            if isinstance(call['error'], TimeoutError):
+                continue
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
         try:
-            print(f"📁 Step 2: Reading real folder structure from Marketing Hub: {folder_id}")
-            
-            # First, verify we can access the folder
-            try:
-                folder_info = self.service.files().get(fileId=folder_id, fields="id,name").execute()
-                print(f"✅ Successfully accessed folder: {folder_info.get('name', 'Unknown')}")
-            except Exception as e:
-                print(f"❌ Cannot access Marketing Hub folder {folder_id}: {e}")
-                return self._fallback_folder_structure()
-            
-            folders = []
-            folder_map = {}
-            self._get_folders_recursive(folder_id, folders, folder_map, 0, max_depth)
-            
-            if not folders:
-                print("⚠️ No folders found in Marketing Hub, using fallback")
-                return self._fallback_folder_structure()
-            
-            structure = self._format_folder_structure_for_gemini(folders, folder_map)
-            print(f"✅ Step 2 Complete: Real folder structure read ({len(folders)} folders)")
-            return structure
-            
+            call['result'] = fn()
+            return call['result']
         except Exception as e:
-            print(f"❌ Step 2 Error: Folder structure reading failed: {e}")
-            return self._fallback_folder_structure()
-    
-    def _get_folders_recursive(self, parent_id, folders, folder_map, depth, max_depth):
-        """Recursively get folder structure"""
-        if depth >= max_depth:
-            return
+            call['error'] = e
+            with self._lock:
+                stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[flight_key]
+            call['done'].set()
+
+    def clear(self):
+        """Reset counters; calls in flight finish normally"""
+        with self._lock:
+            self._stats.clear()
+
+    def stats(self):
+        """Return per-namespace call, execution and coalesced counts"""
+        with self._lock:
+            stats = {namespace: dict(counts) for namespace, counts in self._stats.items()}
+            in_flight = {}
+            for namespace, _ in self._calls:
+                in_flight[namespace] = in_flight.get(namespace, 0) + 1
+        for namespace, counts in stats.items():
+            counts['in_flight'] = in_flight.get(namespace, 0)
+        return stats
+
+
+# Shared by every thread in the process: cold folder crawls, naming doc exports and Gemini prompts
+single_flight = SingleFlight()
+
+
+class TokenBucket:
+    """Token bucket rate limiter: `rate` tokens per second, bursting up to `capacity`
+
+    reserve() takes a token straight away and returns how long the caller has to wait before
+    using it, so callers on an event loop sleep there instead of holding a thread. A rate of
+    0 disables limiting.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._stats = {'granted': 0, 'throttled': 0, 'wait_seconds_total': 0.0}
+
+    def reserve(self):
+        """Take one token; return the seconds to wait before it may be spent"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self._stats['granted'] += 1
+            if wait:
+                self._stats['throttled'] += 1
+                self._stats['wait_seconds_total'] += wait
+        return wait
+
+    def stats(self):
+        """Return the configured rate, tokens left and how often callers were throttled"""
+        with self._lock:
+            stats = dict(self._stats)
+            tokens = min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate)
+        stats['wait_seconds_total'] = round(stats['wait_seconds_total'], 3)
+        stats['requests_per_minute'] = round(self.rate * 60, 1)
+        stats['burst'] = self.capacity
+        stats['tokens_available'] = round(tokens, 1) if self.rate > 0 else None
+        return stats
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Closed / open / half-open circuit breaker around a remote service
+
+    failure_threshold consecutive failures open the circuit, and calls are refused until
+    reset_timeout seconds have passed. The circuit then goes half-open and lets up to
+    half_open_max_calls trial calls through: a successful trial closes it, a failed one opens
+    it again for another reset_timeout.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trials = 0
+        self._lock = threading.Lock()
+        self._stats = {'successes': 0, 'failures': 0, 'rejected': 0, 'trips': 0, 'trial_calls': 0,
+                       'last_trip_at': None}
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow(self):
+        """True if a call may go out now; moves an open circuit to half-open once reset_timeout has passed"""
+        with self._lock:
+            if self._state == self.OPEN and time.time() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._trials = 0
+                print(f"🟡 {self.name} circuit half-open, sending a trial call")
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._trials < self.half_open_max_calls:
+                self._trials += 1
+                self._stats['trial_calls'] += 1
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._stats['successes'] += 1
+            self._consecutive_failures = 0
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                print(f"🟢 {self.name} circuit closed, trial call succeeded")
+
+    def record_failure(self):
+        with self._lock:
+            self._stats['failures'] += 1
+            self._consecutive_failures += 1
+            if self._state == self.HALF_OPEN or (
+                    self._state == self.CLOSED and self._consecutive_failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = time.time()
+                self._stats['trips'] += 1
+                self._stats['last_trip_at'] = self._opened_at
+                print(f"🔴 {self.name} circuit open after {self._consecutive_failures} failures, "
+                      f"failing fast for {self.reset_timeout:g}s")
+
+    def release(self):
+        """A call let through ended without an outcome (e.g. cancelled); free its half-open trial slot"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def reset(self):
+        """Close the circuit and reset counters"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._trials = 0
+            for key in self._stats:
+                self._stats[key] = 0
+            self._stats['last_trip_at'] = None
+
+    def stats(self):
+        """Return the circuit state and trip counters for monitoring"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['state'] = self._state
+            stats['consecutive_failures'] = self._consecutive_failures
+            stats['retry_in_seconds'] = (
+                round(max(0.0, self._opened_at + self.reset_timeout - time.time()), 1)
+                if self._state == self.OPEN else None
+            )
+        stats['failure_threshold'] = self.failure_threshold
+        stats['reset_timeout'] = self.reset_timeout
+        return stats
+
+
+class GeminiAsyncRunner:
+    """Runs every Gemini call on one event loop thread, with a process-wide cap on calls in flight
+
+    Calls go out through the model's generate_content_async, so a call waiting on Gemini holds
+    no thread; models without it (test stubs) run on a private pool sized to the cap. Request
+    and workflow threads get a concurrent.futures.Future, or block on generate(). The semaphore,
+    not the server's thread count, bounds how many Gemini calls are outstanding.
+
+    Every call first takes a token from a bucket sized to the project's requests-per-minute
+    quota. 429s, 5xx and timeouts are retried with jittered backoff while they count towards a
+    circuit breaker; once it opens, calls fail at once with CircuitOpenError so GeminiService
+    goes straight to its fallback, and half-open trial calls find out when Gemini is back.
+    """
+
+    # Retries for 429 / 5xx / timeout errors; everything else fails on the first attempt
+    RETRIABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+    RETRY_MAX_RETRIES = int(os.environ.get('GEMINI_MAX_RETRIES', '3'))
+    RETRY_BACKOFF_BASE = 1.0
+    RETRY_BACKOFF_MAX = 16.0
+
+    def __init__(self, max_concurrency=None, requests_per_minute=None, burst=None, breaker=None):
+        if max_concurrency is None:
+            max_concurrency = int(os.environ.get('GEMINI_MAX_CONCURRENCY', '16'))
+        if requests_per_minute is None:
+            requests_per_minute = float(os.environ.get('GEMINI_REQUESTS_PER_MINUTE', '150'))
+        if burst is None:
+            burst = int(os.environ.get('GEMINI_RATE_LIMIT_BURST', '20'))
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate_limiter = TokenBucket(requests_per_minute / 60, burst)
+        self.breaker = breaker or CircuitBreaker(
+            'Gemini',
+            failure_threshold=int(os.environ.get('GEMINI_BREAKER_FAILURES', '5')),
+            reset_timeout=float(os.environ.get('GEMINI_BREAKER_RESET_SECONDS', '30'))
+        )
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'completed': 0,
+            'errors': 0,
+            'retries': 0,
+            'rejected': 0,
+            'deadline_cancelled': 0,
+            'in_flight': 0,
+            'waiting': 0,
+            'peak_in_flight': 0,
+            'wait_seconds_total': 0.0
+        }
+
+    def submit(self, model, prompt, **kwargs):
+        """Schedule one generate_content call; returns a concurrent.futures.Future for the response"""
+        loop = self._ensure_loop()
+        self._count('calls')
+        return asyncio.run_coroutine_threadsafe(self._call(model, prompt, kwargs), loop)
+
+    def generate(self, model, prompt, **kwargs):
+        """Blocking generate_content through the shared loop and concurrency cap
+
+        Inside a budgeted workflow step, waits only for the time the step has left and then
+        cancels the call, raising TimeoutError.
+        """
+        timeout = Deadline.thread_remaining()
+        if timeout == 0:
+            self._count('deadline_cancelled')
+            raise TimeoutError("Workflow step deadline already passed, Gemini call not sent")
+        future = self.submit(model, prompt, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if future.done():
+                raise
+            future.cancel()
+            self._count('deadline_cancelled')
+            raise TimeoutError(f"Gemini call cancelled at the workflow step deadline ({timeout:.2f}s)")
+
+    def generate_many(self, model, prompts, limit=None, **kwargs):
+        """Send prompts concurrently, at most limit of them at once; returns responses or exceptions in order"""
+        loop = self._ensure_loop()
+        with self._lock:
+            self._stats['calls'] += len(prompts)
+        return asyncio.run_coroutine_threadsafe(self._call_many(model, prompts, limit, kwargs), loop).result()
+
+    def stop(self):
+        """Stop the event loop thread; the next call starts a new one"""
+        with self._lock:
+            loop, thread, executor = self._loop, self._thread, self._executor
+            self._loop = self._thread = self._executor = None
+        if loop:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=5)
+            executor.shutdown(wait=False)
+
+    def stats(self):
+        """Return call counters, current concurrency and queueing for monitoring"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['running'] = bool(self._thread and self._thread.is_alive())
+        stats['wait_seconds_total'] = round(stats['wait_seconds_total'], 3)
+        stats['max_concurrency'] = self.max_concurrency
+        stats['rate_limiter'] = self.rate_limiter.stats()
+        stats['circuit'] = self.breaker.state
+        return stats
+
+    def is_retriable(self, error):
+        """True for rate limiting (429), server errors and timeouts"""
+        if isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+            return True
+        return getattr(error, 'code', None) in self.RETRIABLE_STATUS_CODES
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return self._loop
+            loop = asyncio.new_event_loop()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                # Created on the loop thread; anything submitted meanwhile runs after this
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                loop.run_forever()
+
+            self._loop = loop
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='gemini-call')
+            self._thread = threading.Thread(target=run, name='gemini-event-loop', daemon=True)
+            self._thread.start()
+        print(f"⏱️ Gemini event loop started ({self.max_concurrency} calls in flight at most)")
+        return loop
+
+    async def _call_many(self, model, prompts, limit, kwargs):
+        batch_semaphore = asyncio.Semaphore(limit or len(prompts) or 1)
+
+        async def call(prompt):
+            async with batch_semaphore:
+                return await self._call(model, prompt, kwargs)
+
+        return await asyncio.gather(*(call(prompt) for prompt in prompts), return_exceptions=True)
+
+    async def _call(self, model, prompt, kwargs):
+        for attempt in range(self.RETRY_MAX_RETRIES + 1):
+            if not self.breaker.allow():
+                self._count('rejected')
+                raise CircuitOpenError("Gemini circuit is open, skipping the call")
+            try:
+                response = await self._attempt(model, prompt, kwargs)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                if not self.is_retriable(e):
+                    # Gemini answered; the request itself was rejected
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.RETRY_MAX_RETRIES or self.breaker.state != CircuitBreaker.CLOSED:
+                    raise
+                delay = min(self.RETRY_BACKOFF_MAX, self.RETRY_BACKOFF_BASE * (2 ** attempt))
+                delay *= 0.5 + random.random() / 2
+                print(f"⏳ Gemini call failed ({type(e).__name__}), retrying in {delay:.2f}s (attempt {attempt + 1})")
+                self._count('retries')
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                self._count('completed')
+                return response
+
+    async def _attempt(self, model, prompt, kwargs):
+        queued_at = time.time()
+        wait = self.rate_limiter.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        with self._lock:
+            self._stats['waiting'] += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            # Also when the call is cancelled while still queued
+            with self._lock:
+                self._stats['waiting'] -= 1
+        with self._lock:
+            self._stats['in_flight'] += 1
+            self._stats['peak_in_flight'] = max(self._stats['peak_in_flight'], self._stats['in_flight'])
+            self._stats['wait_seconds_total'] += time.time() - queued_at
+        try:
+            if hasattr(model, 'generate_content_async'):
+                response = await model.generate_content_async(prompt, **kwargs)
+            else:
+                response = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, functools.partial(model.generate_content, prompt, **kwargs)
+                )
+        except Exception:
+            self._count('errors')
+            raise
+        finally:
+            with self._lock:
+                self._stats['in_flight'] -= 1
+            self._semaphore.release()
+        return response
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+
+# Shared by every thread in the process: the semaphore caps Gemini calls in flight, the bucket
+# their rate, and the breaker short-circuits every caller while Gemini is failing
+gemini_runner = GeminiAsyncRunner()
+
+
+class AnalysisResultCache:
+    """LRU + TTL cache for Gemini analysis results, optionally persisted to SQLite"""
+
+    def __init__(self, max_entries=None, ttl_seconds=None, db_path=None):
+        self.max_entries = max_entries or int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', '1000'))
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get('ANALYSIS_CACHE_TTL', '86400'))
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._db = None
+
+        db_path = db_path if db_path is not None else os.environ.get('ANALYSIS_CACHE_DB')
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path):
+        """Open the on-disk backend so cached results survive worker restarts"""
+        try:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache (key TEXT PRIMARY KEY, stored_at REAL, value TEXT)"
+            )
+            self._db.execute("DELETE FROM analysis_cache WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+            self._db.commit()
+            print(f"✅ Analysis result cache persisted to: {db_path}")
+        except Exception as e:
+            print(f"❌ Analysis cache database error, using memory only: {e}")
+            self._db = None
+
+    @staticmethod
+    def make_key(*parts):
+        """Content-addressed key over all inputs that influence a Gemini result"""
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return a copy of the cached value, or None on a miss or expired entry"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return copy.deepcopy(entry[1])
+            if entry:
+                del self._entries[key]
+
+            row = None
+            if self._db:
+                row = self._db.execute(
+                    "SELECT stored_at, value FROM analysis_cache WHERE key = ?", (key,)
+                ).fetchone()
+            if row and now - row[0] < self.ttl_seconds:
+                value = json.loads(row[1])
+                self._remember(key, row[0], value)
+                self._stats['hits'] += 1
+                self._stats['disk_hits'] += 1
+                return copy.deepcopy(value)
+
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, key, value):
+        """Store a result, evicting the least recently used entries beyond max_entries"""
+        now = time.time()
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._remember(key, now, value)
+            self._stats['stores'] += 1
+            if self._db:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO analysis_cache (key, stored_at, value) VALUES (?, ?, ?)",
+                        (key, now, json.dumps(value))
+                    )
+                    self._db.commit()
+                except Exception as e:
+                    print(f"⚠️ Analysis cache write failed: {e}")
+
+    def _remember(self, key, stored_at, value):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def clear(self):
+        """Drop all cached results (memory and disk) and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            for key in self._stats:
+                self._stats[key] = 0
+            if self._db:
+                self._db.execute("DELETE FROM analysis_cache")
+                self._db.commit()
+
+    def stats(self):
+        """Return hit ratio and eviction counters for monitoring"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else None
+        stats['persistent'] = self._db is not None
+        return stats
+
+
+# Shared by every GeminiService in the process
+analysis_result_cache = AnalysisResultCache()
+
+
+class FolderPathIndex:
+    """Trie over normalized folder names for O(depth) path to folder id resolution"""
+
+    ROOT_NAME = 'marketing hub'
+
+    def __init__(self, root_id, folders):
+        self.root_id = root_id
+        self._root = {'id': root_id, 'children': {}}
+
+        nodes = {root_id: self._root}
+        # Parents are always shallower than their children, so insert level by level
+        for folder in sorted(folders, key=lambda f: f['depth']):
+            parent = nodes.get(folder['parent_id'])
+            if parent is None:
+                continue
+            key = self.normalize(folder['name'])
+            # Keep the first folder for duplicate names, like the per-segment Drive lookup did
+            node = parent['children'].setdefault(key, {'id': folder['id'], 'children': {}})
+            nodes[folder['id']] = node
+
+    @staticmethod
+    def normalize(name):
+        """Case- and whitespace-insensitive key for a folder name"""
+        return ' '.join(name.split()).casefold()
+
+    @classmethod
+    def split_path(cls, folder_path):
+        """Split 'Marketing Hub → A → B' or 'Marketing Hub/A/B' into segments below the hub"""
+        separator = '→' if '→' in folder_path else '/'
+        parts = [part.strip() for part in folder_path.split(separator) if part.strip()]
+        if parts and cls.normalize(parts[0]) == cls.ROOT_NAME:
+            parts = parts[1:]
+        return parts
+
+    def resolve(self, folder_path):
+        """Return the folder id for folder_path, or None when it is not in the index"""
+        node = self._root
+        for part in self.split_path(folder_path):
+            node = node['children'].get(self.normalize(part))
+            if node is None:
+                return None
+        return node['id']
+
+
+class FolderTreeCache:
+    """Process-wide cache of crawled Marketing Hub folder trees, keyed by root folder id"""
+
+    def __init__(self, ttl_seconds=None):
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get('FOLDER_TREE_CACHE_TTL', '300'))
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'revalidations': 0,
+            'refreshes': 0,
+            'refresh_seconds_total': 0.0,
+            'last_refresh_seconds': None
+        }
+
+    def get_tree(self, root_id, drive_service, max_depth=3):
+        """Return the cached tree for root_id, revalidating or re-crawling only when needed"""
+        entry = self._fresh_entry(root_id, max_depth)
+        if entry:
+            return entry
+
+        # Concurrent misses for the same tree wait on one probe or crawl instead of each running their own
+        return single_flight.do(
+            'folder_tree', (root_id, max_depth), lambda: self._load_tree(root_id, drive_service, max_depth)
+        )
+
+    def _fresh_entry(self, root_id, max_depth):
+        """Return the cached entry if it is deep enough and within the TTL, counting the hit"""
+        with self._lock:
+            entry = self._entries.get(root_id)
+            fresh = (entry is not None and entry['max_depth'] >= max_depth
+                     and time.time() - entry['checked_at'] < self.ttl_seconds)
+        if fresh:
+            self._count('hits')
+            print(f"⚡ Folder tree cache hit for {root_id} ({len(entry['folders'])} folders)")
+            return entry
+        return None
+
+    def _load_tree(self, root_id, drive_service, max_depth):
+        # A flight that finished just before this one started may already have refreshed the entry
+        entry = self._fresh_entry(root_id, max_depth)
+        if entry:
+            return entry
+
+        with self._lock:
+            entry = self._entries.get(root_id)
+
+        if entry and entry['max_depth'] >= max_depth:
+            # TTL expired: ask Drive whether any hub folder changed instead of re-crawling blindly
+            if drive_service._probe_hub_changed(root_id, entry) is False:
+                with self._lock:
+                    # A change event may have dropped the entry while the probe ran
+                    revalidated = self._entries.get(root_id) is entry
+                    if revalidated:
+                        entry['checked_at'] = time.time()
+                        self._stats['hits'] += 1
+                        self._stats['revalidations'] += 1
+                if revalidated:
+                    print(f"✅ Folder tree cache revalidated for {root_id}")
+                    return entry
+
+        self._count('misses')
+        print(f"🔄 Folder tree cache miss for {root_id}, crawling Drive")
+        started = time.time()
+        entry = drive_service._crawl_folder_tree(root_id, max_depth)
+        elapsed = time.time() - started
+
+        with self._lock:
+            self._stats['refreshes'] += 1
+            self._stats['refresh_seconds_total'] += elapsed
+            self._stats['last_refresh_seconds'] = elapsed
+            if entry:
+                self._entries[root_id] = entry
+
+        return entry
+
+    def peek(self, root_id):
+        """Return the cached tree for root_id without revalidating it, or None"""
+        with self._lock:
+            return self._entries.get(root_id)
+
+    def resolve_path(self, root_id, folder_path):
+        """Resolve a folder path against the cached tree with no network calls; None on a miss"""
+        entry = self.peek(root_id)
+        if not entry:
+            return None
+        return entry['path_index'].resolve(folder_path)
+
+    def invalidate(self, root_id=None):
+        """Drop one cached tree, or all of them when root_id is None"""
+        with self._lock:
+            if root_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(root_id, None)
+
+    def on_drive_change(self, event):
+        """DriveChangeFeed subscriber: a hub folder was created, renamed, moved or trashed"""
+        print(f"📁 Folder tree for {event.root_id} invalidated ({event.kind}: {event.name or event.file_id})")
+        self.invalidate(event.root_id)
+
+    def clear(self):
+        """Drop all cached trees and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            for key in self._stats:
+                self._stats[key] = 0
+            self._stats['refresh_seconds_total'] = 0.0
+            self._stats['last_refresh_seconds'] = None
+
+    def stats(self):
+        """Return hit/miss counters and refresh latency for monitoring"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else None
+        stats['avg_refresh_ms'] = (
+            round(stats['refresh_seconds_total'] * 1000 / stats['refreshes'], 1)
+            if stats['refreshes'] else None
+        )
+        stats['ttl_seconds'] = self.ttl_seconds
+        return stats
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+
+# Shared by every request thread in the process
+folder_tree_cache = FolderTreeCache()
+
+
+class DriveChangeEvent:
+    """One typed change from the Drive Changes feed, as published to DriveChangeFeed subscribers
+
+    file is the item's metadata at poll time (None for permanent deletions). For folder events,
+    folder_ids holds the folder and every hub folder below it, and in_hub is False when a move
+    took the folder out of the Marketing Hub.
+    """
+
+    FOLDER_CREATED = 'folder_created'
+    FOLDER_RENAMED = 'folder_renamed'
+    FOLDER_MOVED = 'folder_moved'
+    FOLDER_TRASHED = 'folder_trashed'
+    FILE_ADDED = 'file_added'
+    FILE_CHANGED = 'file_changed'
+    FILE_REMOVED = 'file_removed'
+    DOC_MODIFIED = 'doc_modified'
+
+    FOLDER_KINDS = (FOLDER_CREATED, FOLDER_RENAMED, FOLDER_MOVED, FOLDER_TRASHED)
+    FILE_KINDS = (FILE_ADDED, FILE_CHANGED, FILE_REMOVED)
+
+    def __init__(self, kind, file_id, root_id, file=None, in_hub=True, folder_ids=()):
+        self.kind = kind
+        self.file_id = file_id
+        self.root_id = root_id
+        self.file = file
+        self.in_hub = in_hub
+        self.folder_ids = frozenset(folder_ids)
+
+    @property
+    def name(self):
+        return (self.file or {}).get('name')
+
+    @property
+    def parents(self):
+        return list((self.file or {}).get('parents', []))
+
+    def __repr__(self):
+        return f"DriveChangeEvent({self.kind}, {self.file_id}, name={self.name!r})"
+
+
+class DriveChangeFeed:
+    """Background follower of the Drive Changes feed for the Marketing Hub
+
+    Holds one page token and polls changes.list (removals included) every poll_interval seconds,
+    turning raw changes into DriveChangeEvents for subscribers. Hub folders are seeded from the
+    cached folder crawl and tracked from the feed, which is what lets a change be classified as
+    a rename, a move or a trash. Files count as added the first time the feed sees them in the
+    hub; components that list hub files themselves register them with track_files(), so a later
+    move out of the hub is reported as a removal. doc_modified is published for Google Docs in the
+    hub and for documents registered with watch_documents(), not for every Doc the account edits.
+
+    The feed polls as one Drive identity: the user whose credentials started it. Later callers
+    with the same identity refresh its credentials; other users only take over after a failed poll.
+    """
+
+    FILE_FIELDS = "id, name, mimeType, size, md5Checksum, parents, trashed, modifiedTime, createdTime, webViewLink"
+    FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+    DOCUMENT_MIME_TYPE = 'application/vnd.google-apps.document'
+
+    def __init__(self, poll_interval=None):
+        if poll_interval is None:
+            poll_interval = float(os.environ.get('DRIVE_CHANGES_POLL_INTERVAL', '15'))
+        self.poll_interval = poll_interval
+        self.root_id = None
+        self.drive_id = None
+        self._drive_service = None
+        self._identity = None
+        self._poll_failed = False
+        self._page_token = None
+        # folder_id -> {'name', 'parent_id'} for every known hub folder below the root
+        self._folders = {}
+        self._files = set()
+        # Google Docs outside the hub whose edits are published as doc_modified
+        self._documents = set()
+        self._subscribers = {}
+        self._next_subscription = 0
+        self._last_poll_at = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        # One poll at a time, so events are published in feed order
+        self._poll_lock = threading.Lock()
+        self._poller = None
+        self._poller_stop = None
+        self._stats = {
+            'polls': 0,
+            'changes': 0,
+            'events': {kind: 0 for kind in DriveChangeEvent.FOLDER_KINDS + DriveChangeEvent.FILE_KINDS
+                       + (DriveChangeEvent.DOC_MODIFIED,)},
+            'errors': 0,
+            'subscriber_errors': 0,
+            'identity_changes': 0
+        }
+
+    def subscribe(self, callback, kinds=None):
+        """Call callback(event) for published events of the given kinds (all when None); returns a subscription id"""
+        with self._lock:
+            self._next_subscription += 1
+            subscription_id = self._next_subscription
+            self._subscribers[subscription_id] = (callback, frozenset(kinds) if kinds else None)
+        return subscription_id
+
+    def unsubscribe(self, subscription_id):
+        """Stop delivering events to a subscription; False if it was not registered"""
+        with self._lock:
+            return self._subscribers.pop(subscription_id, None) is not None
+
+    def start(self, root_id, drive_service):
+        """Follow changes under root_id from now on; cheap when already following it
+
+        drive_service replaces the polling service only when it is the feed's identity (fresher
+        credentials for the same user), when nothing is bound yet, or when the last poll failed.
+        Returns False if the feed could not be started.
+        """
+        identity = DriveClientPool.user_key(drive_service.credentials)
+        with self._lock:
+            following = self.root_id == root_id and self._page_token is not None
+            if following:
+                self._bind(drive_service, identity)
+        if not following:
+            with self._start_lock:
+                with self._lock:
+                    following = self.root_id == root_id and self._page_token is not None
+                    if following:
+                        self._bind(drive_service, identity)
+                if not following and not self._begin(root_id, drive_service, identity):
+                    return False
+        self._ensure_poller()
+        return True
+
+    def _bind(self, drive_service, identity):
+        """Poll with drive_service if it may stand in for the bound identity; called with the lock held"""
+        if self._drive_service is None or identity == self._identity:
+            self._drive_service, self._identity = drive_service, identity
+        elif self._poll_failed:
+            print("🔁 Drive Changes feed switching identity after a failed poll")
+            self._drive_service, self._identity = drive_service, identity
+            self._poll_failed = False
+            self._stats['identity_changes'] += 1
+
+    def track_files(self, file_ids):
+        """Register hub files listed outside the feed, so moving them out is reported as file_removed"""
+        with self._lock:
+            self._files.update(file_ids)
+
+    def watch_documents(self, document_ids):
+        """Publish doc_modified for these Google Docs even though they live outside the hub"""
+        with self._lock:
+            self._documents.update(document_ids)
+
+    def is_hub_folder(self, folder_id):
+        with self._lock:
+            return folder_id == self.root_id or folder_id in self._folders
+
+    def poll(self):
+        """Read the feed from the saved page token and publish its events; returns how many were published"""
+        with self._poll_lock:
+            with self._lock:
+                page_token, drive_service = self._page_token, self._drive_service
+            if not page_token or drive_service is None:
+                return 0
+
+            published = 0
+            try:
+                while True:
+                    response = drive_service.list_changes(page_token, self.FILE_FIELDS, drive_id=self.drive_id)
+                    for change in response.get('changes', []):
+                        for event in self._classify(change):
+                            self._publish(event)
+                            published += 1
+                    page_token = response.get('newStartPageToken') or response['nextPageToken']
+                    # Saved per page, so a failure part-way never re-publishes a page
+                    with self._lock:
+                        self._page_token = page_token
+                        self._stats['changes'] += len(response.get('changes', []))
+                    if response.get('newStartPageToken'):
+                        break
+            except Exception as e:
+                print(f"⚠️ Drive Changes poll failed, resuming from the last page token: {e}")
+                with self._lock:
+                    self._poll_failed = True
+                    self._stats['errors'] += 1
+                return published
+
+            with self._lock:
+                self._poll_failed = False
+                self._last_poll_at = time.time()
+                self._stats['polls'] += 1
+            if published:
+                print(f"🔔 Drive Changes feed published {published} event(s)")
+            return published
+
+    def stop(self):
+        """Stop the background poll thread, if it is running"""
+        with self._lock:
+            poller, stop = self._poller, self._poller_stop
+            self._poller = None
+        if poller:
+            stop.set()
+            poller.join(timeout=5)
+
+    def clear(self):
+        """Stop polling and forget the page token, known folders and counters; subscriptions are kept"""
+        self.stop()
+        with self._start_lock, self._poll_lock, self._lock:
+            self.root_id = None
+            self.drive_id = None
+            self._drive_service = None
+            self._identity = None
+            self._poll_failed = False
+            self._page_token = None
+            self._folders.clear()
+            self._files.clear()
+            self._documents.clear()
+            self._last_poll_at = None
+            for key in ('polls', 'changes', 'errors', 'subscriber_errors', 'identity_changes'):
+                self._stats[key] = 0
+            for kind in self._stats['events']:
+                self._stats['events'][kind] = 0
+
+    def stats(self):
+        """Return feed position, event counters and subscriber count for monitoring"""
+        now = time.time()
+        with self._lock:
+            stats = dict(self._stats)
+            stats['events'] = dict(self._stats['events'])
+            stats['root_id'] = self.root_id
+            stats['following'] = self._page_token is not None
+            stats['hub_folders'] = len(self._folders)
+            stats['tracked_files'] = len(self._files)
+            stats['watched_documents'] = len(self._documents)
+            stats['subscribers'] = len(self._subscribers)
+            stats['seconds_since_poll'] = round(now - self._last_poll_at, 1) if self._last_poll_at else None
+            stats['poller_running'] = bool(self._poller and self._poller.is_alive())
+        stats['poll_interval'] = self.poll_interval
+        return stats
+
+    def _begin(self, root_id, drive_service, identity):
+        try:
+            drive_id = drive_service.get_drive_id(root_id)
+            # Take the token before reading the tree, so folders changed meanwhile are replayed
+            page_token = drive_service.get_changes_start_token(drive_id=drive_id)
+            tree = folder_tree_cache.get_tree(root_id, drive_service)
+        except Exception as e:
+            print(f"❌ Could not start Drive Changes feed for {root_id}: {e}")
+            self._count('errors')
+            return False
+        if not tree:
+            print(f"❌ Could not start Drive Changes feed for {root_id}: folder tree unavailable")
+            self._count('errors')
+            return False
+
+        with self._lock:
+            self.root_id = root_id
+            self.drive_id = drive_id
+            self._drive_service, self._identity = drive_service, identity
+            self._poll_failed = False
+            self._page_token = page_token
+            self._folders = {
+                folder_id: {'name': folder['name'], 'parent_id': folder['parent_id']}
+                for folder_id, folder in tree['folder_map'].items()
+            }
+            self._files.clear()
+            self._last_poll_at = time.time()
+        print(f"🔔 Following Drive Changes for {root_id} ({len(self._folders)} hub folders)")
+        return True
+
+    def _classify(self, change):
+        """Update the known hub folders and files from one raw change and return its events"""
+        file = change.get('file')
+        file_id = change.get('fileId') or (file or {}).get('id')
+        gone = bool(change.get('removed') or not file or file.get('trashed'))
+
+        with self._lock:
+            root_id = self.root_id
+            if file_id == root_id:
+                return []
+            if file_id in self._folders or (file and file.get('mimeType') == self.FOLDER_MIME_TYPE):
+                return self._classify_folder(file_id, file, gone)
+
+            # Trashed items keep their parents, so a trash is attributed to the hub even when untracked
+            parents = (file or {}).get('parents', [])
+            under_hub = any(parent == root_id or parent in self._folders for parent in parents)
+            in_hub = under_hub and not gone
+            events = []
+            if in_hub:
+                kind = DriveChangeEvent.FILE_CHANGED if file_id in self._files else DriveChangeEvent.FILE_ADDED
+                self._files.add(file_id)
+                events.append(DriveChangeEvent(kind, file_id, root_id, file))
+            elif file_id in self._files or under_hub:
+                self._files.discard(file_id)
+                events.append(DriveChangeEvent(DriveChangeEvent.FILE_REMOVED, file_id, root_id, file, in_hub=False))
+            watched = in_hub or file_id in self._documents
+            if watched and not gone and file.get('mimeType') == self.DOCUMENT_MIME_TYPE:
+                events.append(DriveChangeEvent(DriveChangeEvent.DOC_MODIFIED, file_id, root_id, file, in_hub=in_hub))
+            return events
+
+    def _classify_folder(self, folder_id, file, gone):
+        """Folder half of _classify; called with the lock held"""
+        root_id = self.root_id
+        known = self._folders.get(folder_id)
+        parent_id = None if gone else next(
+            (parent for parent in file.get('parents', []) if parent == root_id or parent in self._folders), None
+        )
+
+        if known is None:
+            if parent_id is None:
+                return []
+            self._folders[folder_id] = {'name': file['name'], 'parent_id': parent_id}
+            return [DriveChangeEvent(DriveChangeEvent.FOLDER_CREATED, folder_id, root_id, file, folder_ids=[folder_id])]
+
+        subtree = self._subtree(folder_id)
+        if gone or parent_id is None:
+            for hub_folder_id in subtree:
+                self._folders.pop(hub_folder_id, None)
+            kind = DriveChangeEvent.FOLDER_TRASHED if gone else DriveChangeEvent.FOLDER_MOVED
+            return [DriveChangeEvent(kind, folder_id, root_id, file, in_hub=False, folder_ids=subtree)]
+        if parent_id != known['parent_id']:
+            known['parent_id'] = parent_id
+            known['name'] = file['name']
+            return [DriveChangeEvent(DriveChangeEvent.FOLDER_MOVED, folder_id, root_id, file, folder_ids=subtree)]
+        if file['name'] != known['name']:
+            known['name'] = file['name']
+            return [DriveChangeEvent(DriveChangeEvent.FOLDER_RENAMED, folder_id, root_id, file, folder_ids=subtree)]
+        # Only modifiedTime moved, e.g. a child was added
+        return []
+
+    def _subtree(self, folder_id):
+        """folder_id and every known hub folder below it; called with the lock held"""
+        subtree = {folder_id}
+        frontier = [folder_id]
+        while frontier:
+            parent_id = frontier.pop()
+            for child_id, folder in self._folders.items():
+                if folder['parent_id'] == parent_id and child_id not in subtree:
+                    subtree.add(child_id)
+                    frontier.append(child_id)
+        return subtree
+
+    def _publish(self, event):
+        with self._lock:
+            self._stats['events'][event.kind] += 1
+            subscribers = list(self._subscribers.values())
+        for callback, kinds in subscribers:
+            if kinds is not None and event.kind not in kinds:
+                continue
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"⚠️ Drive change subscriber failed on {event.kind} for {event.file_id}: {e}")
+                self._count('subscriber_errors')
+
+    def _ensure_poller(self):
+        """Start the background poll thread once the feed is following a hub"""
+        if self.poll_interval <= 0:
+            return
+        with self._lock:
+            if self._poller and self._poller.is_alive():
+                return
+            self._poller_stop = threading.Event()
+            self._poller = threading.Thread(
+                target=self._poll_loop, args=(self._poller_stop,), name='drive-change-feed', daemon=True
+            )
+            self._poller.start()
+        print(f"⏱️ Drive Changes poller started (every {self.poll_interval:g}s)")
+
+    def _poll_loop(self, stop):
+        while not stop.wait(self.poll_interval):
+            self.poll()
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+
+# Shared by every request thread; the caches below subscribe to it
+drive_change_feed = DriveChangeFeed()
+
+
+class FolderNameIndex:
+    """Per-folder index of convention-formatted file names, for allocating the next free vNN
+
+    Names are keyed by their version-less stem (e.g. SP-PRES_deck_20240126), and each stem keeps
+    its highest version, so allocation is a dict lookup. Folders are loaded with one names-only
+    listing; when the folder is part of a cached Marketing Hub crawl, every folder in that crawl
+    is listed in the same batched queries. Reservations are made under a lock, so concurrent
+    uploads of the same stem to the same folder always get distinct versions.
+    """
+
+    def __init__(self, ttl_seconds=None):
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get('FOLDER_NAME_INDEX_TTL', '600'))
+        self.ttl_seconds = ttl_seconds
+        # folder_id -> {'versions': {stem: {version: state}}, 'top': {stem: version}, 'loaded_at', 'template', 'rule_set'}
+        self._folders = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._stats = {
+            'reservations': 0,
+            'confirmed': 0,
+            'released': 0,
+            'loads': 0,
+            'load_errors': 0
+        }
+
+    def reserve(self, folder_id, stem, rule_set, drive_service, root_folder_id=None):
+        """Reserve and return the next free version number for stem in folder_id"""
+        self._ensure_loaded(folder_id, rule_set, drive_service, root_folder_id)
+        with self._lock:
+            entry = self._folders.get(folder_id)
+            if entry is None or entry['template'] != rule_set.template:
+                # Listing failed: still hand out distinct versions in this process, reload next time
+                entry = self._folders[folder_id] = self._new_entry(rule_set)
+            version = entry['top'].get(stem, 0) + 1
+            entry['versions'].setdefault(stem, {})[version] = 'pending'
+            entry['top'][stem] = version
+            self._stats['reservations'] += 1
+        return version
+
+    def confirm(self, reservation):
+        """Mark a reserved version as uploaded; reservation is the (folder_id, stem, version) from allocation"""
+        if not reservation:
+            return
+        folder_id, stem, version = reservation
+        with self._lock:
+            entry = self._folders.get(folder_id)
+            if entry is not None:
+                entry['versions'].setdefault(stem, {})[version] = 'confirmed'
+                entry['top'][stem] = max(entry['top'].get(stem, 0), version)
+            self._stats['confirmed'] += 1
+
+    def release(self, reservation):
+        """Give back a reserved version whose upload failed, so a retry can reuse it"""
+        if not reservation:
+            return
+        folder_id, stem, version = reservation
+        with self._lock:
+            entry = self._folders.get(folder_id)
+            versions = entry['versions'].get(stem, {}) if entry else {}
+            if versions.get(version) != 'pending':
+                return
+            del versions[version]
+            entry['top'][stem] = max(versions, default=0)
+            self._stats['released'] += 1
+
+    def on_drive_change(self, event):
+        """DriveChangeFeed subscriber: record a file added to or renamed in an indexed folder"""
+        with self._lock:
+            for folder_id in event.parents:
+                entry = self._folders.get(folder_id)
+                if entry is None:
+                    continue
+                stem, version = entry['rule_set'].version_key(event.name or '')
+                if stem is not None:
+                    entry['versions'].setdefault(stem, {}).setdefault(version, 'existing')
+                    entry['top'][stem] = max(entry['top'].get(stem, 0), version)
+
+    def invalidate(self, folder_id=None):
+        """Force a folder (or every folder when folder_id is None) to be re-listed on next use"""
+        with self._lock:
+            entries = self._folders.values() if folder_id is None else [self._folders.get(folder_id)]
+            for entry in entries:
+                if entry:
+                    entry['loaded_at'] = None
+
+    def clear(self):
+        """Drop every folder and reset counters"""
+        with self._lock:
+            self._folders.clear()
+            for key in self._stats:
+                self._stats[key] = 0
+
+    def stats(self):
+        """Return index size and allocation counters for monitoring"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['folders'] = len(self._folders)
+            stats['stems'] = sum(len(entry['top']) for entry in self._folders.values())
+        stats['ttl_seconds'] = self.ttl_seconds
+        return stats
+
+    def _ensure_loaded(self, folder_id, rule_set, drive_service, root_folder_id):
+        with self._lock:
+            if self._is_fresh(self._folders.get(folder_id), rule_set):
+                return
+
+        with self._load_lock:
+            with self._lock:
+                if self._is_fresh(self._folders.get(folder_id), rule_set):
+                    return
+                folder_ids = [
+                    candidate for candidate in self._folders_to_load(folder_id, root_folder_id)
+                    if candidate == folder_id or not self._is_fresh(self._folders.get(candidate), rule_set)
+                ]
+
+            try:
+                names_by_folder = drive_service.list_file_names(folder_ids)
+            except Exception as e:
+                print(f"⚠️ Could not list existing names for {folder_id}: {e}")
+                self._count('load_errors')
+                return
+
+            with self._lock:
+                for listed_folder_id, names in names_by_folder.items():
+                    self._folders[listed_folder_id] = self._merge(
+                        self._folders.get(listed_folder_id), names, rule_set
+                    )
+                self._stats['loads'] += 1
+            print(f"📇 Indexed file names in {len(names_by_folder)} folder(s)")
+
+    def _folders_to_load(self, folder_id, root_folder_id):
+        """The whole cached hub when folder_id belongs to it, otherwise just folder_id"""
+        tree = folder_tree_cache.peek(root_folder_id) if root_folder_id else None
+        if tree and (folder_id == root_folder_id or folder_id in tree['folder_map']):
+            return [root_folder_id] + [hub_folder_id for hub_folder_id in tree['folder_map'] if hub_folder_id != root_folder_id]
+        return [folder_id]
+
+    def _merge(self, entry, names, rule_set):
+        """Fold a fresh listing into the folder's entry, keeping in-flight reservations"""
+        if entry is None or entry['template'] != rule_set.template:
+            entry = self._new_entry(rule_set)
+        for name in names:
+            stem, version = rule_set.version_key(name)
+            if stem is not None:
+                entry['versions'].setdefault(stem, {}).setdefault(version, 'existing')
+        entry['top'] = {stem: max(versions) for stem, versions in entry['versions'].items() if versions}
+        entry['loaded_at'] = time.time()
+        return entry
+
+    def _is_fresh(self, entry, rule_set):
+        return (
+            entry is not None
+            and entry['loaded_at'] is not None
+            and entry['template'] == rule_set.template
+            and time.time() - entry['loaded_at'] < self.ttl_seconds
+        )
+
+    def _new_entry(self, rule_set):
+        return {'versions': {}, 'top': {}, 'loaded_at': None, 'template': rule_set.template, 'rule_set': rule_set}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+
+# Shared by every upload thread in the process
+folder_name_index = FolderNameIndex()
+
+
+class HubFileIndex:
+    """In-memory index of every file in the Marketing Hub, for duplicate checks without a Drive query
+
+    Files are keyed by id, with secondary maps on md5Checksum and name, so a lookup is a dict probe
+    that also catches renamed copies of the same content. The index is built once from the cached
+    folder crawl plus a batched listing of every hub folder, then kept current by the file and
+    folder events of the DriveChangeFeed it subscribes to. The build runs on a background thread;
+    until it finishes, callers fall back to a name query.
+    """
+
+    FILE_FIELDS = DriveChangeFeed.FILE_FIELDS
+
+    def __init__(self, enabled=None, change_feed=None):
+        if enabled is None:
+            enabled = os.environ.get('HUB_FILE_INDEX', '1') != '0'
+        self.enabled = enabled
+        self.change_feed = change_feed or drive_change_feed
+        self.root_id = None
+        self._files = {}
+        self._by_md5 = {}
+        self._by_name = {}
+        self._built_at = None
+        # Events that arrive while a build is listing files, replayed on top of the listing
+        self._pending_events = None
+        self._lock = threading.Lock()
+        # One build at a time; lookups never wait on it
+        self._refresh_lock = threading.Lock()
+        self._stats = {
+            'lookups': 0,
+            'md5_matches': 0,
+            'name_matches': 0,
+            'builds': 0,
+            'changes_applied': 0,
+            'errors': 0,
+            'last_build_seconds': None
+        }
+
+    def is_ready(self, root_id):
+        with self._lock:
+            return self.enabled and self.root_id == root_id and self._built_at is not None
+
+    def ensure_fresh(self, root_id, drive_service):
+        """Start a background build when the index is cold; True if lookups can be served now"""
+        if not self.enabled or not root_id:
+            return False
+        if not self.is_ready(root_id):
+            self._build_in_background(root_id, drive_service)
+            return False
+        # Already following root_id: this only hands the feed the caller's live credentials
+        self.change_feed.start(root_id, drive_service)
+        return True
+
+    def build(self, root_id, drive_service):
+        """Index every file under root_id from scratch"""
+        with self._refresh_lock:
+            self._build(root_id, drive_service)
+
+    def lookup(self, filename, file_size, md5=None):
+        """Existing hub file with the same content (md5) or the same name and similar size, else None"""
+        with self._lock:
+            self._stats['lookups'] += 1
+            if md5:
+                for file_id in self._by_md5.get(md5.lower(), ()):
+                    self._stats['md5_matches'] += 1
+                    return self._duplicate_info(self._files[file_id], file_size, 'md5')
+            for file_id in self._by_name.get(filename, ()):
+                record = self._files[file_id]
+                if abs(record['size'] - file_size) <= max(1024, file_size * 0.05):
+                    self._stats['name_matches'] += 1
+                    return self._duplicate_info(record, file_size, 'name_size')
+        return None
+
+    def on_drive_change(self, event):
+        """DriveChangeFeed subscriber: fold one file or folder event into the index"""
+        with self._lock:
+            if self._pending_events is not None:
+                self._pending_events.append(event)
+            else:
+                self._apply_event(event)
+
+    def clear(self):
+        """Drop the index and reset counters"""
+        with self._refresh_lock, self._lock:
+            self.root_id = None
+            self._files.clear()
+            self._by_md5.clear()
+            self._by_name.clear()
+            self._built_at = None
+            self._pending_events = None
+            for key in self._stats:
+                self._stats[key] = 0
+            self._stats['last_build_seconds'] = None
+
+    def stats(self):
+        """Return index size, match counters and freshness for monitoring"""
+        now = time.time()
+        with self._lock:
+            stats = dict(self._stats)
+            stats['files'] = len(self._files)
+            stats['files_with_md5'] = sum(len(file_ids) for file_ids in self._by_md5.values())
+            stats['ready'] = self._built_at is not None
+        stats['enabled'] = self.enabled
+        return stats
+
+    def _build_in_background(self, root_id, drive_service):
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+
+        def build():
+            try:
+                self._build(root_id, drive_service)
+            finally:
+                self._refresh_lock.release()
+
+        threading.Thread(target=build, name='hub-index-build', daemon=True).start()
+
+    def _build(self, root_id, drive_service):
+        started = time.time()
+        with self._lock:
+            self._pending_events = []
+        try:
+            # Follow the feed before listing, so edits made during the listing are replayed
+            if not self.change_feed.start(root_id, drive_service):
+                raise RuntimeError("Drive Changes feed unavailable")
+            tree = folder_tree_cache.get_tree(root_id, drive_service)
+            folder_ids = {root_id} | set(tree['folder_map'] if tree else ())
+            files = list(drive_service.iter_files_in(sorted(folder_ids), self.FILE_FIELDS))
+        except Exception as e:
+            print(f"❌ Hub file index build failed: {e}")
+            with self._lock:
+                self._pending_events = None
+                self._stats['errors'] += 1
+            return
+
+        self.change_feed.track_files(file['id'] for file in files)
+        elapsed = time.time() - started
+        with self._lock:
+            self.root_id = root_id
+            self._files.clear()
+            self._by_md5.clear()
+            self._by_name.clear()
+            for file in files:
+                self._put(file)
+            for event in self._pending_events:
+                self._apply_event(event)
+            self._pending_events = None
+            self._built_at = time.time()
+            self._stats['builds'] += 1
+            self._stats['last_build_seconds'] = round(elapsed, 3)
+        print(f"📇 Hub file index built: {len(files)} files in {len(folder_ids)} folders ({elapsed:.2f}s)")
+
+    def _apply_event(self, event):
+        """Fold one event into the maps; called with the lock held"""
+        self._stats['changes_applied'] += 1
+        if event.kind in (DriveChangeEvent.FILE_ADDED, DriveChangeEvent.FILE_CHANGED):
+            self._put(event.file)
+        elif event.kind == DriveChangeEvent.FILE_REMOVED:
+            self._remove(event.file_id)
+        elif not event.in_hub:
+            # A folder was trashed or moved out: so were the files below it
+            for file_id in [file_id for file_id, record in self._files.items()
+                            if event.folder_ids.intersection(record['parents'])]:
+                self._remove(file_id)
+
+    def _put(self, file):
+        self._remove(file['id'])
+        record = {
+            'id': file['id'],
+            'name': file.get('name', ''),
+            'size': int(file.get('size') or 0),
+            'md5': (file.get('md5Checksum') or '').lower() or None,
+            'parents': list(file.get('parents', [])),
+            'modified_time': file.get('modifiedTime', ''),
+            'created_time': file.get('createdTime', ''),
+            'web_link': file.get('webViewLink', '')
+        }
+        self._files[record['id']] = record
+        self._by_name.setdefault(record['name'], set()).add(record['id'])
+        if record['md5']:
+            self._by_md5.setdefault(record['md5'], set()).add(record['id'])
+
+    def _remove(self, file_id):
+        record = self._files.pop(file_id, None)
+        if not record:
+            return
+        for lookup, key in ((self._by_name, record['name']), (self._by_md5, record['md5'])):
+            file_ids = lookup.get(key)
+            if file_ids:
+                file_ids.discard(file_id)
+                if not file_ids:
+                    del lookup[key]
+
+    def _duplicate_info(self, record, file_size, match):
+        return {
+            'id': record['id'],
+            'name': record['name'],
+            'size': record['size'],
+            'created_time': record['created_time'],
+            'web_link': record['web_link'],
+            'size_difference': abs(record['size'] - file_size),
+            'match': match
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+
+# Shared by every request thread in the process
+hub_file_index = HubFileIndex()
+
+
+class NamingRulesCache:
+    """Process-wide cache of naming convention documents, kept fresh by a background poller
+
+    Requests read the cached rules without touching Drive; only a cold document is loaded
+    inline. Edits reach the cache as doc_modified events from the Drive Changes feed, which is
+    asked to watch each document read; the poller re-checks each document's modifiedTime every
+    refresh_interval seconds as a backstop and re-exports it only when it changed.
+    """
+
+    def __init__(self, refresh_interval=None, change_feed=None):
+        if refresh_interval is None:
+            refresh_interval = float(os.environ.get('NAMING_RULES_REFRESH_INTERVAL', '300'))
+        self.refresh_interval = refresh_interval
+        self.change_feed = change_feed or drive_change_feed
+        self._entries = {}
+        # Most recent DriveService seen per document, so the poller refreshes with live credentials
+        self._sources = {}
+        self._lock = threading.Lock()
+        self._poller = None
+        self._poller_stop = None
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'checks': 0,
+            'refreshes': 0,
+            'errors': 0,
+            'last_check_at': None
+        }
+
+    def get_rules(self, document_id, drive_service):
+        """Return the cached entry for document_id, loading it from Drive only when cold"""
+        with self._lock:
+            entry = self._entries.get(document_id)
+            if drive_service is not None:
+                self._sources[document_id] = drive_service
+        self.change_feed.watch_documents((document_id,))
+
+        if entry:
+            self._count('hits')
+            self._ensure_poller()
+            return entry
+
+        def load():
+            with self._lock:
+                entry = self._entries.get(document_id)
+            if entry:
+                self._count('hits')
+                return entry
+            self._count('misses')
+            return self._refresh(document_id, drive_service, False)
+
+        # Cold cache: one request loads the document while concurrent ones wait for it
+        entry = single_flight.do('naming_rules', (document_id, False), load)
+        self._ensure_poller()
+        return entry
+
+    def refresh(self, document_id, drive_service=None, force=False):
+        """Re-export document_id if its modifiedTime changed (or force is set); return the current entry
+
+        Concurrent refreshes of the same document (poller, change feed, cold loads) share one check.
+        """
+        return single_flight.do(
+            'naming_rules', (document_id, force), lambda: self._refresh(document_id, drive_service, force)
+        )
+
+    def _refresh(self, document_id, drive_service, force):
+        with self._lock:
+            entry = self._entries.get(document_id)
+            drive_service = drive_service or self._sources.get(document_id)
+
+        if not drive_service or not drive_service.is_available():
+            print("❌ Drive service not available for naming rules refresh")
+            return entry
+
+        try:
+            file_metadata = drive_service.get_thread_service().files().get(
+                fileId=document_id,
+                fields="modifiedTime,name"
+            ).execute()
+            modified_time = file_metadata.get('modifiedTime')
+            now = time.time()
+            with self._lock:
+                self._stats['checks'] += 1
+                self._stats['last_check_at'] = now
+
+            if entry and not force and entry['modified_time'] == modified_time:
+                entry['checked_at'] = now
+                return entry
+
+            print(f"📖 Reading naming convention document: {file_metadata.get('name', document_id)}")
+            rules = drive_service.read_document(document_id)
+            if not rules:
+                print("❌ Failed to read document content, keeping existing cache")
+                self._count('errors')
+                return entry
+
+            entry = {'rules': rules, 'modified_time': modified_time, 'fetched_at': now, 'checked_at': now}
+            with self._lock:
+                self._entries[document_id] = entry
+                self._stats['refreshes'] += 1
+            print(f"✅ Naming convention rules cached (Modified: {modified_time}, {len(rules)} characters)")
+            return entry
+
+        except Exception as e:
+            print(f"❌ Error refreshing naming convention cache: {e}")
+            self._count('errors')
+            return entry
+
+    def on_drive_change(self, event):
+        """DriveChangeFeed subscriber: re-export a cached document as soon as it is edited"""
+        with self._lock:
+            entry = self._entries.get(event.file_id)
+        if entry and entry['modified_time'] != event.file.get('modifiedTime'):
+            self.refresh(event.file_id)
+
+    def _ensure_poller(self):
+        """Start the background poller once there is a document to watch"""
+        if self.refresh_interval <= 0:
+            return
+        with self._lock:
+            if self._poller and self._poller.is_alive():
+                return
+            self._poller_stop = threading.Event()
+            self._poller = threading.Thread(
+                target=self._poll, args=(self._poller_stop,), name='naming-rules-poller', daemon=True
+            )
+            self._poller.start()
+        print(f"⏱️ Naming rules poller started (every {self.refresh_interval:g}s)")
+
+    def _poll(self, stop):
+        while not stop.wait(self.refresh_interval):
+            with self._lock:
+                document_ids = list(self._sources)
+            for document_id in document_ids:
+                self.refresh(document_id)
+
+    def stop(self):
+        """Stop the background poller, if it is running"""
+        with self._lock:
+            poller, stop = self._poller, self._poller_stop
+            self._poller = None
+        if poller:
+            stop.set()
+            poller.join(timeout=5)
+
+    def clear(self):
+        """Stop the poller, drop all cached documents and reset counters"""
+        self.stop()
+        with self._lock:
+            self._entries.clear()
+            self._sources.clear()
+            for key in self._stats:
+                self._stats[key] = 0
+            self._stats['last_check_at'] = None
+
+    def stats(self):
+        """Return cache age and refresh counters for monitoring"""
+        now = time.time()
+        with self._lock:
+            stats = dict(self._stats)
+            stats['documents'] = {
+                document_id: {
+                    'modified_time': entry['modified_time'],
+                    'age_seconds': round(now - entry['fetched_at'], 1),
+                    'checked_seconds_ago': round(now - entry['checked_at'], 1),
+                    'rules_length': len(entry['rules'])
+                }
+                for document_id, entry in self._entries.items()
+            }
+            stats['poller_running'] = bool(self._poller and self._poller.is_alive())
+
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else None
+        if stats['last_check_at'] is not None:
+            stats['last_check_at'] = datetime.fromtimestamp(stats['last_check_at']).isoformat()
+        stats['refresh_interval'] = self.refresh_interval
+        return stats
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+
+# Shared by every request thread in the process; the poller keeps it warm between requests
+naming_rules_cache = NamingRulesCache()
+
+# Process-wide caches follow the hub through the shared Changes feed
+drive_change_feed.subscribe(folder_tree_cache.on_drive_change, DriveChangeEvent.FOLDER_KINDS)
+drive_change_feed.subscribe(folder_name_index.on_drive_change, (DriveChangeEvent.FILE_ADDED, DriveChangeEvent.FILE_CHANGED))
+drive_change_feed.subscribe(hub_file_index.on_drive_change, DriveChangeEvent.FILE_KINDS + DriveChangeEvent.FOLDER_KINDS)
+drive_change_feed.subscribe(naming_rules_cache.on_drive_change, (DriveChangeEvent.DOC_MODIFIED,))
+
+
+class GoogleHttpTransport:
+    """Shared keep-alive HTTP transport for all Google API calls
+    
+    OAuth token exchange, userinfo, token refresh and raw upload-session calls share one
+    requests.Session whose connection pool is sized to the server's thread count. Drive clients
+    wrap one persistent httplib2.Http per thread, so a TLS connection to googleapis.com
+    outlives the request that opened it. Both sides count requests against newly opened
+    connections, which makes reuse visible in stats().
+    """
+    
+    def __init__(self, pool_size=None):
+        # gunicorn runs --threads 8; every thread may hold one connection per Google host
+        self.pool_size = pool_size or int(os.environ.get('HTTP_POOL_SIZE', '8'))
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._drive_requests = 0
+        self._drive_connections = 0
+    
+    def auth_request(self):
+        """google-auth transport for credential refreshes over the pooled session"""
+        return AuthRequest(session=self.session)
+    
+    def thread_http(self):
+        """This thread's persistent httplib2 connection holder (httplib2 is not thread-safe)"""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = _CountingHttp(self)
+            self._local.http = http
+        return http
+    
+    def authorized_http(self, credentials):
+        """Per-user authorized wrapper around this thread's persistent connections"""
+        return google_auth_httplib2.AuthorizedHttp(credentials, http=self.thread_http())
+    
+    def _record_drive(self, requests_made, new_connections):
+        with self._lock:
+            self._drive_requests += requests_made
+            self._drive_connections += new_connections
+    
+    def stats(self):
+        http_requests = 0
+        http_connections = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                http_requests += pool.num_requests
+                http_connections += pool.num_connections
+        with self._lock:
+            drive_requests = self._drive_requests
+            drive_connections = self._drive_connections
+        return {
+            'pool_size': self.pool_size,
+            'http': self._reuse_stats(http_requests, http_connections),
+            'drive': self._reuse_stats(drive_requests, drive_connections)
+        }
+    
+    @staticmethod
+    def _reuse_stats(requests_made, connections):
+        return {
+            'requests': requests_made,
+            'connections_opened': connections,
+            'reused_requests': max(0, requests_made - connections),
+            'reuse_ratio': round(1 - connections / requests_made, 3) if requests_made else None
+        }
+
+
+class _CountingHttp(httplib2.Http):
+    """httplib2.Http that reports requests and newly opened sockets to the transport"""
+    
+    def __init__(self, transport):
+        super().__init__()
+        # 308 means "resume incomplete" for resumable uploads, as in googleapiclient.http.build_http
+        self.redirect_codes = self.redirect_codes - {308}
+        self._transport = transport
+        self._seen_sockets = weakref.WeakSet()
+    
+    def request(self, *args, **kwargs):
+        self._apply_deadline()
+        try:
+            return super().request(*args, **kwargs)
+        finally:
+            new_connections = 0
+            for connection in list(self.connections.values()):
+                sock = getattr(connection, 'sock', None)
+                if sock is not None and sock not in self._seen_sockets:
+                    self._seen_sockets.add(sock)
+                    new_connections += 1
+            self._transport._record_drive(1, new_connections)
+
+    def _apply_deadline(self):
+        """Use the workflow step's remaining budget as the socket timeout, or none outside a step"""
+        timeout = Deadline.thread_remaining()
+        if timeout == 0:
+            raise socket.timeout("Workflow step deadline passed before the Drive request was sent")
+        if timeout == self.timeout:
+            return
+        self.timeout = timeout
+        for connection in self.connections.values():
+            connection.timeout = timeout
+            if getattr(connection, 'sock', None) is not None:
+                connection.sock.settimeout(timeout)
+
+
+google_http_transport = GoogleHttpTransport()
+
+
+class DriveClientPool:
+    """Process-wide pool of Drive API clients keyed by user and thread
+    
+    Building a client parses the discovery document and sets up httplib2, so each (user, thread)
+    pair builds one from the static discovery doc and reuses it across requests. httplib2 is not
+    thread-safe, hence one client per thread rather than one per user.
+    """
+    
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or int(os.environ.get('DRIVE_CLIENT_POOL_MAX', '64'))
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._builds = 0
+        self._evictions = 0
+    
+    @staticmethod
+    def user_key(credentials):
+        """Stable per-user key; the refresh token outlives access tokens, and neither is kept in the key"""
+        identity = getattr(credentials, 'refresh_token', None) or getattr(credentials, 'token', None) or ''
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()[:16]
+    
+    def get(self, credentials):
+        """Return this thread's client for the user, building it on first use"""
+        key = (self.user_key(credentials), threading.get_ident())
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry:
+                self._clients.move_to_end(key)
+                self._hits += 1
+        
+        if entry:
+            pooled_credentials, service = entry
+            if pooled_credentials is not credentials:
+                # Same user, newer request: carry over a refreshed access token
+                pooled_credentials.token = credentials.token
+                pooled_credentials.expiry = getattr(credentials, 'expiry', None)
+            return service
+        
+        service = build('drive', 'v3', http=google_http_transport.authorized_http(credentials),
+                        static_discovery=True, cache_discovery=False)
+        with self._lock:
+            self._builds += 1
+            self._clients[key] = (credentials, service)
+            while len(self._clients) > self.max_entries:
+                self._clients.popitem(last=False)
+                self._evictions += 1
+        return service
+    
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self._hits = 0
+            self._builds = 0
+            self._evictions = 0
+    
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._builds
+            return {
+                'clients': len(self._clients),
+                'hits': self._hits,
+                'builds': self._builds,
+                'evictions': self._evictions,
+                'hit_ratio': round(self._hits / lookups, 3) if lookups else None
+            }
+
+
+drive_client_pool = DriveClientPool()
+
+
+class DriveService:
+    """Handle Google Drive API integration for folder structure reading"""
+
+    # Limits for packing many parent ids into one `'a' in parents or 'b' in parents` query
+    FOLDER_QUERY_MAX_PARENTS = 40
+    FOLDER_QUERY_MAX_LENGTH = 2000
+
+    # Backoff for 403 rateLimitExceeded / 429 responses
+    RATE_LIMIT_MAX_RETRIES = 5
+    RATE_LIMIT_BACKOFF_BASE = 0.5
+    RATE_LIMIT_BACKOFF_MAX = 16.0
+    
+    def __init__(self, credentials=None, max_workers=None):
+        self.credentials = credentials
+        self.service = None
+        # Parallel crawl mode is enabled when more than one worker is allowed
+        self.max_workers = max_workers or int(os.environ.get('DRIVE_CRAWL_MAX_WORKERS', '4'))
+        # Optional callable returning a fresh client for worker threads (tests inject fakes here)
+        self.service_factory = None
+        self._owner_thread = threading.get_ident()
+        self._local = threading.local()
+        
+        if credentials:
+            try:
+                # Ensure credentials have the required token
+                if hasattr(credentials, 'token') and credentials.token:
+                    self.service = drive_client_pool.get(credentials)
+                    print("✅ Drive API service initialized successfully with valid credentials")
+                else:
+                    print("❌ Drive API credentials missing token")
+            except Exception as e:
+                print(f"❌ Drive service initialization error: {e}")
+        else:
+            print("❌ No credentials provided for Drive API")
+    
+    def is_available(self):
+        """Check if Drive API is available
+        
+        Decided from the credentials alone, without a network round trip: a token that has not
+        expired, or an expired one google-auth can refresh on the next call. Clients injected
+        without credentials count as available.
+        """
+        if self.service is None:
+            print(f"❌ Drive API Available: False (No service initialized)")
+            return False
+        if self.credentials is None:
+            return True
+        
+        token_usable = bool(getattr(self.credentials, 'token', None)) and not getattr(self.credentials, 'expired', False)
+        if token_usable or getattr(self.credentials, 'refresh_token', None):
+            return True
+        
+        print("❌ Drive API Available: False (Access token expired and cannot be refreshed)")
+        return False
+    
+    def read_document(self, file_id):
+        """Read a Google Docs document content"""
+        if not self.is_available():
+            print("❌ Drive API not available for document reading")
+            return None
+        
+        try:
+            print(f"📖 Reading document: {file_id}")
+            result = self.get_thread_service().files().export(
+                fileId=file_id,
+                mimeType='text/plain'
+            ).execute()
+            
+            content = result.decode('utf-8')
+            print(f"✅ Document read successfully: {len(content)} characters")
+            return content
+            
+        except Exception as e:
+            print(f"❌ Document read error: {e}")
+            return None
+    
+    def get_real_folder_structure(self, folder_id, max_depth=3):
+        """Step 2: Get real folder structure from Marketing Hub"""
+        if not self.is_available():
+            print("❌ Step 2: Drive API not available, using fallback folder structure")
+            return self._fallback_folder_structure()
+        
+        try:
+            print(f"📁 Step 2: Reading real folder structure from Marketing Hub: {folder_id}")
+
+            tree = self.get_folder_tree(folder_id, max_depth)
+            if not tree:
+                return self._fallback_folder_structure()
+
+            print(f"✅ Step 2 Complete: Real folder structure read ({len(tree['folders'])} folders)")
+            return tree['structure']
+
+        except Exception as e:
+            print(f"❌ Step 2 Error: Folder structure reading failed: {e}")
+            return self._fallback_folder_structure()
+
+    def get_folder_tree(self, folder_id, max_depth=3):
+        """Get the crawled folder tree (folders, folder_map, structure) via the shared cache"""
+        return folder_tree_cache.get_tree(folder_id, self, max_depth)
+
+    def _crawl_folder_tree(self, folder_id, max_depth):
+        """Crawl the folder tree under folder_id and return a cache entry, or None on failure"""
+        # First, verify we can access the folder
+        try:
+            folder_info = self.get_thread_service().files().get(fileId=folder_id, fields="id,name,modifiedTime").execute()
+            print(f"✅ Successfully accessed folder: {folder_info.get('name', 'Unknown')}")
+        except Exception as e:
+            print(f"❌ Cannot access Marketing Hub folder {folder_id}: {e}")
+            return None
+
+        folders = []
+        folder_map = {}
+        self._get_folders_breadth_first(folder_id, folders, folder_map, max_depth)
+
+        if not folders:
+            print("⚠️ No folders found in Marketing Hub, using fallback")
+            return None
+
+        now = time.time()
+        return {
+            'root_id': folder_id,
+            'folders': folders,
+            'folder_map': folder_map,
+            'structure': self._format_folder_structure_for_gemini(folders, folder_map),
+            'path_index': FolderPathIndex(folder_id, folders),
+            'root_modified': folder_info.get('modifiedTime'),
+            'newest_modified': max(
+                [folder_info.get('modifiedTime') or ''] + [folder.get('modifiedTime') or '' for folder in folders]
+            ),
+            'max_depth': max_depth,
+            'fetched_at': now,
+            'checked_at': now
+        }
+
+    def _probe_hub_changed(self, folder_id, entry):
+        """Cheap revalidation: has any folder in the crawled tree changed, at any depth?
+
+        One get for the root, then one query for folders (trashed ones included) modified after the
+        newest modifiedTime in the crawl. A hub folder, or a folder with a hub parent, in the results
+        means the tree changed. Returns None if the probe failed.
+        """
+        try:
+            service = self.get_thread_service()
+            root_info = self._execute(service.files().get(fileId=folder_id, fields="id,modifiedTime"))
+            if root_info.get('modifiedTime') != entry['root_modified']:
+                return True
+
+            hub_folder_ids = set(entry['folder_map']) | {folder_id}
+            query = (f"mimeType='application/vnd.google-apps.folder' "
+                     f"and modifiedTime > '{entry['newest_modified']}'")
+            page_token = None
+            while True:
+                results = self._execute(service.files().list(
+                    q=query,
+                    fields="nextPageToken, files(id,parents)",
+                    pageSize=1000,
+                    pageToken=page_token
+                ))
+                for folder in results.get('files', []):
+                    if folder['id'] in hub_folder_ids or hub_folder_ids.intersection(folder.get('parents', [])):
+                        return True
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    return False
+        except Exception as e:
+            print(f"⚠️ Folder tree revalidation probe failed: {e}")
+            return None
+
+    def _get_folders_breadth_first(self, root_id, folders, folder_map, max_depth):
+        """Level-order crawl: one OR-ed parents query per batch of parent ids at each depth"""
+        level_parents = [root_id]
+
+        for depth in range(max_depth):
+            if not level_parents:
+                break
+
+            parent_set = set(level_parents)
+            next_level = []
+
+            for children in self._list_child_folders_for_batches(level_parents, depth):
+                for folder in children:
+                    # Reconstruct the hierarchy from the returned parents field
+                    parent_id = next((p for p in folder.get('parents', []) if p in parent_set), None)
+                    if parent_id is None or folder['id'] in folder_map:
+                        continue
+
+                    folder_info = {
+                        'id': folder['id'],
+                        'name': folder['name'],
+                        'modifiedTime': folder.get('modifiedTime'),
+                        'depth': depth,
+                        'parent_id': parent_id,
+                        'path': self._build_folder_path(folder['name'], parent_id, folder_map)
+                    }
+                    folders.append(folder_info)
+                    folder_map[folder['id']] = folder_info
+                    next_level.append(folder['id'])
+
+            level_parents = next_level
+
+    def _list_child_folders_for_batches(self, parent_ids, depth):
+        """List children for every parent batch of one level, fanning out over a bounded thread pool"""
+        batches = list(self._batch_parent_ids(parent_ids))
+
+        def list_batch(batch):
+            try:
+                return self._list_child_folders(batch)
+            except Exception as e:
+                print(f"❌ Error reading folders at depth {depth}: {e}")
+                return []
+
+        workers = min(self.max_workers, len(batches))
+        if workers <= 1:
+            return [list_batch(batch) for batch in batches]
+
+        print(f"⚡ Crawling {len(batches)} folder batches at depth {depth} with {workers} workers")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='drive-crawl') as executor:
+            # map() keeps results in batch order so the crawl output stays deterministic
+            return list(executor.map(list_batch, batches))
+
+    def get_thread_service(self):
+        """Return a Drive client owned by the calling thread (httplib2 is not thread-safe)"""
+        if self.service is None or threading.get_ident() == self._owner_thread:
+            return self.service
+
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            if self.service_factory:
+                service = self.service_factory()
+            else:
+                service = drive_client_pool.get(self.credentials)
+            self._local.service = service
+        return service
+
+    def _execute(self, request):
+        """Execute a Drive request, backing off exponentially with jitter when rate limited"""
+        for attempt in range(self.RATE_LIMIT_MAX_RETRIES + 1):
+            try:
+                return request.execute()
+            except HttpError as e:
+                if attempt >= self.RATE_LIMIT_MAX_RETRIES or not self._is_rate_limited(e):
+                    raise
+                delay = min(self.RATE_LIMIT_BACKOFF_MAX, self.RATE_LIMIT_BACKOFF_BASE * (2 ** attempt))
+                delay *= 0.5 + random.random() / 2
+                remaining = Deadline.thread_remaining()
+                if remaining is not None and delay >= remaining:
+                    # The retry would land after the workflow step's deadline
+                    raise
+                print(f"⏳ Drive rate limit hit, retrying in {delay:.2f}s (attempt {attempt + 1})")
+                time.sleep(delay)
+
+    def _is_rate_limited(self, error):
+        """True for 429s and 403 rateLimitExceeded / userRateLimitExceeded responses"""
+        status = getattr(error.resp, 'status', None)
+        if status == 429:
+            return True
+        content = error.content.decode('utf-8', 'ignore') if isinstance(error.content, bytes) else str(error.content)
+        return status == 403 and ('rateLimitExceeded' in content or 'userRateLimitExceeded' in content)
+
+    def _batch_parent_ids(self, parent_ids):
+        """Split parent ids into batches that keep the OR-ed query under Drive's length limits"""
+        return self._batch_query_terms(parent_ids, lambda parent_id: f"'{parent_id}' in parents")
+
+    def _batch_query_terms(self, terms, clause):
+        """Group terms so that their OR-ed clauses stay under the per-query count and length limits"""
+        batch = []
+        length = 0
+        for term in terms:
+            clause_length = len(clause(term)) + len(" or ")
+            if batch and (len(batch) >= self.FOLDER_QUERY_MAX_PARENTS
+                          or length + clause_length > self.FOLDER_QUERY_MAX_LENGTH):
+                yield batch
+                batch = []
+                length = 0
+            batch.append(term)
+            length += clause_length
+        if batch:
+            yield batch
+
+    def check_file_exists(self, filename, file_size, folder_id=None, md5=None):
+        """Check whether a file with the same content, or the same name and size, already exists
         
+        Single-file form of find_duplicates; with folder_id (the hub root) it is an in-memory
+        hub_file_index probe that also catches renamed copies when md5 is known.
+        """
         try:
-            query = f"'{parent_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
-            results = self.service.files().list(
-                q=query,
-                fields="files(id, name, parents)",
-                orderBy="name"
-            ).execute()
-            
-            for folder in results.get('files', []):
-                folder_info = {
-                    'id': folder['id'],
-                    'name': folder['name'],
-                    'depth': depth,
-                    'parent_id': parent_id,
-                    'path': self._build_folder_path(folder['name'], parent_id, folder_map)
-                }
-                folders.append(folder_info)
-                folder_map[folder['id']] = folder_info
-                
-                # Recurse into subfolders
-                self._get_folders_recursive(folder['id'], folders, folder_map, depth + 1, max_depth)
-                
+            print(f"🔍 Checking for duplicate files: {filename} ({file_size} bytes)")
+            duplicates = self.find_duplicates(
+                [{'filename': filename, 'file_size': file_size, 'md5': md5}], folder_id
+            )
+            return duplicates.get(0)
         except Exception as e:
-            print(f"❌ Error reading folders at depth {depth}: {e}")
-    
+            print(f"❌ Duplicate check error: {e}")
+            # Return None instead of raising exception to allow workflow to continue
+            return None
+
+    def find_duplicates(self, files, folder_id=None):
+        """Batch duplicate check: hub index probes, or one OR-ed name query for all files
+        
+        Returns {index in files: duplicate_info} for files that already exist, so two items with the
+        same name are judged on their own size and md5. Files may carry an 'md5'.
+        Without the index, matches are on name and size, and when the folder tree under folder_id
+        is cached, matches outside the Marketing Hub are ignored.
+        """
+        if not files or not self.is_available():
+            return {}
+
+        if hub_file_index.ensure_fresh(folder_id, self):
+            duplicates = {}
+            for position, file_info in enumerate(files):
+                duplicate = hub_file_index.lookup(file_info['filename'], file_info['file_size'], file_info.get('md5'))
+                if duplicate:
+                    print(f"⚠️ Duplicate found in hub index ({duplicate['match']}): "
+                          f"{duplicate['name']} (ID: {duplicate['id']})")
+                    duplicates[position] = duplicate
+            print(f"🔍 Duplicate check (hub index): {len(duplicates)} of {len(files)} files already exist")
+            return duplicates
+
+        hub_folder_ids = None
+        tree = folder_tree_cache.peek(folder_id) if folder_id else None
+        if tree:
+            hub_folder_ids = set(tree['folder_map']) | {folder_id}
+
+        names = sorted({file_info['filename'] for file_info in files})
+        name_clause = lambda name: f"name='{self._escape_query_value(name)}'"
+        candidates = {}
+        service = self.get_thread_service()
+
+        for batch in self._batch_query_terms(names, name_clause):
+            query = (f"({' or '.join(name_clause(name) for name in batch)}) "
+                     f"and mimeType!='application/vnd.google-apps.folder' and trashed=false")
+            page_token = None
+            while True:
+                results = self._execute(service.files().list(
+                    q=query,
+                    fields="nextPageToken, files(id,name,size,parents,createdTime,webViewLink)",
+                    pageSize=1000,
+                    pageToken=page_token
+                ))
+                for item in results.get('files', []):
+                    if hub_folder_ids is not None and not hub_folder_ids.intersection(item.get('parents', [])):
+                        continue
+                    candidates.setdefault(item['name'], []).append(item)
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+
+        duplicates = {}
+        for position, file_info in enumerate(files):
+            duplicate = self._match_duplicate(candidates.get(file_info['filename'], []), file_info['file_size'])
+            if duplicate:
+                print(f"⚠️ Potential duplicate found: {duplicate['name']} (ID: {duplicate['id']})")
+                duplicates[position] = duplicate
+
+        print(f"🔍 Duplicate check: {len(duplicates)} of {len(files)} files already exist")
+        return duplicates
+
+    def _match_duplicate(self, candidates, file_size):
+        """Pick the first existing file whose size is within 5% (or 1KB) of file_size"""
+        for file in candidates:
+            existing_size = int(file.get('size', 0))
+            size_diff = abs(existing_size - file_size)
+            size_threshold = max(1024, file_size * 0.05)  # 5% or 1KB threshold
+
+            if size_diff <= size_threshold:
+                return {
+                    'id': file['id'],
+                    'name': file['name'],
+                    'size': existing_size,
+                    'created_time': file.get('createdTime', ''),
+                    'web_link': file.get('webViewLink', ''),
+                    'size_difference': size_diff,
+                    'match': 'name_size'
+                }
+        return None
+
+    def _escape_query_value(self, value):
+        """Escape a string literal for a Drive `q` expression"""
+        return value.replace("\\", "\\\\").replace("'", "\\'")
+
+    def _list_child_folders(self, parent_ids):
+        """List every child folder of the given parents in one query, following nextPageToken"""
+        parents_clause = " or ".join(f"'{parent_id}' in parents" for parent_id in parent_ids)
+        query = f"({parents_clause}) and mimeType='application/vnd.google-apps.folder' and trashed=false"
+
+        children = []
+        page_token = None
+        service = self.get_thread_service()
+        while True:
+            results = self._execute(service.files().list(
+                q=query,
+                fields="nextPageToken, files(id, name, parents, modifiedTime)",
+                orderBy="name",
+                pageSize=1000,
+                pageToken=page_token
+            ))
+            children.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return children
+
+    def list_file_names(self, folder_ids):
+        """Names of the non-folder files directly inside each folder, as {folder_id: [name, ...]}"""
+        names_by_folder = {folder_id: [] for folder_id in folder_ids}
+        for item in self.iter_files_in(folder_ids, "name, parents"):
+            for parent_id in item.get('parents', []):
+                if parent_id in names_by_folder:
+                    names_by_folder[parent_id].append(item['name'])
+        return names_by_folder
+
+    def iter_files_in(self, folder_ids, fields):
+        """Yield every non-folder file directly inside any of folder_ids, in batched OR-ed queries"""
+        service = self.get_thread_service()
+        for batch in self._batch_parent_ids(folder_ids):
+            parents_clause = " or ".join(f"'{parent_id}' in parents" for parent_id in batch)
+            query = f"({parents_clause}) and mimeType!='application/vnd.google-apps.folder' and trashed=false"
+            page_token = None
+            while True:
+                results = self._execute(service.files().list(
+                    q=query,
+                    fields=f"nextPageToken, files({fields})",
+                    pageSize=1000,
+                    pageToken=page_token
+                ))
+                yield from results.get('files', [])
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+
+    def get_drive_id(self, folder_id):
+        """Shared drive id holding folder_id, or None when it lives in My Drive"""
+        folder_info = self._execute(self.get_thread_service().files().get(
+            fileId=folder_id, fields="id,driveId", supportsAllDrives=True
+        ))
+        return folder_info.get('driveId')
+
+    def get_changes_start_token(self, drive_id=None):
+        """Page token for the current head of the Drive Changes feed (of a shared drive when drive_id is set)"""
+        response = self._execute(self.get_thread_service().changes().getStartPageToken(
+            **self._changes_drive_params(drive_id, listing=False)
+        ))
+        return response['startPageToken']
+
+    def list_changes(self, page_token, file_fields, drive_id=None):
+        """One page of the Changes feed from page_token, including removals"""
+        return self._execute(self.get_thread_service().changes().list(
+            pageToken=page_token,
+            pageSize=1000,
+            includeRemoved=True,
+            fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({file_fields}))",
+            **self._changes_drive_params(drive_id, listing=True)
+        ))
+
+    @staticmethod
+    def _changes_drive_params(drive_id, listing):
+        if not drive_id:
+            return {}
+        params = {'driveId': drive_id, 'supportsAllDrives': True}
+        if listing:
+            params['includeItemsFromAllDrives'] = True
+        return params
+
     def _build_folder_path(self, folder_name, parent_id, folder_map):
         """Build full folder path"""
         if parent_id in folder_map:
@@ -548,112 +3328,7 @@ class DriveService:
 • Compliance: Certifications, legal documents"""
 
 
-class NamingConventionService:
-    """Handle naming convention document processing with version-based cache"""
-    
-    def __init__(self, drive_service=None, document_id=None):
-        self.drive_service = drive_service
-        self.document_id = document_id or "1IqpsMdfAjGx3H2l6SyRWcRH3red40c6AosMORn0oQes"
-        self._cached_rules = None
-        self._cached_modified_time = None
-    
-    def get_naming_rules(self):
-        """Get naming convention rules from document with version-based cache"""
-        # Check if document has been modified since last cache
-        if self._should_refresh_cache():
-            print(f"🔄 Document modified, refreshing naming convention cache")
-            self._refresh_cache()
-        
-        # Return cached rules if available
-        if self._cached_rules:
-            return self._cached_rules
-        
-        # Fallback if no cached rules available
-        print("🔄 Using fallback naming convention rules")
-        return self._fallback_naming_rules()
-    
-    def _should_refresh_cache(self):
-        """Check if cache should be refreshed based on document modification time"""
-        if not self._cached_rules or not self._cached_modified_time:
-            print("📝 No cached rules or modification time, refresh needed")
-            return True
-        
-        if not self.drive_service or not self.drive_service.is_available():
-            print("❌ Drive service not available, using cached rules")
-            return False
-        
-        try:
-            # Get document metadata to check last modified time
-            print(f"🔍 Checking document modification time: {self.document_id}")
-            file_metadata = self.drive_service.service.files().get(
-                fileId=self.document_id,
-                fields="modifiedTime,version"
-            ).execute()
-            
-            current_modified_time = file_metadata.get('modifiedTime')
-            current_version = file_metadata.get('version', 'unknown')
-            
-            print(f"📅 Current modified time: {current_modified_time}")
-            print(f"📅 Cached modified time: {self._cached_modified_time}")
-            print(f"🔢 Document version: {current_version}")
-            
-            # Check if document has been modified
-            if current_modified_time != self._cached_modified_time:
-                print("✅ Document has been modified, cache refresh needed")
-                return True
-            else:
-                print("✅ Document unchanged, using cached rules")
-                return False
-                
-        except Exception as e:
-            print(f"⚠️ Error checking document modification time: {e}")
-            print("🔄 Continuing with cached rules due to metadata check failure")
-            return False
-    
-    def _refresh_cache(self):
-        """Refresh the cache by reading the document and updating metadata"""
-        if not self.drive_service or not self.drive_service.is_available():
-            print("❌ Drive service not available for cache refresh")
-            return
-        
-        try:
-            # Get document metadata first
-            file_metadata = self.drive_service.service.files().get(
-                fileId=self.document_id,
-                fields="modifiedTime,version,name"
-            ).execute()
-            
-            current_modified_time = file_metadata.get('modifiedTime')
-            document_name = file_metadata.get('name', 'Unknown Document')
-            
-            print(f"📖 Reading updated naming convention document: {document_name}")
-            
-            # Read the document content
-            rules = self.drive_service.read_document(self.document_id)
-            
-            if rules:
-                # Update cache with new rules and metadata
-                self._cached_rules = rules
-                self._cached_modified_time = current_modified_time
-                print(f"✅ Naming convention rules updated from document (Modified: {current_modified_time})")
-                print(f"📊 Rules length: {len(rules)} characters")
-            else:
-                print("❌ Failed to read document content, keeping existing cache")
-                
-        except Exception as e:
-            print(f"❌ Error refreshing naming convention cache: {e}")
-            print("🔄 Keeping existing cached rules")
-    
-    def force_refresh(self):
-        """Force refresh the cache (useful for manual refresh operations)"""
-        print("🔄 Force refreshing naming convention cache")
-        self._cached_rules = None
-        self._cached_modified_time = None
-        return self.get_naming_rules()
-    
-    def _fallback_naming_rules(self):
-        """Enhanced fallback naming convention rules"""
-        return """Skylark Drones File Naming Convention:
+FALLBACK_NAMING_RULES = """Skylark Drones File Naming Convention:
 
 Format: PREFIX-CATEGORY_description_YYYYMMDD_vNN.ext
 
@@ -681,41 +3356,291 @@ EXAMPLES:
 - BS-AGR_crop_monitoring_20240126_v02.pptx
 - DMO-TECH_software_platform_guide_20240126_v01.pdf
 - MA-BRAND_corporate_profile_20240126_v01.pdf"""
+
+
+class NamingRuleSet:
+    """Naming convention document compiled into prefix/category code tables and a filename template
+
+    Built once per document version by compile(); generates filenames deterministically and
+    renders the compact code table that is sent to Gemini in place of the full document.
+    """
+
+    DEFAULT_TEMPLATE = 'PREFIX-CATEGORY_description_YYYYMMDD_vNN.ext'
+    DEFAULT_PREFIX = 'MA'
+    DEFAULT_CATEGORY = 'GEN'
+    # Gemini's content categories that don't share a code with the naming document
+    CATEGORY_ALIASES = {
+        'TECHNICAL': 'TECH',
+        'SALES': 'PRES',
+        'PRESENTATION': 'PRES',
+        'MARKETING': 'MARK',
+        'GENERAL': 'GEN'
+    }
+    TEMPLATE_TOKENS = re.compile(r'PREFIX|CATEGORY|description|YYYYMMDD|vNN|\.ext')
+    DESCRIPTION_LENGTH = 20
+
+    _ITEM_PATTERN = re.compile(r'^[-*•]?\s*([A-Z][A-Z0-9]{1,7})\s*(?::|=|–|—|\s-)\s*(.+)$')
+    _compiled = OrderedDict()
+    _compiled_lock = threading.Lock()
+    _COMPILED_MAX = 16
+
+    def __init__(self, prefixes, categories, template=None, examples=None, version=None):
+        self.prefixes = prefixes
+        self.categories = categories
+        self.template = template or self.DEFAULT_TEMPLATE
+        self.examples = examples or []
+        self.version = version
+        self._prefix_words = self._description_words(prefixes)
+        self._category_words = self._description_words(categories)
+        self._name_pattern = self._compile_name_pattern(self.template)
+
+    @classmethod
+    def compile(cls, rules_text, version=None):
+        """Return the rule set for this document text, parsing it only the first time it is seen"""
+        key = (version, hashlib.sha256((rules_text or '').encode('utf-8')).hexdigest())
+        with cls._compiled_lock:
+            rule_set = cls._compiled.get(key)
+            if rule_set:
+                cls._compiled.move_to_end(key)
+                return rule_set
+
+        rule_set = cls.parse(rules_text, version)
+        with cls._compiled_lock:
+            cls._compiled[key] = rule_set
+            while len(cls._compiled) > cls._COMPILED_MAX:
+                cls._compiled.popitem(last=False)
+        print(f"📐 Compiled naming rules: {len(rule_set.prefixes)} prefixes, {len(rule_set.categories)} categories")
+        return rule_set
+
+    @classmethod
+    def parse(cls, rules_text, version=None):
+        """Parse exported document text; sections the document lacks come from the fallback rules"""
+        prefixes, categories, examples = OrderedDict(), OrderedDict(), []
+        template = None
+        section = None
+
+        for raw_line in (rules_text or '').splitlines():
+            line = raw_line.strip()
+            if not line:
+                continue
+
+            format_match = re.match(r'^(?:filename\s+)?format\s*:\s*(\S+)', line, re.IGNORECASE)
+            if format_match:
+                template = template or format_match.group(1)
+                continue
+
+            item = cls._ITEM_PATTERN.match(line)
+            if item and section is not None and section is not examples:
+                section.setdefault(item.group(1), item.group(2).strip())
+                continue
+
+            # Headings may or may not end with a colon; any other colon line closes the section
+            heading = line.upper()
+            if len(line) < 60 and ('PREFIX' in heading or 'PRODUCT' in heading):
+                section = prefixes
+            elif len(line) < 60 and 'CATEGOR' in heading:
+                section = categories
+            elif len(line) < 60 and 'EXAMPLE' in heading:
+                section = examples
+            elif line.endswith(':'):
+                section = None
+            elif section is examples:
+                example = line.lstrip('-*• ').strip()
+                if '.' in example and ' ' not in example:
+                    examples.append(example)
+
+        if template and not all(token in template for token in ('PREFIX', 'description', '.ext')):
+            print(f"⚠️ Ignoring unrecognised naming format: {template}")
+            template = None
+
+        if not (prefixes and categories) and rules_text != FALLBACK_NAMING_RULES:
+            fallback = cls.parse(FALLBACK_NAMING_RULES)
+            prefixes = prefixes or fallback.prefixes
+            categories = categories or fallback.categories
+            template = template or fallback.template
+            examples = examples or fallback.examples
+
+        return cls(prefixes, categories, template, examples, version)
+
+    def code_table(self):
+        """Compact code table for prompts: the format plus code=meaning pairs, no prose or examples"""
+        return "\n".join([
+            f"FORMAT: {self.template}",
+            "PREFIX: " + "; ".join(f"{code}={meaning}" for code, meaning in self.prefixes.items()),
+            "CATEGORY: " + "; ".join(f"{code}={meaning}" for code, meaning in self.categories.items())
+        ])
+
+    def resolve_prefix(self, value):
+        return self._resolve(value, self.prefixes, {}, self._prefix_words, self.DEFAULT_PREFIX)
+
+    def resolve_category(self, value):
+        return self._resolve(value, self.categories, self.CATEGORY_ALIASES, self._category_words,
+                             self.DEFAULT_CATEGORY)
+
+    def build_filename(self, filename, analysis_data, date=None, version=1):
+        """Deterministic filename for the given analysis: same inputs, same date and version, same name"""
+        if '.' in filename:
+            base_name, file_ext = filename.rsplit('.', 1)
+        else:
+            base_name, file_ext = filename, 'pdf'
+
+        description = re.sub(r'[^a-z0-9]+', '_', base_name.lower()).strip('_')
+        description = description[:self.DESCRIPTION_LENGTH].rstrip('_') or 'file'
+        values = {
+            'PREFIX': self.resolve_prefix(analysis_data.get('product_line')),
+            'CATEGORY': self.resolve_category(analysis_data.get('content_category')),
+            'description': description,
+            'YYYYMMDD': (date or datetime.now()).strftime('%Y%m%d'),
+            'vNN': f"v{version:02d}",
+            '.ext': f".{file_ext.lower()}"
+        }
+        return self.TEMPLATE_TOKENS.sub(lambda match: values[match.group(0)], self.template)
+
+    def version_key(self, name):
+        """Split a convention-formatted name into (stem, version); (None, None) if it doesn't match
+
+        The stem is the name with its version masked and extension dropped, so v01.pdf and v02.pptx
+        of the same PREFIX-CATEGORY_description_YYYYMMDD share one version sequence.
+        """
+        match = self._name_pattern.fullmatch(name or '') if self._name_pattern else None
+        if not match:
+            return None, None
+        version_start, version_end = match.span('version')
+        stem = name[:version_start] + 'vNN' + name[version_end:]
+        if match.group('ext'):
+            stem = stem[:len(stem) - len(match.group('ext'))]
+        return stem, int(match.group('version')[1:])
+
+    def _compile_name_pattern(self, template):
+        if 'vNN' not in template:
+            return None
+        token_patterns = {
+            'PREFIX': r'[A-Z0-9]+',
+            'CATEGORY': r'[A-Z0-9]+',
+            'description': r'[a-z0-9_]+?',
+            'YYYYMMDD': r'\d{8}',
+            'vNN': r'(?P<version>v\d{2,})',
+            '.ext': r'(?P<ext>\.[A-Za-z0-9]+)'
+        }
+        pattern, position = '', 0
+        for token in self.TEMPLATE_TOKENS.finditer(template):
+            pattern += re.escape(template[position:token.start()]) + token_patterns[token.group(0)]
+            position = token.end()
+        pattern += re.escape(template[position:])
+        if '(?P<ext>' not in pattern:
+            pattern += '(?P<ext>)'
+        return re.compile(pattern)
+
+    def _resolve(self, value, codes, aliases, description_words, default):
+        """Map a free-form Gemini value (code, alias, or name like 'Spectra') onto a known code"""
+        tokens = re.findall(r'[A-Z0-9]+', str(value or '').upper())
+        for lookup in (codes, aliases, description_words):
+            for token in tokens:
+                if token in lookup:
+                    return token if lookup is codes else lookup[token]
+        return default
+
+    @staticmethod
+    def _description_words(codes):
+        words = {}
+        for code, meaning in codes.items():
+            for word in re.findall(r'[A-Za-z]{4,}', meaning):
+                words.setdefault(word.upper(), code)
+        return words
+
+
+class NamingConventionService:
+    """Handle naming convention document processing backed by the shared naming_rules_cache"""
+    
+    def __init__(self, drive_service=None, document_id=None):
+        self.drive_service = drive_service
+        self.document_id = document_id or "1IqpsMdfAjGx3H2l6SyRWcRH3red40c6AosMORn0oQes"
+        self._cached_rules = None
+        self._cached_modified_time = None
+        self._rule_set = None
+        # Version of the rules the calling thread last read, so a rule set is compiled with the
+        # version of the text it was built from even if another thread reads meanwhile
+        self._loaded = threading.local()
+    
+    def get_naming_rules(self):
+        """Get naming convention rules from the process-wide cache; Drive is only hit when it is cold"""
+        entry = naming_rules_cache.get_rules(self.document_id, self.drive_service)
+        if entry:
+            # Snapshot the entry so rules_version matches the rules this request used
+            self._cached_rules = entry['rules']
+            self._cached_modified_time = entry['modified_time']
+            self._loaded.version = entry['modified_time']
+            return entry['rules']
+
+        # Fallback if no cached rules available
+        print("🔄 Using fallback naming convention rules")
+        self._loaded.version = None
+        return self._fallback_naming_rules()
+    
+    @property
+    def rules_version(self):
+        """modifiedTime of the naming document the cached rules were read from, if any"""
+        return self._cached_modified_time
+
+    def force_refresh(self):
+        """Force refresh the cache (useful for manual refresh operations)"""
+        print("🔄 Force refreshing naming convention cache")
+        naming_rules_cache.refresh(self.document_id, self.drive_service, force=True)
+        return self.get_naming_rules()
+    
+    def _fallback_naming_rules(self):
+        """Enhanced fallback naming convention rules"""
+        return FALLBACK_NAMING_RULES
     
-    def apply_naming_convention(self, filename, analysis_data):
-        """Apply naming convention to generate proper filename"""
+    def get_rule_set(self):
+        """Naming rules compiled for the current document version (parsed once per version)
+        
+        The rule set's version is the modifiedTime of the text it was compiled from, so callers can
+        snapshot (rules, version) once and pass the rule set along instead of re-reading this service.
+        """
+        rules = self.get_naming_rules()
+        rule_set = NamingRuleSet.compile(rules, getattr(self._loaded, 'version', None))
+        self._rule_set = rule_set
+        return rule_set
+
+    def fallback_rule_set(self):
+        """Built-in rules, for when the naming document cannot be loaded within the workflow's deadline
+        
+        Leaves the service untouched: the abandoned get_rule_set() may still finish and set it.
+        """
+        return NamingRuleSet.compile(self._fallback_naming_rules(), None)
+
+    def allocate_filename(self, filename, analysis_data, folder_id, root_folder_id=None):
+        """Name for a file about to be uploaded into folder_id, with the next free vNN for its stem
+
+        Returns (filename, reservation). Pass the reservation to folder_name_index.confirm() once the
+        upload succeeds, or to folder_name_index.release() if it fails.
+        """
         try:
-            # Extract file extension
-            file_ext = filename.split('.')[-1] if '.' in filename else 'pdf'
-            
-            # Get components from analysis
-            product_line = analysis_data.get('product_line', 'MA').upper()
-            content_category = analysis_data.get('content_category', 'GEN').upper()
-            
-            # Map content category to naming convention
-            category_mapping = {
-                'TECH': 'TECH',
-                'TECHNICAL': 'TECH',
-                'SALES': 'PRES',
-                'PRES': 'PRES',
-                'BRAND': 'BRAND',
-                'MARK': 'MARK',
-                'MARKETING': 'MARK',
-                'GENERAL': 'GEN'
-            }
-            
-            category = category_mapping.get(content_category, 'GEN')
+            rule_set = self._rule_set or self.get_rule_set()
+            date = datetime.now()
+            stem, _ = rule_set.version_key(rule_set.build_filename(filename, analysis_data, date=date))
+            if stem is None or not self.drive_service:
+                return rule_set.build_filename(filename, analysis_data, date=date), None
             
-            # Generate description from filename
-            base_name = filename.split('.')[0] if '.' in filename else filename
-            description = re.sub(r'[^a-zA-Z0-9_]', '_', base_name.lower())[:20]
-            
-            # Current date
-            date_str = datetime.now().strftime('%Y%m%d')
-            
-            # Generate final filename
-            suggested_name = f"{product_line}-{category}_{description}_{date_str}_v01.{file_ext}"
+            version = folder_name_index.reserve(folder_id, stem, rule_set, self.drive_service, root_folder_id)
+            allocated_name = rule_set.build_filename(filename, analysis_data, date=date, version=version)
+            print(f"📝 Allocated filename: {allocated_name}")
+            return allocated_name, (folder_id, stem, version)
             
+        except Exception as e:
+            print(f"❌ Filename allocation error: {e}")
+            return self.apply_naming_convention(filename, analysis_data), None
+
+    def apply_naming_convention(self, filename, analysis_data, rule_set=None):
+        """Apply naming convention to generate proper filename
+        
+        rule_set is the snapshot the workflow sent to Gemini; without one the last compiled rules are used.
+        """
+        try:
+            # Reuse the rule set this request already compiled, so the name matches the rules Gemini saw
+            rule_set = rule_set or self._rule_set or self.get_rule_set()
+            suggested_name = rule_set.build_filename(filename, analysis_data)
             print(f"📝 Generated filename: {suggested_name}")
             return suggested_name
             
@@ -724,14 +3649,41 @@ EXAMPLES:
             return filename
 
 
+# Threads shared by every workflow's background steps, so concurrent analyses don't each start a
+# pool of their own; Gemini calls wait on gemini_runner, not on these
+WORKFLOW_STEP_WORKERS = int(os.environ.get('WORKFLOW_STEP_WORKERS', '16'))
+workflow_step_executor = ThreadPoolExecutor(max_workers=WORKFLOW_STEP_WORKERS, thread_name_prefix='workflow-step')
+
+
 class IntelligentWorkflowOrchestrator:
     """Orchestrates the 3-step intelligent workflow with progress tracking"""
+
+    # 'standard' makes separate analysis and recommendation calls, 'fused' makes one
+    WORKFLOW_MODES = ('standard', 'fused')
+
+    # Share of the end-to-end deadline each step may use. The first three start together, so the
+    # longest path (duplicate check, analysis, recommendation) adds up to the whole budget
+    STEP_BUDGETS = {
+        'duplicate_check': 0.25,
+        'naming_rules': 0.25,
+        'folder_structure': 0.4,
+        'content_analysis': 0.4,
+        'folder_recommendation': 0.35,
+        'fused_analysis': 0.6
+    }
+    # Steps the workflow waits on as soon as they start: without a deadline they run on the
+    # calling thread rather than occupying a second one
+    CALLER_THREAD_STEPS = ('content_analysis', 'folder_recommendation', 'fused_analysis')
     
     def __init__(self, gemini_service, drive_service, naming_service):
         self.gemini_service = gemini_service
         self.drive_service = drive_service
         self.naming_service = naming_service
         self.progress_callback = None
+        self.default_mode = os.environ.get('GEMINI_ANALYSIS_MODE', 'standard')
+        # End-to-end budget for one analysis, off (0) by default: a gemini-2.5-pro call takes 5-20 s,
+        # so size it from measured model latency (60+ s) or steps will routinely degrade to fallbacks
+        self.deadline_seconds = float(os.environ.get('WORKFLOW_DEADLINE_SECONDS', '0'))
     
     def set_progress_callback(self, callback):
         """Set callback function for progress updates"""
@@ -743,69 +3695,285 @@ class IntelligentWorkflowOrchestrator:
             self.progress_callback(step, progress, message)
         print(f"📊 Step {step}: {progress}% - {message}")
     
-    def execute_intelligent_workflow(self, filename, file_type, file_size, marketing_hub_folder_id):
-        """Execute the complete 3-step intelligent workflow with progress tracking"""
-        print(f"🚀 Starting 3-step intelligent workflow for: {filename}")
+    def execute_intelligent_workflow(self, filename, file_type, file_size, marketing_hub_folder_id, mode=None,
+                                     file_md5=None, deadline_seconds=None):
+        """Execute the complete 3-step intelligent workflow with progress tracking
+        
+        mode 'fused' merges the analysis and recommendation into one Gemini call. file_md5, when the
+        browser could hash the file, lets the duplicate check catch renamed copies. Each step gets a
+        slice of deadline_seconds (WORKFLOW_DEADLINE_SECONDS by default, 0 for none); a step that
+        overruns it is abandoned for its fallback and listed in the result's degraded_steps.
+        """
+        mode = mode if mode in self.WORKFLOW_MODES else self.default_mode
+        if deadline_seconds is None:
+            deadline_seconds = self.deadline_seconds
+        deadline = Deadline(deadline_seconds) if deadline_seconds > 0 else None
+        print(f"🚀 Starting 3-step intelligent workflow for: {filename} (mode: {mode}, deadline: {deadline_seconds:g}s)")
+        workflow_started = time.perf_counter()
+        step_timings = {}
+        degraded_steps = []
         
         try:
             # Initialize progress
             self._update_progress(1, 0, "Initializing content analysis...")
             
-            # Check for duplicate files first
+            # Duplicate check, naming rules fetch and folder crawl don't depend on each other,
+            # so they run concurrently; analysis then waits for the rules, recommendation for both
             self._update_progress(1, 5, "🔍 Checking for duplicate files...")
-            try:
-                duplicate = self.drive_service.check_file_exists(filename, file_size, marketing_hub_folder_id)
-                
-                if duplicate:
-                    print(f"⚠️ Duplicate file detected: {duplicate['name']}")
-                    return self._create_duplicate_result(filename, duplicate)
-            except Exception as duplicate_error:
-                print(f"⚠️ Duplicate check failed, continuing with analysis: {duplicate_error}")
-                # Continue with normal workflow if duplicate check fails
-            
-            # Get naming convention rules
-            naming_rules = self.naming_service.get_naming_rules()
-            self._update_progress(1, 10, "Loading naming convention rules...")
-            
-            # Step 1: Gemini analyzes file content
-            self._update_progress(1, 15, "Starting Gemini 2.5 Pro content analysis...")
-            print("🧠 STEP 1: Gemini content analysis...")
-            content_analysis = self.gemini_service.analyze_file_content(
-                filename, file_type, file_size, naming_rules
+            duplicate_step = self._submit_step(
+                step_timings, deadline, 'duplicate_check',
+                self._check_duplicate, filename, file_size, marketing_hub_folder_id, file_md5
+            )
+            rules_step = self._submit_step(
+                step_timings, deadline, 'naming_rules',
+                self.naming_service.get_rule_set
+            )
+            structure_step = self._submit_step(
+                step_timings, deadline, 'folder_structure',
+                self.drive_service.get_real_folder_structure, marketing_hub_folder_id
             )
-            self._update_progress(1, 33, "✅ Content analysis complete")
             
-            # Step 2: Drive API reads real folder structure
-            self._update_progress(2, 40, "📁 Reading Marketing Hub structure...")
-            print("📁 STEP 2: Reading real folder structure...")
-            folder_structure = self.drive_service.get_real_folder_structure(marketing_hub_folder_id)
-            self._update_progress(2, 66, "✅ Folder structure loaded")
+            duplicate = self._await_step(duplicate_step, degraded_steps, lambda: None)
+            if duplicate:
+                print(f"⚠️ Duplicate file detected: {duplicate['name']}")
+                result = self._create_duplicate_result(filename, duplicate)
+                result['step_timings'] = self._finish_timings(step_timings, workflow_started)
+                result['degraded_steps'] = degraded_steps
+                return result
             
-            # Step 3: Gemini recommends folder based on analysis + real structure
-            self._update_progress(3, 75, "🎯 Generating intelligent recommendation...")
-            print("🎯 STEP 3: Gemini intelligent folder recommendation...")
-            folder_recommendation = self.gemini_service.recommend_folder_with_structure(
-                filename, content_analysis, folder_structure
+            # Get naming convention rules
+            # One snapshot of the rules for the whole workflow: Gemini gets its compact code table,
+            # the filename is built from it and the result cache is versioned by its modifiedTime
+            rule_set = self._await_step(
+                rules_step, degraded_steps, lambda: self.naming_service.fallback_rule_set()
             )
-            self._update_progress(3, 90, "✅ Recommendation complete")
+            naming_rules = rule_set.code_table()
+            rules_version = rule_set.version
+            self._update_progress(1, 10, "Loading naming convention rules...")
+            
+            if mode == 'fused':
+                # Steps 1+3 in one structured Gemini call, once the folder crawl is in
+                self._update_progress(2, 40, "📁 Reading Marketing Hub structure...")
+                folder_structure = self._await_step(
+                    structure_step, degraded_steps, lambda: self.drive_service._fallback_folder_structure()
+                )
+                self._update_progress(2, 66, "✅ Folder structure loaded")
+                path_index = self._cached_path_index(marketing_hub_folder_id)
+                
+                self._update_progress(3, 75, "🧠 Gemini 2.5 Pro analyzing and recommending in one pass...")
+                print("🧠 STEPS 1+3: Fused Gemini analysis and recommendation...")
+                content_analysis, folder_recommendation = self._await_step(
+                    self._submit_step(
+                        step_timings, deadline, 'fused_analysis',
+                        self.gemini_service.analyze_and_recommend,
+                        filename, file_type, file_size, naming_rules, folder_structure, rules_version, path_index
+                    ),
+                    degraded_steps,
+                    lambda: self._fallback_analysis_and_recommendation(filename, file_type, file_size)
+                )
+                self._update_progress(3, 90, "✅ Recommendation complete")
+            else:
+                # Step 1: Gemini analyzes file content
+                self._update_progress(1, 15, "Starting Gemini 2.5 Pro content analysis...")
+                print("🧠 STEP 1: Gemini content analysis...")
+                content_analysis = self._await_step(
+                    self._submit_step(
+                        step_timings, deadline, 'content_analysis',
+                        self.gemini_service.analyze_file_content,
+                        filename, file_type, file_size, naming_rules, rules_version
+                    ),
+                    degraded_steps,
+                    lambda: self.gemini_service._fallback_content_analysis(filename, file_type, file_size)
+                )
+                self._update_progress(1, 33, "✅ Content analysis complete")
+                
+                # Step 2: Drive API reads real folder structure (already running in the background)
+                self._update_progress(2, 40, "📁 Reading Marketing Hub structure...")
+                print("📁 STEP 2: Reading real folder structure...")
+                folder_structure = self._await_step(
+                    structure_step, degraded_steps, lambda: self.drive_service._fallback_folder_structure()
+                )
+                self._update_progress(2, 66, "✅ Folder structure loaded")
+                path_index = self._cached_path_index(marketing_hub_folder_id)
+                
+                # Step 3: Gemini recommends folder based on analysis + real structure
+                self._update_progress(3, 75, "🎯 Generating intelligent recommendation...")
+                print("🎯 STEP 3: Gemini intelligent folder recommendation...")
+                folder_recommendation = self._await_step(
+                    self._submit_step(
+                        step_timings, deadline, 'folder_recommendation',
+                        self.gemini_service.recommend_folder_with_structure,
+                        filename, content_analysis, folder_structure, path_index
+                    ),
+                    degraded_steps,
+                    lambda: self.gemini_service._fallback_folder_recommendation(filename, content_analysis)
+                )
+                self._update_progress(3, 90, "✅ Recommendation complete")
             
             # Apply naming convention
             self._update_progress(3, 95, "📝 Applying naming convention...")
-            suggested_filename = self.naming_service.apply_naming_convention(filename, content_analysis)
+            suggested_filename = self.naming_service.apply_naming_convention(filename, content_analysis, rule_set)
             
             # Create comprehensive result
             self._update_progress(3, 100, "✅ Analysis complete")
             result = self._create_comprehensive_result(
                 filename, content_analysis, folder_recommendation, suggested_filename
             )
+            result['step_timings'] = self._finish_timings(step_timings, workflow_started)
+            result['workflow_mode'] = mode
+            result['degraded_steps'] = degraded_steps
+            # Cascade tier that answered each Gemini step (absent for fallbacks)
+            result['model_tiers'] = {
+                'content_analysis': content_analysis.get('model_tier'),
+                'folder_recommendation': folder_recommendation.get('model_tier')
+            }
             
-            print("✅ 3-step intelligent workflow completed successfully!")
+            print(f"✅ 3-step intelligent workflow completed successfully! Timings (ms): {result['step_timings']}")
+            if degraded_steps:
+                print(f"⏰ Steps degraded to their fallback: {', '.join(degraded_steps)}")
             return result
             
         except Exception as e:
             print(f"❌ Intelligent workflow error: {e}")
             return self._create_fallback_result(filename, file_type, file_size)
     
+    def execute_batch_workflow(self, files, marketing_hub_folder_id):
+        """Analyze a multi-file drop with one folder snapshot, one rules fetch and one duplicate query
+        
+        files is a list of dicts with filename, file_type and file_size. Returns per-file results
+        in the same order plus step timings for the whole batch.
+        """
+        print(f"🚀 Starting batch intelligent workflow for {len(files)} files")
+        workflow_started = time.perf_counter()
+        step_timings = {}
+        
+        duplicate_future = workflow_step_executor.submit(
+            self._run_timed_step, step_timings, 'duplicate_check',
+            self._find_duplicates, files, marketing_hub_folder_id
+        )
+        rules_future = workflow_step_executor.submit(
+            self._run_timed_step, step_timings, 'naming_rules',
+            self.naming_service.get_rule_set
+        )
+        structure_future = workflow_step_executor.submit(
+            self._run_timed_step, step_timings, 'folder_structure',
+            self.drive_service.get_real_folder_structure, marketing_hub_folder_id
+        )
+        duplicates = duplicate_future.result()
+        rule_set = rules_future.result()
+        folder_structure = structure_future.result()
+        
+        naming_rules = rule_set.code_table()
+        rules_version = rule_set.version
+        to_analyze = [file_info for position, file_info in enumerate(files) if position not in duplicates]
+        analyses = self._run_timed_step(
+            step_timings, 'batch_analysis',
+            self.gemini_service.analyze_files_batch, to_analyze, naming_rules, folder_structure, rules_version
+        )
+        analyses_by_position = iter(analyses)
+        
+        results = []
+        for position, file_info in enumerate(files):
+            filename = file_info['filename']
+            if position in duplicates:
+                results.append(self._create_duplicate_result(filename, duplicates[position]))
+                continue
+            content_analysis, folder_recommendation = next(analyses_by_position)
+            suggested_filename = self.naming_service.apply_naming_convention(filename, content_analysis, rule_set)
+            results.append(self._create_comprehensive_result(
+                filename, content_analysis, folder_recommendation, suggested_filename
+            ))
+        
+        timings = self._finish_timings(step_timings, workflow_started)
+        print(f"✅ Batch workflow completed for {len(files)} files. Timings (ms): {timings}")
+        return {'results': results, 'step_timings': timings}
+    
+    def _find_duplicates(self, files, folder_id):
+        """Run the batch duplicate check, treating failures as 'no duplicates'"""
+        try:
+            return self.drive_service.find_duplicates(files, folder_id)
+        except Exception as duplicate_error:
+            print(f"⚠️ Batch duplicate check failed, continuing with analysis: {duplicate_error}")
+            return {}
+    
+    def _check_duplicate(self, filename, file_size, folder_id, file_md5=None):
+        """Run the duplicate check, treating failures as 'no duplicate'"""
+        try:
+            return self.drive_service.check_file_exists(filename, file_size, folder_id, md5=file_md5)
+        except Exception as duplicate_error:
+            print(f"⚠️ Duplicate check failed, continuing with analysis: {duplicate_error}")
+            # Continue with normal workflow if duplicate check fails
+            return None
+    
+    def _submit_step(self, step_timings, deadline, step_name, func, *args):
+        """Start a workflow step with its slice of the deadline bound to the worker thread
+
+        Steps run on the shared workflow_step_executor. A CALLER_THREAD_STEPS step with no deadline
+        to abandon it at runs right here instead, and is returned already finished.
+        Returns (step_name, future, expires_at) for _await_step; expires_at is None without a deadline.
+        """
+        expires_at = deadline.step_expiry(self.STEP_BUDGETS[step_name]) if deadline else None
+        if expires_at is None and step_name in self.CALLER_THREAD_STEPS:
+            future = Future()
+            try:
+                future.set_result(self._run_bounded_step(step_timings, step_name, expires_at, func, *args))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = workflow_step_executor.submit(
+                self._run_bounded_step, step_timings, step_name, expires_at, func, *args
+            )
+        return step_name, future, expires_at
+
+    def _run_bounded_step(self, step_timings, step_name, expires_at, func, *args):
+        """Run a step under its deadline; returns (result, monotonic time it finished)"""
+        with Deadline.bind(expires_at):
+            result = self._run_timed_step(step_timings, step_name, func, *args)
+        return result, time.monotonic()
+
+    @staticmethod
+    def _cached_path_index(marketing_hub_folder_id):
+        """The hub's FolderPathIndex if the tree is cached, for validating recommended folders"""
+        entry = folder_tree_cache.peek(marketing_hub_folder_id)
+        return entry['path_index'] if entry else None
+
+    def _await_step(self, step, degraded_steps, fallback):
+        """Wait for a step until its deadline; past it, abandon the step and return fallback()"""
+        step_name, future, expires_at = step
+        timeout = None if expires_at is None else max(0.0, expires_at - time.monotonic())
+        try:
+            result, finished_at = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if future.done():
+                raise
+            # Not started yet: never runs. Running: left to finish in the background, result unused
+            future.cancel()
+            print(f"⏰ {step_name} overran its deadline, using its fallback")
+            degraded_steps.append(step_name)
+            return fallback()
+        if expires_at is not None and finished_at >= expires_at:
+            # The step's own Drive / Gemini timeout fired and it already returned its fallback
+            degraded_steps.append(step_name)
+        return result
+
+    def _fallback_analysis_and_recommendation(self, filename, file_type, file_size):
+        content_analysis = self.gemini_service._fallback_content_analysis(filename, file_type, file_size)
+        return content_analysis, self.gemini_service._fallback_folder_recommendation(filename, content_analysis)
+
+    def _run_timed_step(self, step_timings, step_name, func, *args):
+        """Run one workflow step and record its wall-clock duration in milliseconds"""
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            step_timings[step_name] = round((time.perf_counter() - started) * 1000, 1)
+    
+    def _finish_timings(self, step_timings, workflow_started):
+        """Snapshot step timings and add the end-to-end total"""
+        timings = dict(step_timings)
+        timings['total'] = round((time.perf_counter() - workflow_started) * 1000, 1)
+        return timings
+    
     def _create_comprehensive_result(self, filename, content_analysis, folder_recommendation, suggested_filename):
         """Create comprehensive result from all workflow steps"""
         # Ensure all required fields exist with defaults
@@ -908,69 +4076,6 @@ class IntelligentWorkflowOrchestrator:
         }
 
 
-    def check_file_exists(self, filename, file_size, folder_id=None):
-        """Check if a file with similar characteristics already exists"""
-        if not self.is_available():
-            print("❌ Drive API not available for duplicate check")
-            return None
-        
-        try:
-            print(f"🔍 Checking for duplicate files: {filename} ({file_size} bytes)")
-            
-            # Escape single quotes in filename for query
-            escaped_filename = filename.replace("'", "\\'")
-            
-            # Search for files with the same name
-            query = f"name='{escaped_filename}'"
-            if folder_id:
-                query += f" and parents in '{folder_id}'"
-            
-            print(f"🔍 Drive API query: {query}")
-            
-            results = self.service.files().list(
-                q=query,
-                fields="files(id,name,size,parents,createdTime,webViewLink)",
-                pageSize=10
-            ).execute()
-            
-            files = results.get('files', [])
-            print(f"🔍 Found {len(files)} files with similar names")
-            
-            if not files:
-                print(f"✅ No duplicate found for: {filename}")
-                return None
-            
-            # Check for exact matches (same name and similar size)
-            for file in files:
-                existing_size = int(file.get('size', 0))
-                size_diff = abs(existing_size - file_size)
-                size_threshold = max(1024, file_size * 0.05)  # 5% or 1KB threshold
-                
-                if size_diff <= size_threshold:
-                    print(f"⚠️ Potential duplicate found: {file['name']} (ID: {file['id']})")
-                    return {
-                        'id': file['id'],
-                        'name': file['name'],
-                        'size': existing_size,
-                        'created_time': file.get('createdTime', ''),
-                        'web_link': file.get('webViewLink', ''),
-                        'size_difference': size_diff
-                    }
-            
-            print(f"✅ Similar named files found but different sizes for: {filename}")
-            return None
-            
-        except Exception as e:
-            print(f"❌ Duplicate check error: {e}")
-            print(f"   Error type: {type(e).__name__}")
-            print(f"   Filename: {filename}")
-            escaped_for_log = filename.replace("'", "\\'")
-            print(f"   Query attempted: name='{escaped_for_log}'")
-            # Return None instead of raising exception to allow workflow to continue
-            return None
-
-
-    
     def _create_duplicate_result(self, filename, duplicate_info):
         """Create result for duplicate file detection"""
         from datetime import datetime
@@ -989,12 +4094,19 @@ class IntelligentWorkflowOrchestrator:
         
         size_mb = duplicate_info.get('size', 0) / (1024 * 1024)
         
+        if duplicate_info.get('match') == 'md5':
+            match_reason = 'A file with identical content (same MD5 checksum) already exists in your Marketing Hub.'
+            match_basis = 'Identical content (MD5)'
+        else:
+            match_reason = 'A file with the same name and similar size already exists in your Marketing Hub.'
+            match_basis = 'Same name and similar size'
+        
         return {
             "summary": f'''<div class="duplicate-warning">
                             <div class="duplicate-icon">⚠️</div>
                             <div class="duplicate-content">
                                 <h3>Duplicate File Detected</h3>
-                                <p>A file with the same name and similar size already exists in your Marketing Hub.</p>
+                                <p>{match_reason}</p>
                             </div>
                           </div>
                           
@@ -1015,6 +4127,7 @@ class IntelligentWorkflowOrchestrator:
             
             "details": f'''<div class="duplicate-details">
                             <strong>Existing File:</strong> {duplicate_info['name']}<br>
+                            <strong>Matched On:</strong> {match_basis}<br>
                             <strong>File Size:</strong> {size_mb:.1f} MB<br>
                             <strong>Created:</strong> {formatted_time}<br>
                             <strong>Size Difference:</strong> {duplicate_info.get('size_difference', 0)} bytes
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Tests for the content-addressed Gemini analysis result cache
+"""
+
+import time
+
+from services_enhanced import GeminiService, AnalysisResultCache, analysis_result_cache
+from test_gemini_fused import StubModel, make_gemini
+
+
+def test_repeat_analysis_is_served_from_cache():
+    model = StubModel(base_latency=0)
+    gemini_service = make_gemini(model)
+
+    first = gemini_service.analyze_file_content('Spectra Manual.pdf', 'application/pdf', 3200000, 'rules', '2024-01-01')
+    second = gemini_service.analyze_file_content('Spectra Manual.pdf', 'application/pdf', 3300000, 'rules', '2024-01-01')
+
+    assert second == first
+    assert model.calls == 1
+    assert analysis_result_cache.stats()['hit_ratio'] == 0.5
+
+
+def test_rules_version_change_invalidates_analysis():
+    model = StubModel(base_latency=0)
+    gemini_service = make_gemini(model)
+
+    gemini_service.analyze_file_content('Spectra Manual.pdf', 'application/pdf', 3200000, 'rules', '2024-01-01')
+    gemini_service.analyze_file_content('Spectra Manual.pdf', 'application/pdf', 3200000, 'rules', '2024-02-01')
+
+    assert model.calls == 2
+
+
+def test_folder_structure_change_invalidates_recommendation():
+    model = StubModel(base_latency=0)
+    gemini_service = make_gemini(model)
+    analysis = {'content_category': 'TECH', 'product_line': 'SP'}
+
+    gemini_service.recommend_folder_with_structure('Spectra Manual.pdf', analysis, 'tree v1')
+    gemini_service.recommend_folder_with_structure('Spectra Manual.pdf', analysis, 'tree v1')
+    gemini_service.recommend_folder_with_structure('Spectra Manual.pdf', analysis, 'tree v2')
+
+    assert model.calls == 2
+
+
+def test_fallback_results_are_not_cached():
+    model = StubModel(base_latency=0)
+    model.generate_content = lambda prompt, **kwargs: (_ for _ in ()).throw(RuntimeError('quota'))
+    gemini_service = make_gemini(model)
+
+    gemini_service.analyze_file_content('Profile.pdf', 'application/pdf', 1000, 'rules')
+
+    assert analysis_result_cache.stats()['stores'] == 0
+
+
+def test_cached_values_are_isolated_copies():
+    cache = AnalysisResultCache(max_entries=10, ttl_seconds=60, db_path='')
+    cache.put('key', {'confidence': '90'})
+
+    cache.get('key')['confidence'] = 'mutated'
+
+    assert cache.get('key') == {'confidence': '90'}
+
+
+def test_lru_eviction():
+    cache = AnalysisResultCache(max_entries=2, ttl_seconds=60, db_path='')
+    cache.put('a', {'v': 1})
+    cache.put('b', {'v': 2})
+    cache.get('a')
+    cache.put('c', {'v': 3})
+
+    assert cache.get('b') is None
+    assert cache.get('a') == {'v': 1}
+    assert cache.stats()['evictions'] == 1
+
+
+def test_ttl_expiry():
+    cache = AnalysisResultCache(max_entries=10, ttl_seconds=0.05, db_path='')
+    cache.put('a', {'v': 1})
+    time.sleep(0.1)
+
+    assert cache.get('a') is None
+
+
+def test_sqlite_backend_survives_restart(tmp_path):
+    db_path = str(tmp_path / 'analysis_cache.db')
+    AnalysisResultCache(max_entries=10, ttl_seconds=60, db_path=db_path).put('a', {'v': 1})
+
+    restarted = AnalysisResultCache(max_entries=10, ttl_seconds=60, db_path=db_path)
+
+    assert restarted.get('a') == {'v': 1}
+    assert restarted.stats()['disk_hits'] == 1
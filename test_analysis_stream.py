@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for the Server-Sent Events analysis endpoint
+"""
+
+import json
+import time
+
+import pytest
+
+import main
+
+
+class SlowOrchestrator:
+    """Emits progress updates with a pause between steps, like the real workflow waiting on Gemini"""
+
+    STEP_DELAY = 0.3
+
+    def __init__(self, gemini_service, drive_service, naming_service):
+        self.progress_callback = None
+
+    def set_progress_callback(self, callback):
+        self.progress_callback = callback
+
+    def execute_intelligent_workflow(self, filename, file_type, file_size, marketing_hub_folder_id, mode=None,
+                                     file_md5=None):
+        for step, progress in ((1, 33), (2, 66), (3, 100)):
+            self.progress_callback(step, progress, f"Step {step} done")
+            time.sleep(self.STEP_DELAY)
+        return {'summary': f"Analyzed {filename}", 'is_duplicate': False}
+
+
+class FailingOrchestrator(SlowOrchestrator):
+    def execute_intelligent_workflow(self, *args, **kwargs):
+        self.progress_callback(1, 0, "Initializing content analysis...")
+        raise RuntimeError("Gemini exploded")
+
+
+@pytest.fixture
+def client():
+    main.app.config['TESTING'] = True
+    with main.app.test_client() as client:
+        with client.session_transaction() as session:
+            session['user_info'] = {'email': 'tester@skylarkdrones.com'}
+        yield client
+
+
+def read_events(response, started=None):
+    """Yield (arrival_seconds, event, data) for each SSE message as it arrives, timed from `started`"""
+    started = started or time.perf_counter()
+    buffer = ''
+    for chunk in response.response:
+        buffer += chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+        while '\n\n' in buffer:
+            message, buffer = buffer.split('\n\n', 1)
+            fields = dict(line.split(': ', 1) for line in message.split('\n') if not line.startswith(':'))
+            if fields:
+                yield time.perf_counter() - started, fields['event'], json.loads(fields['data'])
+
+
+def post_stream(client):
+    return client.post('/api/gemini/analyze/stream', json={
+        'filename': 'Spectra Brochure.pdf', 'fileType': 'application/pdf', 'fileSize': 1000
+    }, buffered=False)
+
+
+def test_progress_events_arrive_before_workflow_finishes(client, monkeypatch):
+    monkeypatch.setattr(main, 'IntelligentWorkflowOrchestrator', SlowOrchestrator)
+
+    # The workflow starts as soon as the request is accepted, so time from before the POST
+    started = time.perf_counter()
+    response = post_stream(client)
+    events = list(read_events(response, started))
+
+    assert response.mimetype == 'text/event-stream'
+    assert [event for _, event, _ in events] == ['progress', 'progress', 'progress', 'result']
+    assert events[-1][2]['summary'] == 'Analyzed Spectra Brochure.pdf'
+    # The first update is delivered while the workflow is still running, not replayed at the end
+    assert events[0][0] < SlowOrchestrator.STEP_DELAY
+    assert events[-1][0] >= SlowOrchestrator.STEP_DELAY * 3
+
+
+def test_workflow_error_is_the_last_event(client, monkeypatch):
+    monkeypatch.setattr(main, 'IntelligentWorkflowOrchestrator', FailingOrchestrator)
+
+    events = list(read_events(post_stream(client)))
+
+    assert [event for _, event, _ in events] == ['progress', 'error']
+    assert 'Gemini exploded' in events[-1][2]['error']
+
+
+def test_idle_stream_sends_keepalive_comments(client, monkeypatch):
+    monkeypatch.setattr(main, 'IntelligentWorkflowOrchestrator', SlowOrchestrator)
+    monkeypatch.setattr(main, 'SSE_KEEPALIVE_SECONDS', 0.05)
+
+    body = b''.join(post_stream(client).response)
+
+    assert b': keep-alive' in body
+    assert body.rstrip().endswith(b'}')
+
+
+def test_stream_requires_login():
+    with main.app.test_client() as anonymous:
+        assert anonymous.post('/api/gemini/analyze/stream', json={}).status_code == 401
+
+
+@pytest.mark.parametrize('file_size', ['abc', -1, 10.5, None, [1000]])
+def test_invalid_file_size_is_rejected_before_analysis(client, monkeypatch, file_size):
+    monkeypatch.setattr(main, 'IntelligentWorkflowOrchestrator', FailingOrchestrator)
+    body = {'filename': 'Spectra Brochure.pdf', 'fileType': 'application/pdf', 'fileSize': file_size}
+
+    for route in ('/api/gemini/analyze', '/api/gemini/analyze/stream', '/api/gemini/analyze/jobs'):
+        assert client.post(route, json=body).status_code == 400
+    assert client.post('/api/gemini/analyze/batch', json={'files': [body]}).status_code == 400
+
+
+def test_numeric_file_size_string_reaches_the_workflow_as_an_int(client, monkeypatch):
+    sizes = []
+
+    class RecordingOrchestrator(SlowOrchestrator):
+        STEP_DELAY = 0
+
+        def execute_intelligent_workflow(self, filename, file_type, file_size, *args, **kwargs):
+            sizes.append(file_size)
+            return super().execute_intelligent_workflow(filename, file_type, file_size, *args, **kwargs)
+
+    monkeypatch.setattr(main, 'IntelligentWorkflowOrchestrator', RecordingOrchestrator)
+    response = client.post('/api/gemini/analyze/stream', json={
+        'filename': 'Spectra Brochure.pdf', 'fileType': 'application/pdf', 'fileSize': '1000'
+    }, buffered=False)
+    list(read_events(response))
+
+    assert sizes == [1000]
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Tests for multi-file batch analysis: shared duplicate query, grouped Gemini prompts, per-file results
+"""
+
+import re
+import json
+import time
+
+import pytest
+
+from fake_google import FakeDrive, build_marketing_hub, make_drive_service
+from test_gemini_fused import StubResponse, make_gemini, StubNaming
+from services_enhanced import DriveService, NamingConventionService, IntelligentWorkflowOrchestrator, hub_file_index
+
+
+@pytest.fixture(autouse=True)
+def without_hub_index(monkeypatch):
+    # These tests cover the name-query path used until the hub file index is built
+    monkeypatch.setattr(hub_file_index, 'enabled', False)
+
+
+class BatchStubModel:
+    """Answers grouped prompts with one JSON object per listed file"""
+
+    def __init__(self, latency=0.0, skip=()):
+        self.latency = latency
+        self.skip = set(skip)
+        self.calls = 0
+        self.files_per_call = []
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        listed = re.findall(r"^\s*(\d+)\. Filename: (.+?) \|", prompt, re.MULTILINE)
+        self.files_per_call.append(len(listed))
+        items = [
+            {
+                'file_index': int(position),
+                'document_type': 'Brochure',
+                'content_category': 'SALES',
+                'product_line': 'SP',
+                'content_description': f"Description of {filename}",
+                'confidence_score': 88,
+                'recommended_folder': f"Marketing Hub → Sales → {filename}",
+                'reasoning': 'Sales collateral',
+                'confidence': 86,
+                'alternative': 'Marketing Hub → General'
+            }
+            for position, filename in listed if filename not in self.skip
+        ]
+        return StubResponse(json.dumps(items))
+
+
+def make_files(count):
+    return [
+        {'filename': f"Brochure {index:02d}.pdf", 'file_type': 'application/pdf', 'file_size': 10000 + index}
+        for index in range(count)
+    ]
+
+
+def test_grouped_prompts_return_per_file_results_in_order():
+    model = BatchStubModel()
+    files = make_files(12)
+
+    results = make_gemini(model).analyze_files_batch(files, 'rules', 'structure')
+
+    assert model.calls == 3
+    assert sorted(model.files_per_call) == [2, 5, 5]  # groups are in flight together, in any order
+    for file_info, (analysis, recommendation) in zip(files, results):
+        assert analysis['content_description'] == f"Description of {file_info['filename']}"
+        assert recommendation['recommended_folder'] == f"Marketing Hub → Sales → {file_info['filename']}"
+
+
+def test_batch_results_are_cached_per_file():
+    model = BatchStubModel()
+    gemini_service = make_gemini(model)
+    gemini_service.analyze_files_batch(make_files(4), 'rules', 'structure')
+
+    model.calls = 0
+    results = gemini_service.analyze_files_batch(make_files(6), 'rules', 'structure')
+
+    assert model.calls == 1
+    assert model.files_per_call[-1] == 2
+    assert results[5][0]['content_description'] == "Description of Brochure 05.pdf"
+
+
+def test_missing_item_falls_back_for_that_file_only():
+    model = BatchStubModel(skip={'Brochure 01.pdf'})
+
+    results = make_gemini(model).analyze_files_batch(make_files(3), 'rules', 'structure')
+
+    assert results[0][0]['content_category'] == 'SALES'
+    assert results[1][1]['recommended_folder'] == "Marketing Hub → 03_Marketing Campaigns → Product Brochures"
+    assert results[2][0]['content_category'] == 'SALES'
+
+
+def test_groups_are_sent_concurrently():
+    model = BatchStubModel(latency=0.2)
+
+    started = time.perf_counter()
+    make_gemini(model).analyze_files_batch(make_files(15), 'rules', 'structure')
+    elapsed = time.perf_counter() - started
+
+    assert model.calls == 3
+    assert elapsed < 0.5
+
+
+def test_find_duplicates_uses_one_query_and_matches_size():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=2, per_folder=1, depth=1)
+    folder_id = next(item['id'] for item in fake.items.values() if item['parents'] == [root_id])
+    fake.add_file("Brochure 00.pdf", folder_id, size='10000')
+    fake.add_file("Brochure 01.pdf", folder_id, size='999999')
+    fake.add_file("O'Brien Deck.pdf", folder_id, size='5000')
+    files = make_files(20) + [{'filename': "O'Brien Deck.pdf", 'file_type': 'application/pdf', 'file_size': 5000}]
+    drive_service = make_drive_service(fake)
+
+    fake.reset_calls()
+    duplicates = drive_service.find_duplicates(files, root_id)
+
+    assert fake.calls['files.list'] == 1
+    assert set(duplicates) == {0, 20}
+    assert duplicates[20]['name'] == "O'Brien Deck.pdf"
+
+
+def test_find_duplicates_ignores_files_outside_cached_hub():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=2, per_folder=1, depth=1)
+    fake.add_file("Brochure 00.pdf", 'someone-elses-folder', size='10000')
+    drive_service = make_drive_service(fake)
+    drive_service.get_folder_tree(root_id)
+
+    assert drive_service.find_duplicates(make_files(1), root_id) == {}
+
+
+def test_batch_workflow_shares_rules_structure_and_duplicate_query():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=2, per_folder=2, depth=2)
+    fake.add_file('Naming Convention', None, mime_type='application/vnd.google-apps.document',
+                  file_id='naming-doc', content='PREFIXES:\n- SP: Spectra Series')
+    existing_folder = next(item['id'] for item in fake.items.values() if item['parents'] == [root_id])
+    fake.add_file("Brochure 03.pdf", existing_folder, size='10003')
+    drive_service = make_drive_service(fake)
+    model = BatchStubModel()
+    orchestrator = IntelligentWorkflowOrchestrator(
+        make_gemini(model), drive_service, NamingConventionService(drive_service, 'naming-doc')
+    )
+
+    batch = orchestrator.execute_batch_workflow(make_files(8), root_id)
+
+    assert len(batch['results']) == 8
+    assert batch['results'][3]['is_duplicate'] is True
+    assert all(not result.get('is_duplicate') for index, result in enumerate(batch['results']) if index != 3)
+    assert fake.calls['files.export'] == 1
+    assert model.calls == 2
+    assert sum(model.files_per_call) == 7
+    assert {'duplicate_check', 'naming_rules', 'folder_structure', 'batch_analysis', 'total'} <= set(batch['step_timings'])
+
+
+def test_batch_items_sharing_a_name_are_checked_separately():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=2, per_folder=1, depth=1)
+    folder_id = next(item['id'] for item in fake.items.values() if item['parents'] == [root_id])
+    fake.add_file("Brochure.pdf", folder_id, size='10000')
+    drive_service = make_drive_service(fake)
+    model = BatchStubModel()
+    orchestrator = IntelligentWorkflowOrchestrator(make_gemini(model), drive_service, StubNaming())
+    files = [
+        {'filename': 'Brochure.pdf', 'file_type': 'application/pdf', 'file_size': 10000},
+        {'filename': 'Brochure.pdf', 'file_type': 'application/pdf', 'file_size': 900000},
+    ]
+
+    assert set(drive_service.find_duplicates(files, root_id)) == {0}
+    batch = orchestrator.execute_batch_workflow(files, root_id)
+
+    assert batch['results'][0]['is_duplicate'] is True
+    assert not batch['results'][1].get('is_duplicate')
+    assert sum(model.files_per_call) == 1
+
+
+def test_batch_workflow_survives_duplicate_check_failure():
+    class BrokenDrive(DriveService):
+        def find_duplicates(self, files, folder_id=None):
+            raise RuntimeError("Drive unavailable")
+
+    model = BatchStubModel()
+    orchestrator = IntelligentWorkflowOrchestrator(make_gemini(model), BrokenDrive(None), StubNaming())
+
+    batch = orchestrator.execute_batch_workflow(make_files(2), 'hub-root')
+
+    assert [result['analysis_data']['content_category'] for result in batch['results']] == ['SALES', 'SALES']
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Tests for server-relayed chunked uploads that resume from the last byte Drive acknowledged
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import main
+from test_direct_upload import drive, upload_server, client, ANALYSIS
+
+MB = 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(main, 'UPLOAD_CHUNK_SIZE', MB)
+
+
+def start_chunked(client, size):
+    return client.post('/api/upload/chunk/start', json={
+        'filename': 'Survey Flight.mp4', 'fileType': 'video/mp4', 'fileSize': size, 'analysis': ANALYSIS
+    }).get_json()
+
+
+def put_chunk(client, token, payload, offset, end, body=None):
+    return client.put('/api/upload/chunk', data=payload[offset:end] if body is None else body, headers={
+        'X-Upload-Token': token, 'Content-Range': f"bytes {offset}-{end - 1}/{len(payload)}"
+    })
+
+
+def upload_with_resume(client, token, payload, chunk_size, interrupt=None):
+    """The browser's loop: send slices, and after any failure resume from the reported offset"""
+    offset = 0
+    while True:
+        end = min(offset + chunk_size, len(payload))
+        body = interrupt(offset, payload[offset:end]) if interrupt else None
+        response = put_chunk(client, token, payload, offset, end, body)
+        if response.status_code != 200:
+            response = client.get(f"/api/upload/chunk/status?upload_token={token}")
+        result = response.get_json()
+        if result['status'] != 'incomplete':
+            return result
+        offset = result['offset']
+
+
+def test_chunks_are_relayed_to_drive_session(client, upload_server):
+    payload = b'v' * (3 * MB + 100)
+    upload_session = start_chunked(client, len(payload))
+
+    assert 'upload_url' not in upload_session
+    result = upload_with_resume(client, upload_session['upload_token'], payload, upload_session['chunk_size'])
+
+    assert result['status'] == 'success'
+    assert result['folder_path'] == 'Marketing Hub → 04_Sales Enablement → Presentations'
+    assert upload_server.chunk_offsets == [0, MB, 2 * MB, 3 * MB]
+    assert upload_server.files[result['file_id']]['size'] == len(payload)
+
+
+def test_drive_connection_drop_resumes_without_resending_completed_chunks(client, upload_server):
+    payload = b'v' * (4 * MB)
+    token = start_chunked(client, len(payload))['upload_token']
+
+    def drop_third_chunk(offset, chunk):
+        if offset == 2 * MB and upload_server.chunk_offsets.count(2 * MB) == 0:
+            upload_server.drop_next_chunk(after_bytes=256 * 1024)
+        return None
+
+    result = upload_with_resume(client, token, payload, MB, interrupt=drop_third_chunk)
+
+    assert result['status'] == 'success'
+    assert upload_server.chunk_offsets == [0, MB, 2 * MB, 2 * MB, 3 * MB]
+    assert upload_server.files[result['file_id']]['size'] == len(payload)
+
+
+def test_browser_connection_drop_mid_chunk_resumes_from_acknowledged_offset(client, upload_server):
+    payload = b'v' * (3 * MB)
+    token = start_chunked(client, len(payload))['upload_token']
+    dropped = []
+
+    def cut_off_second_chunk(offset, chunk):
+        if offset == MB and not dropped:
+            dropped.append(offset)
+            return chunk[:MB // 3]
+        return None
+
+    result = upload_with_resume(client, token, payload, MB, interrupt=cut_off_second_chunk)
+
+    assert dropped == [MB]
+    assert result['status'] == 'success'
+    # The truncated chunk never reached Drive, and chunk 0 was not sent again
+    assert upload_server.chunk_offsets == [0, MB, 2 * MB]
+
+
+def test_status_reports_drive_offset(client, upload_server):
+    payload = b'v' * (3 * MB)
+    token = start_chunked(client, len(payload))['upload_token']
+    put_chunk(client, token, payload, 0, MB)
+
+    status = client.get(f"/api/upload/chunk/status?upload_token={token}").get_json()
+
+    assert status == {'status': 'incomplete', 'offset': MB}
+
+
+def test_chunk_at_wrong_offset_is_rejected(client, upload_server):
+    payload = b'v' * (3 * MB)
+    token = start_chunked(client, len(payload))['upload_token']
+
+    response = put_chunk(client, token, payload, MB, 2 * MB)
+
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == 0
+    assert upload_server.chunk_offsets == []
+
+
+def test_content_range_must_match_the_declared_size(client, upload_server):
+    payload = b'v' * (2 * MB)
+    token = start_chunked(client, len(payload))['upload_token']
+
+    wrong_total = client.put('/api/upload/chunk', data=payload[:MB], headers={
+        'X-Upload-Token': token, 'Content-Range': f"bytes 0-{MB - 1}/{3 * MB}"
+    })
+    past_the_end = client.put('/api/upload/chunk', data=b'v' * 10, headers={
+        'X-Upload-Token': token, 'Content-Range': f"bytes {2 * MB - 5}-{2 * MB + 4}/{2 * MB}"
+    })
+    wrong_status_total = client.put('/api/upload/chunk', headers={
+        'X-Upload-Token': token, 'Content-Range': f"bytes */{MB}"
+    })
+
+    assert wrong_total.status_code == 400
+    assert past_the_end.status_code == 416
+    assert past_the_end.get_json()['offset'] == 0
+    assert wrong_status_total.status_code == 400
+    assert upload_server.chunk_offsets == []
+
+
+def test_concurrent_chunks_for_one_upload_are_relayed_once(upload_server):
+    payload = b'v' * (2 * MB)
+    clients = []
+    for _ in range(4):
+        client = main.app.test_client()
+        with client.session_transaction() as session:
+            session['user_info'] = {'email': 'tester@skylarkdrones.com'}
+            session['access_token'] = 'ya29.test-token'
+        clients.append(client)
+    token = start_chunked(clients[0], len(payload))['upload_token']
+    barrier = threading.Barrier(len(clients))
+
+    def send(client):
+        barrier.wait()
+        return put_chunk(client, token, payload, 0, MB)
+
+    with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+        responses = list(pool.map(send, clients))
+
+    assert sorted(response.status_code for response in responses) == [200, 409, 409, 409]
+    assert all(response.get_json()['offset'] == MB for response in responses)
+    assert upload_server.chunk_offsets == [0]
+
+
+def test_retried_final_chunk_returns_original_result(client, upload_server):
+    payload = b'v' * MB
+    token = start_chunked(client, len(payload))['upload_token']
+    first = put_chunk(client, token, payload, 0, MB).get_json()
+
+    retried = put_chunk(client, token, payload, 0, MB).get_json()
+
+    assert retried['file_id'] == first['file_id']
+    assert upload_server.chunk_offsets == [0]
+
+
+def test_unknown_upload_token(client, upload_server):
+    assert client.get('/api/upload/chunk/status?upload_token=bogus').status_code == 404
+    assert client.put('/api/upload/chunk', data=b'x', headers={
+        'X-Upload-Token': 'bogus', 'Content-Range': 'bytes 0-0/1'
+    }).status_code == 404
+
+
+def test_oversized_chunk_is_refused_before_it_is_read(client, upload_server):
+    payload = b'v' * (2 * MB)
+    upload_session = start_chunked(client, len(payload))
+    token = upload_session['upload_token']
+
+    whole_file = put_chunk(client, token, payload, 0, len(payload))
+    # A range within the limit can't smuggle in a larger body either
+    padded = put_chunk(client, token, payload, 0, MB, body=payload)
+
+    assert whole_file.status_code == padded.status_code == 413
+    assert upload_server.chunk_offsets == []
+    result = upload_with_resume(client, token, payload, upload_session['chunk_size'])
+    assert result['status'] == 'success'
+
+
+def test_another_user_cannot_relay_chunks_or_read_progress(client, upload_server):
+    payload = b'v' * (MB + 10)
+    token = start_chunked(client, len(payload))['upload_token']
+    with client.session_transaction() as session:
+        session['user_info'] = {'email': 'someone-else@skylarkdrones.com'}
+
+    assert put_chunk(client, token, payload, 0, MB).status_code == 404
+    assert client.get(f"/api/upload/chunk/status?upload_token={token}").status_code == 404
+    assert upload_server.chunk_offsets == []
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Tests for browser-direct resumable uploads: server-issued Drive sessions and the finalize step
+"""
+
+import pytest
+import requests
+
+import main
+from fake_google import FakeDrive, FakeResumableUploadServer, build_marketing_hub, http_error, make_drive_service
+from services_enhanced import folder_name_index
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def drive():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=1, per_folder=1, depth=1)
+    sales = fake.add_folder('04_Sales Enablement', root_id, folder_id='sales-folder')
+    fake.add_folder('Presentations', sales, folder_id='presentations-folder')
+    return fake
+
+
+@pytest.fixture
+def upload_server(drive, monkeypatch):
+    monkeypatch.setattr(main, 'DriveService', lambda credentials=None: make_drive_service(drive))
+    monkeypatch.setattr(main, 'MARKETING_HUB_FOLDER_ID', 'hub-root')
+    with FakeResumableUploadServer(drive=drive) as server:
+        monkeypatch.setattr(main, 'DRIVE_UPLOAD_URL', server.url + '/upload/drive/v3/files')
+        yield server
+
+
+@pytest.fixture
+def client():
+    main.app.config['TESTING'] = True
+    with main.app.test_client() as client:
+        with client.session_transaction() as session:
+            session['user_info'] = {'email': 'tester@skylarkdrones.com'}
+            session['access_token'] = 'ya29.test-token'
+        yield client
+
+
+def log_in_as(client, email):
+    with client.session_transaction() as session:
+        session['user_info'] = {'email': email}
+
+
+ANALYSIS = {
+    'analysis_data': {'content_category': 'SALES', 'product_line': 'SP'},
+    'folder_data': {'recommended_folder': 'Marketing Hub → 04_Sales Enablement → Presentations', 'confidence': '90'}
+}
+
+
+def put_in_chunks(upload_url, payload, chunk_size):
+    """Send the file the way the browser does: Content-Range PUTs until Drive returns the file"""
+    offset = 0
+    while True:
+        end = min(offset + chunk_size, len(payload))
+        response = requests.put(upload_url, data=payload[offset:end],
+                                headers={'Content-Range': f"bytes {offset}-{end - 1}/{len(payload)}"})
+        if response.status_code != 308:
+            return response.json()
+        offset = end
+
+
+def start_session(client, size, analysis=ANALYSIS):
+    return client.post('/api/upload/session', json={
+        'filename': 'Spectra Sales Deck.pdf', 'fileType': 'application/pdf', 'fileSize': size, 'analysis': analysis
+    })
+
+
+def test_direct_upload_round_trip(client, upload_server, monkeypatch):
+    monkeypatch.setattr(main, 'UPLOAD_CHUNK_SIZE', MB)
+    payload = b'%PDF' + b'x' * (3 * MB)
+
+    session_response = start_session(client, len(payload))
+    upload_session = session_response.get_json()
+    assert session_response.status_code == 200
+    assert upload_session['folder_path'] == 'Marketing Hub → 04_Sales Enablement → Presentations'
+    assert upload_session['chunk_size'] == MB
+
+    drive_file = put_in_chunks(upload_session['upload_url'], payload, upload_session['chunk_size'])
+    result = client.post('/api/upload/finalize', json={
+        'upload_token': upload_session['upload_token'], 'file_id': drive_file['id']
+    }).get_json()
+
+    assert result['status'] == 'success'
+    assert result['file_id'] == drive_file['id']
+    assert result['final_name'] == upload_session['final_name']
+    assert result['folder_path'] == upload_session['folder_path']
+    assert upload_server.chunk_requests == 4
+    assert upload_server.files[drive_file['id']]['size'] == len(payload)
+    assert upload_server.files[drive_file['id']]['parents'] == ['presentations-folder']
+
+
+def test_session_request_carries_upload_headers(client, upload_server):
+    start_session(client, 12345)
+
+    headers = next(iter(upload_server.sessions.values()))['headers']
+    assert headers['Authorization'] == 'Bearer ya29.test-token'
+    assert headers['X-Upload-Content-Length'] == '12345'
+    assert headers['X-Upload-Content-Type'] == 'application/pdf'
+    assert headers['Origin'] == 'http://localhost'
+
+
+def test_unresolvable_folder_falls_back_to_hub_root(client, upload_server):
+    analysis = {'folder_data': {'recommended_folder': 'Marketing Hub → Nowhere'}}
+
+    upload_session = start_session(client, 10, analysis=analysis).get_json()
+
+    assert upload_session['folder_path'] == 'Marketing Hub'
+    assert next(iter(upload_server.sessions.values()))['metadata']['parents'] == ['hub-root']
+
+
+def test_finalize_rejects_unknown_token(client, upload_server):
+    response = client.post('/api/upload/finalize', json={'upload_token': 'bogus', 'file_id': 'x'})
+
+    assert response.status_code == 404
+
+
+def test_finalize_rejects_file_outside_session_folder(client, upload_server, drive):
+    upload_session = start_session(client, 10).get_json()
+    drive.add_file('Elsewhere.pdf', 'sales-folder', file_id='stray-file')
+
+    response = client.post('/api/upload/finalize', json={
+        'upload_token': upload_session['upload_token'], 'file_id': 'stray-file'
+    })
+
+    assert response.status_code == 409
+
+
+def test_finalize_can_be_retried_after_a_transient_drive_error(client, upload_server, drive):
+    payload = b'%PDF' + b'x' * 1000
+    upload_session = start_session(client, len(payload)).get_json()
+    drive_file = put_in_chunks(upload_session['upload_url'], payload, len(payload))
+    finalize = {'upload_token': upload_session['upload_token'], 'file_id': drive_file['id']}
+    drive.fail_next('files.get', http_error(503, 'backendError', 'Backend Error'))
+
+    failed = client.post('/api/upload/finalize', json=finalize)
+    retried = client.post('/api/upload/finalize', json=finalize)
+
+    assert failed.status_code == 502
+    assert retried.status_code == 200
+    assert retried.get_json()['final_name'] == upload_session['final_name']
+    assert folder_name_index.stats()['confirmed'] == 1
+    # A finalize whose response was lost is repeated by the browser and gets the same answer
+    repeated = client.post('/api/upload/finalize', json=finalize)
+    assert repeated.status_code == 200
+    assert repeated.get_json()['final_name'] == upload_session['final_name']
+    assert folder_name_index.stats()['confirmed'] == 1
+
+
+def test_another_user_cannot_finalize_or_abort_the_upload(client, upload_server):
+    payload = b'%PDF' + b'x' * 1000
+    upload_session = start_session(client, len(payload)).get_json()
+    drive_file = put_in_chunks(upload_session['upload_url'], payload, len(payload))
+    token = upload_session['upload_token']
+
+    log_in_as(client, 'someone-else@skylarkdrones.com')
+    assert client.post('/api/upload/abort', json={'upload_token': token}).status_code == 404
+    assert client.post('/api/upload/finalize', json={'upload_token': token, 'file_id': drive_file['id']}).status_code == 404
+
+    log_in_as(client, 'tester@skylarkdrones.com')
+    finalized = client.post('/api/upload/finalize', json={'upload_token': token, 'file_id': drive_file['id']})
+    assert finalized.status_code == 200
+    assert finalized.get_json()['final_name'] == upload_session['final_name']
+
+
+def test_finalize_of_a_missing_file_releases_its_version(client, upload_server, drive):
+    upload_session = start_session(client, 10).get_json()
+    drive.fail_next('files.get', http_error(404, 'notFound', 'File not found'))
+
+    response = client.post('/api/upload/finalize', json={
+        'upload_token': upload_session['upload_token'], 'file_id': 'never-uploaded'
+    })
+
+    assert response.status_code == 404
+    assert start_session(client, 10).get_json()['final_name'] == upload_session['final_name']
+
+
+def test_retry_resumes_the_existing_session_without_skipping_a_version(client, upload_server):
+    """The browser's retry: ask the earlier session for its offset ('bytes */N') and finish it"""
+    payload = b'%PDF' + b'x' * (3 * MB)
+    upload_session = start_session(client, len(payload)).get_json()
+    upload_url = upload_session['upload_url']
+    requests.put(upload_url, data=payload[:MB], headers={'Content-Range': f"bytes 0-{MB - 1}/{len(payload)}"})
+
+    status = requests.put(upload_url, headers={'Content-Range': f"bytes */{len(payload)}"})
+    offset = int(status.headers['Range'].split('-')[1]) + 1
+    drive_file = requests.put(upload_url, data=payload[offset:], headers={
+        'Content-Range': f"bytes {offset}-{len(payload) - 1}/{len(payload)}"
+    }).json()
+    result = client.post('/api/upload/finalize', json={
+        'upload_token': upload_session['upload_token'], 'file_id': drive_file['id']
+    }).get_json()
+    next_session = start_session(client, len(payload)).get_json()
+
+    assert status.status_code == 308 and offset == MB
+    assert upload_server.chunk_offsets == [0, MB]
+    assert result['final_name'] == upload_session['final_name']
+    assert next_session['final_name'] == upload_session['final_name'].replace('_v01.', '_v02.')
+
+
+def test_session_requires_drive_credentials(upload_server):
+    with main.app.test_client() as client:
+        with client.session_transaction() as session:
+            session['user_info'] = {'email': 'tester@skylarkdrones.com'}
+
+        response = client.post('/api/upload/session', json={'filename': 'a.pdf', 'fileSize': 1})
+
+    assert response.status_code == 401
+    assert response.get_json()['error_type'] == 'auth_expired'
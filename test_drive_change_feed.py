@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Tests for the Drive Changes feed follower and its typed change events
+"""
+
+from fake_google import FakeDrive, build_marketing_hub, make_drive_service
+from services_enhanced import (
+    DriveChangeEvent, DriveChangeFeed, drive_change_feed, folder_tree_cache, naming_rules_cache
+)
+
+
+def follow_hub(top_level=2, per_folder=2, depth=2):
+    """A fake hub and a manually polled feed following it, recording every event"""
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=top_level, per_folder=per_folder, depth=depth)
+    drive_service = make_drive_service(fake)
+    feed = DriveChangeFeed(poll_interval=0)
+    assert feed.start(root_id, drive_service)
+    events = []
+    feed.subscribe(events.append)
+    return fake, root_id, drive_service, feed, events
+
+
+def children_of(fake, parent_id):
+    return [item['id'] for item in fake.items.values() if item['parents'] == [parent_id]]
+
+
+def test_folder_changes_are_typed():
+    fake, root_id, _, feed, events = follow_hub()
+    first, second = children_of(fake, root_id)
+    # Drive reports only the latest state of an item per poll, so poll after each step
+    campaign_id = fake.add_folder('Fresh Campaign', first)
+    feed.poll()
+    fake.update(campaign_id, name='Launch Campaign')
+    feed.poll()
+    fake.update(campaign_id, parents=[second])
+    fake.touch(second)
+    feed.poll()
+    fake.update(first, trashed=True)
+    feed.poll()
+    fake.update(second, parents=['someone-elses-folder'])
+    feed.poll()
+
+    assert [(event.kind, event.file_id) for event in events] == [
+        (DriveChangeEvent.FOLDER_CREATED, campaign_id),
+        (DriveChangeEvent.FOLDER_RENAMED, campaign_id),
+        (DriveChangeEvent.FOLDER_MOVED, campaign_id),
+        (DriveChangeEvent.FOLDER_TRASHED, first),
+        (DriveChangeEvent.FOLDER_MOVED, second),
+    ]
+    assert events[1].name == 'Launch Campaign'
+    assert events[3].folder_ids == {first, *children_of(fake, first)}
+    assert events[4].in_hub is False and campaign_id in events[4].folder_ids
+    assert feed.stats()['hub_folders'] == 0
+
+
+def test_file_and_document_events():
+    fake, root_id, _, feed, events = follow_hub()
+    folder_id = children_of(fake, root_id)[0]
+    file_id = fake.add_file('Deck.pdf', folder_id, size='100')
+    feed.poll()
+    fake.update(file_id, name='Deck v2.pdf')
+    feed.poll()
+    fake.update(file_id, parents=['someone-elses-folder'])
+    fake.add_file('Unrelated.pdf', 'someone-elses-folder')
+    doc_id = fake.add_file('Naming Convention', None, mime_type='application/vnd.google-apps.document')
+    feed.watch_documents([doc_id])
+    fake.add_file('Someone else\'s notes', None, mime_type='application/vnd.google-apps.document')
+    hub_doc_id = fake.add_file('Brief', folder_id, mime_type='application/vnd.google-apps.document')
+    feed.poll()
+
+    assert [(event.kind, event.file_id) for event in events] == [
+        (DriveChangeEvent.FILE_ADDED, file_id),
+        (DriveChangeEvent.FILE_CHANGED, file_id),
+        (DriveChangeEvent.FILE_REMOVED, file_id),
+        (DriveChangeEvent.DOC_MODIFIED, doc_id),
+        (DriveChangeEvent.FILE_ADDED, hub_doc_id),
+        (DriveChangeEvent.DOC_MODIFIED, hub_doc_id),
+    ]
+    assert events[1].name == 'Deck v2.pdf'
+    assert feed.stats()['events'][DriveChangeEvent.FILE_ADDED] == 2
+
+
+def test_subscribers_register_and_unregister_at_runtime():
+    fake, root_id, _, feed, events = follow_hub()
+    folder_id = children_of(fake, root_id)[0]
+    folder_events = []
+    subscription = feed.subscribe(lambda event: folder_events.append(event.kind), DriveChangeEvent.FOLDER_KINDS)
+    feed.subscribe(lambda event: 1 / 0)
+
+    fake.add_file('Deck.pdf', folder_id)
+    fake.add_folder('Campaign A', folder_id)
+    feed.poll()
+    assert feed.unsubscribe(subscription)
+    fake.add_folder('Campaign B', folder_id)
+    feed.poll()
+
+    assert folder_events == [DriveChangeEvent.FOLDER_CREATED]
+    assert len(events) == 3  # a failing subscriber does not starve the others
+    assert feed.stats()['subscriber_errors'] == 3
+    assert not feed.unsubscribe(subscription)
+
+
+def test_scripted_feed_pages_and_resumes_after_failure():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=1, per_folder=1, depth=1)
+    folder_id = children_of(fake, root_id)[0]
+    drive_service = make_drive_service(fake)
+    pages = {
+        '7': {'nextPageToken': '8', 'changes': [
+            {'fileId': 'a', 'removed': False, 'file': {'id': 'a', 'name': 'A.pdf', 'parents': [folder_id]}},
+        ]},
+        '8': {'newStartPageToken': '9', 'changes': [
+            {'fileId': 'a', 'removed': True},
+            {'fileId': 'stranger', 'removed': True},
+        ]},
+        '9': {'newStartPageToken': '9', 'changes': []},
+    }
+    requests, failures = [], ['8']
+
+    def list_changes(page_token, file_fields, drive_id=None):
+        requests.append((page_token, drive_id))
+        if page_token in failures:
+            failures.remove(page_token)
+            raise TimeoutError("changes.list timed out")
+        return pages[page_token]
+
+    drive_service.get_drive_id = lambda folder_id: 'shared-drive'
+    drive_service.get_changes_start_token = lambda drive_id=None: '7'
+    drive_service.list_changes = list_changes
+    feed = DriveChangeFeed(poll_interval=0)
+    events = []
+    feed.subscribe(events.append)
+    feed.start(root_id, drive_service)
+
+    assert feed.poll() == 1
+    assert feed.poll() == 1
+    assert feed.poll() == 0
+
+    assert requests == [('7', 'shared-drive'), ('8', 'shared-drive'), ('8', 'shared-drive'), ('9', 'shared-drive')]
+    assert [event.kind for event in events] == [DriveChangeEvent.FILE_ADDED, DriveChangeEvent.FILE_REMOVED]
+    assert feed.stats()['errors'] == 1
+
+
+def test_feed_keeps_polling_as_the_identity_that_started_it():
+    fake, root_id, drive_service, feed, _ = follow_hub()
+    other_user = make_drive_service(FakeDrive())
+    other_user.credentials = type('Credentials', (), {'refresh_token': 'someone-else', 'token': 'x'})()
+    same_user = make_drive_service(fake)
+
+    assert feed.start(root_id, other_user)
+    assert feed._drive_service is drive_service
+    assert feed.start(root_id, same_user)
+    assert feed._drive_service is same_user
+
+    fake.fail_next('changes.list', RuntimeError("Drive unavailable"))
+    feed.poll()
+    assert feed.start(root_id, other_user)
+    assert feed._drive_service is other_user
+    assert feed.stats()['identity_changes'] == 1
+
+
+def test_hub_caches_follow_the_shared_feed():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=2, per_folder=1, depth=1)
+    doc_id = fake.add_file('Naming Convention', None, mime_type='application/vnd.google-apps.document',
+                           file_id='naming-doc', content='PREFIXES:\n- SP: Spectra Series')
+    drive_service = make_drive_service(fake)
+    naming_rules_cache.get_rules(doc_id, drive_service)
+    drive_change_feed.start(root_id, drive_service)
+    assert folder_tree_cache.peek(root_id) is not None
+
+    fake.add_folder('Fresh Campaign', children_of(fake, root_id)[0])
+    fake.update(doc_id, content='PREFIXES:\n- MA: Marvel Aerial')
+    drive_change_feed.poll()
+
+    assert folder_tree_cache.peek(root_id) is None
+    assert 'Fresh Campaign' in drive_service.get_real_folder_structure(root_id)
+    assert 'Marvel Aerial' in naming_rules_cache.get_rules(doc_id, drive_service)['rules']
+    assert naming_rules_cache.stats()['refreshes'] == 2
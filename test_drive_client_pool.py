@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Tests and microbenchmark for the per-user, per-thread Drive client pool
+"""
+
+import time
+import threading
+from datetime import datetime, timedelta
+
+from googleapiclient.discovery import build
+from google.oauth2.credentials import Credentials
+
+from fake_google import FakeDrive
+from services_enhanced import DriveService, DriveClientPool, drive_client_pool
+
+
+def user_credentials(user, token='ya29.access', expiry=None):
+    return Credentials(token=token, refresh_token=f"refresh-{user}", expiry=expiry,
+                       token_uri='https://oauth2.googleapis.com/token', client_id='id', client_secret='secret')
+
+
+def test_requests_from_same_user_and_thread_share_one_client():
+    first = DriveService(user_credentials('alice'))
+    second = DriveService(user_credentials('alice', token='ya29.refreshed'))
+
+    assert second.service is first.service
+    assert drive_client_pool.stats()['builds'] == 1
+    assert drive_client_pool.stats()['hits'] == 1
+
+
+def test_refreshed_access_token_reaches_pooled_client():
+    first_credentials = user_credentials('alice')
+    DriveService(first_credentials)
+
+    DriveService(user_credentials('alice', token='ya29.refreshed'))
+
+    assert first_credentials.token == 'ya29.refreshed'
+
+
+def test_users_and_threads_get_separate_clients():
+    alice = DriveService(user_credentials('alice'))
+    bob = DriveService(user_credentials('bob'))
+    from_worker = []
+    worker = threading.Thread(target=lambda: from_worker.append(alice.get_thread_service()))
+    worker.start()
+    worker.join()
+
+    assert alice.service is not bob.service
+    assert from_worker[0] is not alice.service
+    assert drive_client_pool.stats()['builds'] == 3
+
+
+def test_pool_evicts_least_recently_used_client():
+    pool = DriveClientPool(max_entries=2)
+    alice = pool.get(user_credentials('alice'))
+    pool.get(user_credentials('bob'))
+    pool.get(user_credentials('alice'))
+    pool.get(user_credentials('carol'))
+
+    assert pool.stats()['evictions'] == 1
+    assert pool.get(user_credentials('alice')) is alice
+    assert pool.stats()['builds'] == 3
+
+
+def test_availability_uses_token_state_without_network_call():
+    fake = FakeDrive()
+    drive_service = DriveService(None)
+    drive_service.service = fake
+
+    drive_service.credentials = user_credentials('alice')
+    assert drive_service.is_available()
+
+    expired = datetime.utcnow() - timedelta(hours=1)
+    drive_service.credentials = user_credentials('alice', expiry=expired)
+    assert drive_service.is_available()  # refreshable
+
+    drive_service.credentials = Credentials(token='ya29.stale', expiry=expired)
+    assert not drive_service.is_available()
+
+    assert fake.calls['about.get'] == 0
+
+
+def test_benchmark_request_overhead_pooled_vs_per_request_build():
+    """Per-request Drive setup: build + about.get ping per availability check, versus the pool"""
+    fake = FakeDrive(latency=0.02)  # ~20 ms round trip for the old about.get ping
+    credentials = user_credentials('alice')
+    requests_per_run = 20
+    availability_checks = 3  # naming rules, folder structure and document read each checked
+
+    started = time.perf_counter()
+    for _ in range(requests_per_run):
+        build('drive', 'v3', credentials=credentials)
+        for _ in range(availability_checks):
+            fake.about().get(fields='user').execute()
+    per_request_before = (time.perf_counter() - started) / requests_per_run
+
+    started = time.perf_counter()
+    for _ in range(requests_per_run):
+        drive_service = DriveService(credentials)
+        for _ in range(availability_checks):
+            assert drive_service.is_available()
+    per_request_after = (time.perf_counter() - started) / requests_per_run
+
+    print(f"Drive setup per request: before {per_request_before * 1000:.1f} ms, "
+          f"after {per_request_after * 1000:.2f} ms")
+    assert drive_client_pool.stats()['builds'] == 1
+    assert per_request_after < per_request_before * 0.1
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests and benchmark for the breadth-first, batched and parallel Marketing Hub folder crawl
+"""
+
+import math
+import time
+import threading
+
+from fake_google import FakeDrive, build_marketing_hub, http_error, make_drive_service, rate_limit_error
+from services_enhanced import DriveService
+
+
+def test_crawl_round_trips_scale_with_depth_not_folder_count():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=6, per_folder=4, depth=3)
+    drive_service = make_drive_service(fake)
+
+    tree = drive_service.get_folder_tree(root_id)
+
+    # 6 + 24 + 96 folders, crawled with one query per batch of parents per level
+    assert len(tree['folders']) == 126
+    batch = DriveService.FOLDER_QUERY_MAX_PARENTS
+    expected = 1 + math.ceil(6 / batch) + math.ceil(24 / batch)
+    assert fake.calls['files.list'] == expected
+
+
+def test_crawl_follows_pagination_instead_of_truncating():
+    fake = FakeDrive(max_page_size=100)
+    root_id = fake.add_folder('Marketing Hub', folder_id='hub-root')
+    campaigns = fake.add_folder('03_Marketing Campaigns', root_id)
+    for index in range(150):
+        fake.add_folder(f"Campaign {index:03d}", campaigns)
+
+    tree = make_drive_service(fake).get_folder_tree(root_id, max_depth=2)
+
+    assert len(tree['folders']) == 151
+    assert fake.calls['files.list'] == 3
+
+
+def test_paths_are_rebuilt_from_parents_field():
+    fake = FakeDrive()
+    root_id = fake.add_folder('Marketing Hub', folder_id='hub-root')
+    sales = fake.add_folder('04_Sales Enablement', root_id)
+    industry = fake.add_folder('Industry Specific Material', sales)
+    fake.add_folder('Mining', industry)
+
+    tree = make_drive_service(fake).get_folder_tree(root_id)
+    paths = {folder['path'] for folder in tree['folders']}
+
+    assert "Marketing Hub → 04_Sales Enablement → Industry Specific Material → Mining" in paths
+
+
+def test_parent_batches_respect_query_length_limit():
+    drive_service = DriveService(None)
+    parent_ids = [f"{index:033d}" for index in range(200)]
+
+    batches = list(drive_service._batch_parent_ids(parent_ids))
+
+    assert sum(len(batch) for batch in batches) == 200
+    for batch in batches:
+        query = " or ".join(f"'{parent_id}' in parents" for parent_id in batch)
+        assert len(batch) <= DriveService.FOLDER_QUERY_MAX_PARENTS
+        assert len(query) <= DriveService.FOLDER_QUERY_MAX_LENGTH
+
+
+def test_rate_limited_list_calls_back_off_and_retry():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=3, per_folder=2, depth=2)
+    fake.fail_next('files.list', rate_limit_error(), times=2)
+    drive_service = make_drive_service(fake)
+    drive_service.RATE_LIMIT_BACKOFF_BASE = 0.001
+
+    tree = drive_service.get_folder_tree(root_id)
+
+    assert len(tree['folders']) == 9
+    # three levels listed, two of the calls retried once each
+    assert fake.calls['files.list'] == 3 + 2
+
+
+def test_other_http_errors_are_not_retried():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=3, per_folder=2, depth=2)
+    fake.fail_next('files.list', http_error(404, 'notFound'))
+    drive_service = make_drive_service(fake)
+
+    assert drive_service.get_folder_tree(root_id) is None
+    assert fake.calls['files.list'] == 1
+
+
+def test_parallel_crawl_uses_one_client_per_worker_thread():
+    # A little latency keeps batches overlapping, so the pool really starts more than one thread
+    fake = FakeDrive(latency=0.01)
+    root_id = build_marketing_hub(fake, top_level=40, per_folder=4, depth=3)
+    drive_service = make_drive_service(fake)
+    built = []
+
+    def factory():
+        built.append(threading.get_ident())
+        return fake
+
+    drive_service.service_factory = factory
+    drive_service.max_workers = 4
+    tree = drive_service.get_folder_tree(root_id)
+
+    assert len(tree['folders']) == 40 + 160 + 640
+    assert 1 < len(built) <= 4
+    assert len(set(built)) == len(built)
+
+
+def test_parallel_crawl_matches_serial_crawl():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=40, per_folder=4, depth=3)
+
+    serial = make_drive_service(fake)
+    serial.max_workers = 1
+    serial_tree = serial._crawl_folder_tree(root_id, 3)
+
+    parallel = make_drive_service(fake)
+    parallel.service_factory = lambda: fake
+    parallel.max_workers = 8
+    parallel_tree = parallel._crawl_folder_tree(root_id, 3)
+
+    assert parallel_tree['structure'] == serial_tree['structure']
+
+
+def test_benchmark_parallel_crawl_scaling():
+    """Wall-clock crawl time against a fake Drive with 20 ms per call, by worker count"""
+    fake = FakeDrive(latency=0.02)
+    root_id = build_marketing_hub(fake, top_level=40, per_folder=4, depth=4)
+    timings = {}
+
+    for workers in (1, 2, 4, 8):
+        drive_service = make_drive_service(fake)
+        drive_service.service_factory = lambda: fake
+        drive_service.max_workers = workers
+        fake.reset_calls()
+
+        started = time.perf_counter()
+        tree = drive_service._crawl_folder_tree(root_id, 4)
+        timings[workers] = time.perf_counter() - started
+
+        assert len(tree['folders']) == 40 + 160 + 640 + 2560
+        print(f"workers={workers}: {timings[workers] * 1000:.0f} ms, {fake.calls['files.list']} list calls")
+
+    assert timings[4] < timings[1] * 0.75
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests for the process-wide Marketing Hub folder tree cache
+"""
+
+import time
+
+import pytest
+
+from fake_google import FakeDrive, build_marketing_hub, make_drive_service
+from services_enhanced import (
+    GeminiService, NamingConventionService, IntelligentWorkflowOrchestrator, folder_tree_cache, hub_file_index
+)
+
+
+@pytest.fixture(autouse=True)
+def default_ttl(monkeypatch):
+    monkeypatch.setattr(folder_tree_cache, 'ttl_seconds', 300)
+
+
+def make_orchestrator(fake):
+    gemini_service = GeminiService.__new__(GeminiService)
+    gemini_service.api_key = None
+    gemini_service.model = None
+    drive_service = make_drive_service(fake)
+    naming_service = NamingConventionService(drive_service, 'naming-doc')
+    return IntelligentWorkflowOrchestrator(gemini_service, drive_service, naming_service)
+
+
+def test_second_analyze_makes_no_list_calls():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=3, per_folder=2, depth=2)
+    fake.add_file('Naming Convention', None, mime_type='application/vnd.google-apps.document',
+                  file_id='naming-doc', content='PREFIXES:\n- SP: Spectra Series')
+
+    make_orchestrator(fake).execute_intelligent_workflow('Spectra Brochure.pdf', 'application/pdf', 1000, root_id)
+    assert fake.calls['files.list'] > 0
+    # The duplicate check answers from the hub file index once its background build lands
+    deadline = time.time() + 5
+    while not hub_file_index.is_ready(root_id) and time.time() < deadline:
+        time.sleep(0.01)
+
+    before = folder_tree_cache.stats()
+
+    fake.reset_calls()
+    make_orchestrator(fake).execute_intelligent_workflow('Spectra Brochure.pdf', 'application/pdf', 1000, root_id)
+    assert fake.calls['files.list'] == 0
+
+    stats = folder_tree_cache.stats()
+    assert stats['hits'] - before['hits'] == 1
+    assert stats['misses'] == before['misses']
+    assert stats['last_refresh_seconds'] is not None
+
+
+def test_expired_entry_revalidates_with_probe_instead_of_crawl():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=3, per_folder=3, depth=3)
+    drive_service = make_drive_service(fake)
+
+    first = drive_service.get_real_folder_structure(root_id)
+    crawl_calls = fake.calls['files.list']
+
+    folder_tree_cache.ttl_seconds = 0
+    fake.reset_calls()
+    second = drive_service.get_real_folder_structure(root_id)
+
+    assert second == first
+    assert fake.calls['files.list'] == 1 < crawl_calls
+    assert folder_tree_cache.stats()['revalidations'] == 1
+
+
+def test_modified_top_level_folder_triggers_recrawl():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=2, per_folder=2, depth=2)
+    drive_service = make_drive_service(fake)
+    drive_service.get_real_folder_structure(root_id)
+
+    top_level_id = next(item['id'] for item in fake.items.values() if item['parents'] == [root_id])
+    fake.add_folder('Fresh Campaign', top_level_id)
+    fake.touch(top_level_id)
+
+    folder_tree_cache.ttl_seconds = 0
+    structure = drive_service.get_real_folder_structure(root_id)
+
+    assert 'Fresh Campaign' in structure
+    assert folder_tree_cache.stats()['misses'] == 2
+
+
+def test_change_deep_in_the_hub_triggers_recrawl():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=2, per_folder=2, depth=3)
+    drive_service = make_drive_service(fake)
+    drive_service.get_real_folder_structure(root_id)
+
+    # Renaming a third-level folder leaves the root and top-level folders untouched
+    deep_id = next(item['id'] for item in fake.items.values()
+                   if folder_tree_cache.peek(root_id)['folder_map'].get(item['id'], {}).get('depth') == 2)
+    fake.update(deep_id, name='Renamed Deep Folder')
+
+    folder_tree_cache.ttl_seconds = 0
+    structure = drive_service.get_real_folder_structure(root_id)
+
+    assert 'Renamed Deep Folder' in structure
+    assert folder_tree_cache.stats()['revalidations'] == 0
+
+
+def test_entry_invalidated_during_the_probe_is_recrawled():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=2, per_folder=2, depth=2)
+    drive_service = make_drive_service(fake)
+    drive_service.get_real_folder_structure(root_id)
+    probe = drive_service._probe_hub_changed
+
+    def probe_then_invalidate(folder_id, entry):
+        changed = probe(folder_id, entry)
+        folder_tree_cache.invalidate(root_id)
+        return changed
+
+    drive_service._probe_hub_changed = probe_then_invalidate
+    folder_tree_cache.ttl_seconds = 0
+    drive_service.get_real_folder_structure(root_id)
+
+    assert folder_tree_cache.stats()['revalidations'] == 0
+    assert folder_tree_cache.stats()['refreshes'] == 2
+
+
+def test_cache_is_shared_across_drive_service_instances():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=2, per_folder=2, depth=2)
+
+    make_drive_service(fake).get_real_folder_structure(root_id)
+    fake.reset_calls()
+    make_drive_service(fake).get_real_folder_structure(root_id)
+
+    assert fake.calls['files.list'] == 0
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Tests for vNN allocation through the per-folder name index
+"""
+
+import threading
+from datetime import datetime
+
+import main
+from fake_google import FakeDrive, build_marketing_hub, make_drive_service
+from test_direct_upload import drive, upload_server, client, start_session, put_in_chunks, ANALYSIS
+from services_enhanced import (
+    NamingConventionService, NamingRuleSet, FolderNameIndex, FALLBACK_NAMING_RULES, folder_name_index
+)
+
+RULES = NamingRuleSet.parse(FALLBACK_NAMING_RULES)
+TODAY = datetime.now().strftime('%Y%m%d')
+DECK = {'product_line': 'SP', 'content_category': 'SALES'}
+
+
+def test_version_key_masks_version_and_extension():
+    assert RULES.version_key('SP-PRES_deck_20240305_v03.pdf') == ('SP-PRES_deck_20240305_vNN', 3)
+    assert RULES.version_key('SP-PRES_deck_20240305_v12.pptx') == ('SP-PRES_deck_20240305_vNN', 12)
+    assert RULES.version_key('Final deck (2).pdf') == (None, None)
+
+
+def test_allocates_next_free_version_after_existing_names():
+    fake = FakeDrive()
+    fake.add_folder('Presentations', folder_id='decks')
+    fake.add_file(f"SP-PRES_sales_deck_{TODAY}_v01.pdf", 'decks')
+    fake.add_file(f"SP-PRES_sales_deck_{TODAY}_v03.pptx", 'decks')
+    fake.add_file(f"SP-PRES_other_deck_{TODAY}_v07.pdf", 'decks')
+    naming_service = NamingConventionService(make_drive_service(fake))
+
+    first, reservation = naming_service.allocate_filename('Sales Deck.pdf', DECK, 'decks')
+    fake.reset_calls()
+    second, _ = naming_service.allocate_filename('Sales Deck.pdf', DECK, 'decks')
+    fresh, _ = naming_service.allocate_filename('New Deck.pdf', DECK, 'decks')
+
+    assert first == f"SP-PRES_sales_deck_{TODAY}_v04.pdf"
+    assert reservation == ('decks', f"SP-PRES_sales_deck_{TODAY}_vNN", 4)
+    assert second == f"SP-PRES_sales_deck_{TODAY}_v05.pdf"
+    assert fresh == f"SP-PRES_new_deck_{TODAY}_v01.pdf"
+    assert fake.calls['files.list'] == 0
+
+
+def test_concurrent_reservations_get_distinct_versions():
+    fake = FakeDrive(latency=0.02)
+    fake.add_folder('Presentations', folder_id='decks')
+    drive_service = make_drive_service(fake)
+    stem = f"SP-PRES_sales_deck_{TODAY}_vNN"
+    versions = []
+    barrier = threading.Barrier(16)
+
+    def reserve():
+        barrier.wait()
+        versions.append(folder_name_index.reserve('decks', stem, RULES, drive_service))
+
+    threads = [threading.Thread(target=reserve) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(versions) == list(range(1, 17))
+    assert fake.calls['files.list'] == 1
+
+
+def test_released_version_is_reused_and_confirmed_is_not():
+    fake = FakeDrive()
+    fake.add_folder('Presentations', folder_id='decks')
+    drive_service = make_drive_service(fake)
+    stem = f"SP-PRES_sales_deck_{TODAY}_vNN"
+
+    confirmed = folder_name_index.reserve('decks', stem, RULES, drive_service)
+    folder_name_index.confirm(('decks', stem, confirmed))
+    failed = folder_name_index.reserve('decks', stem, RULES, drive_service)
+    folder_name_index.release(('decks', stem, failed))
+
+    assert folder_name_index.reserve('decks', stem, RULES, drive_service) == failed == 2
+
+
+def test_cached_hub_crawl_indexes_every_folder_in_one_listing():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=3, per_folder=3, depth=2)
+    drive_service = make_drive_service(fake)
+    drive_service.get_folder_tree(root_id)
+    folders = [item['id'] for item in fake.items.values() if item['mimeType'].endswith('folder')]
+    fake.add_file(f"SP-PRES_sales_deck_{TODAY}_v02.pdf", folders[-1])
+    index = FolderNameIndex()
+
+    fake.reset_calls()
+    for folder_id in folders:
+        index.reserve(folder_id, f"SP-PRES_sales_deck_{TODAY}_vNN", RULES, drive_service, root_id)
+
+    assert fake.calls['files.list'] == 1
+    assert index.reserve(folders[-1], f"SP-PRES_sales_deck_{TODAY}_vNN", RULES, drive_service, root_id) == 4
+
+
+def test_repeat_uploads_to_same_folder_get_increasing_versions(client, upload_server):
+    payload = b'%PDF' + b'x' * 1000
+    names = []
+    for _ in range(2):
+        upload_session = start_session(client, len(payload)).get_json()
+        drive_file = put_in_chunks(upload_session['upload_url'], payload, len(payload))
+        result = client.post('/api/upload/finalize', json={
+            'upload_token': upload_session['upload_token'], 'file_id': drive_file['id']
+        }).get_json()
+        names.append(result['final_name'])
+
+    assert names == [f"SP-PRES_spectra_sales_deck_{TODAY}_v01.pdf", f"SP-PRES_spectra_sales_deck_{TODAY}_v02.pdf"]
+    assert folder_name_index.stats()['confirmed'] == 2
+
+
+def test_cancelled_upload_does_not_advance_the_next_version(client, upload_server):
+    payload = b'%PDF' + b'x' * 1000
+    cancelled = start_session(client, len(payload)).get_json()
+
+    aborted = client.post('/api/upload/abort', json={'upload_token': cancelled['upload_token']})
+    upload_session = start_session(client, len(payload)).get_json()
+    drive_file = put_in_chunks(upload_session['upload_url'], payload, len(payload))
+    result = client.post('/api/upload/finalize', json={
+        'upload_token': upload_session['upload_token'], 'file_id': drive_file['id']
+    }).get_json()
+
+    assert aborted.get_json()['status'] == 'aborted'
+    assert result['final_name'] == cancelled['final_name'] == f"SP-PRES_spectra_sales_deck_{TODAY}_v01.pdf"
+    # The cancelled Drive session no longer accepts bytes, and its token is gone
+    assert len(upload_server.sessions) == 1
+    assert client.post('/api/upload/abort', json={'upload_token': cancelled['upload_token']}).status_code == 404
+    # A completed upload keeps its token (and its version) until it expires
+    assert client.post('/api/upload/abort', json={'upload_token': upload_session['upload_token']}).status_code == 409
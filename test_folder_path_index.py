@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for resolving recommended folder paths through the cached folder path index
+"""
+
+import pytest
+
+from fake_google import FakeDrive
+from services_enhanced import DriveService, FolderPathIndex
+from main import find_folder_by_path
+
+
+@pytest.fixture
+def hub():
+    fake = FakeDrive()
+    root_id = fake.add_folder('Marketing Hub', folder_id='hub-root')
+    brand = fake.add_folder('01_Brand Assets', root_id, folder_id='brand')
+    fake.add_folder('Company Profiles', brand, folder_id='profiles')
+    sales = fake.add_folder('04_Sales Enablement', root_id, folder_id='sales')
+    industry = fake.add_folder('Industry Specific Material', sales, folder_id='industry')
+    fake.add_folder('Solar & Renewable Energy', industry, folder_id='solar')
+    return fake, root_id
+
+
+def crawl(fake, root_id):
+    drive_service = DriveService(None)
+    drive_service.service = fake
+    drive_service.get_folder_tree(root_id)
+
+
+@pytest.mark.parametrize('path', [
+    "Marketing Hub → 04_Sales Enablement → Industry Specific Material → Solar & Renewable Energy",
+    "Marketing Hub/04_Sales Enablement/Industry Specific Material/Solar & Renewable Energy",
+    "marketing hub →  04_sales enablement→industry   specific material → SOLAR & RENEWABLE ENERGY",
+    "04_Sales Enablement → Industry Specific Material → Solar & Renewable Energy",
+])
+def test_warm_cache_resolves_without_network_calls(hub, path):
+    fake, root_id = hub
+    crawl(fake, root_id)
+    fake.reset_calls()
+
+    assert find_folder_by_path(fake, path, root_id) == 'solar'
+    assert sum(fake.calls.values()) == 0
+
+
+def test_hub_root_resolves_to_root_id(hub):
+    fake, root_id = hub
+    crawl(fake, root_id)
+
+    assert find_folder_by_path(fake, "Marketing Hub", root_id) == root_id
+
+
+def test_cold_cache_falls_back_to_drive(hub):
+    fake, root_id = hub
+
+    assert find_folder_by_path(fake, "Marketing Hub → 01_Brand Assets → Company Profiles", root_id) == 'profiles'
+    assert fake.calls['files.list'] == 2
+
+
+def test_index_miss_falls_back_to_drive(hub):
+    fake, root_id = hub
+    crawl(fake, root_id)
+    fake.add_folder('Logos & Visual Identity', 'brand', folder_id='logos')
+    fake.reset_calls()
+
+    assert find_folder_by_path(fake, "Marketing Hub → 01_Brand Assets → Logos & Visual Identity", root_id) == 'logos'
+    assert fake.calls['files.list'] == 2
+
+
+def test_unknown_path_returns_none():
+    index = FolderPathIndex('hub-root', [
+        {'id': 'brand', 'name': '01_Brand Assets', 'depth': 0, 'parent_id': 'hub-root'}
+    ])
+
+    assert index.resolve("Marketing Hub → 01_Brand Assets") == 'brand'
+    assert index.resolve("Marketing Hub → 01_Brand Assets → Missing") is None
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Tests and load test for the event-loop Gemini runner and the polled analysis job endpoints
+"""
+
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import main
+import services_enhanced
+from services_enhanced import GeminiAsyncRunner
+from test_gemini_fused import FUSED_JSON, StubResponse, make_gemini
+
+
+@pytest.fixture
+def use_runner(monkeypatch):
+    """Swap in an unthrottled runner with the given cap for the shared one; stopped after the test"""
+    runners = []
+
+    def use(max_concurrency):
+        runner = GeminiAsyncRunner(max_concurrency=max_concurrency, requests_per_minute=0)
+        runners.append(runner)
+        monkeypatch.setattr(services_enhanced, 'gemini_runner', runner)
+        return runner
+
+    yield use
+    for runner in runners:
+        runner.stop()
+
+
+class AsyncStubModel:
+    """Native async model: waiting on it holds no thread, like genai's generate_content_async"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.active = 0
+        self.peak = 0
+
+    async def generate_content_async(self, prompt, **kwargs):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(self.latency)
+        self.active -= 1
+        return StubResponse(FUSED_JSON)
+
+
+class BlockingStubModel:
+    """Model with only the blocking generate_content call"""
+
+    def __init__(self, latency, fail_on=None):
+        self.latency = latency
+        self.fail_on = fail_on
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.latency)
+        with self._lock:
+            self.active -= 1
+        if prompt == self.fail_on:
+            raise RuntimeError("quota exceeded")
+        return StubResponse(prompt.upper())
+
+
+def test_semaphore_caps_calls_in_flight(use_runner):
+    runner = use_runner(3)
+    model = AsyncStubModel(latency=0.1)
+
+    started = time.perf_counter()
+    futures = [runner.submit(model, f"prompt {number}") for number in range(9)]
+    responses = [future.result() for future in futures]
+    elapsed = time.perf_counter() - started
+
+    assert len(responses) == 9
+    assert model.peak == 3
+    assert 0.3 <= elapsed < 0.6
+    stats = runner.stats()
+    assert stats['completed'] == 9 and stats['peak_in_flight'] == 3 and stats['in_flight'] == 0
+
+
+def test_blocking_models_share_the_same_cap_and_errors_propagate(use_runner):
+    runner = use_runner(2)
+    model = BlockingStubModel(latency=0.05, fail_on='bad')
+
+    responses = runner.generate_many(model, ['a', 'bad', 'c', 'd'])
+
+    assert model.peak == 2
+    assert [response.text for response in responses if not isinstance(response, Exception)] == ['A', 'C', 'D']
+    assert isinstance(responses[1], RuntimeError)
+    with pytest.raises(RuntimeError):
+        runner.generate(model, 'bad')
+    assert runner.stats()['errors'] == 2
+
+
+def test_generate_many_respects_per_batch_limit(use_runner):
+    use_runner(16)
+    model = AsyncStubModel(latency=0.05)
+
+    services_enhanced.gemini_runner.generate_many(model, [f"group {number}" for number in range(6)], limit=2)
+
+    assert model.peak == 2
+
+
+def test_gemini_service_calls_go_through_the_runner(use_runner):
+    runner = use_runner(4)
+
+    content_analysis, folder_recommendation = make_gemini(AsyncStubModel(latency=0)).analyze_and_recommend(
+        'Spectra Manual.pdf', 'application/pdf', 1000, 'rules', 'structure'
+    )
+
+    assert content_analysis['product_line'] == 'SP'
+    assert folder_recommendation['recommended_folder'].endswith('User Manuals')
+    assert runner.stats()['completed'] == 1
+
+
+class GeminiOnlyOrchestrator:
+    """Workflow whose only slow step is one fused Gemini call"""
+
+    def __init__(self, gemini_service, drive_service, naming_service):
+        self.gemini_service = gemini_service
+        self.progress_callback = None
+
+    def set_progress_callback(self, callback):
+        self.progress_callback = callback
+
+    def execute_intelligent_workflow(self, filename, file_type, file_size, marketing_hub_folder_id, mode=None,
+                                     file_md5=None):
+        self.progress_callback(1, 15, "Starting Gemini content analysis...")
+        _, folder_recommendation = self.gemini_service.analyze_and_recommend(
+            filename, file_type, file_size, 'rules', 'structure'
+        )
+        self.progress_callback(3, 100, "Analysis complete")
+        return {'summary': f"Analyzed {filename}", 'recommended_folder': folder_recommendation['recommended_folder']}
+
+
+def logged_in_client(email='tester@skylarkdrones.com'):
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session['user_info'] = {'email': email}
+    return client
+
+
+@pytest.fixture
+def stub_app(monkeypatch):
+    main.app.config['TESTING'] = True
+    monkeypatch.setattr(main, 'IntelligentWorkflowOrchestrator', GeminiOnlyOrchestrator)
+
+    def use_model(model):
+        monkeypatch.setattr(main, 'gemini_service', make_gemini(model))
+
+    return use_model
+
+
+def poll_job(client, job_id, interval=0.01, send=lambda request: request()):
+    after, updates = 0, []
+    while True:
+        job = send(lambda: client.get(f"/api/gemini/analyze/jobs/{job_id}?after={after}")).get_json()
+        updates.extend(job['events'])
+        after = job['next']
+        if job['status'] != 'running':
+            return job, updates
+        time.sleep(interval)
+
+
+def test_job_returns_before_gemini_answers_and_polls_to_the_result(stub_app, use_runner):
+    use_runner(4)
+    stub_app(AsyncStubModel(latency=0.3))
+    client = logged_in_client()
+
+    started = time.perf_counter()
+    response = client.post('/api/gemini/analyze/jobs', json={
+        'filename': 'Spectra Manual.pdf', 'fileType': 'application/pdf', 'fileSize': 1000
+    })
+    returned_after = time.perf_counter() - started
+    job, updates = poll_job(client, response.get_json()['job_id'])
+
+    assert response.status_code == 202
+    assert returned_after < 0.1
+    assert job['status'] == 'done'
+    assert job['result']['summary'] == 'Analyzed Spectra Manual.pdf'
+    assert [update['progress'] for update in updates] == [15, 100]
+
+
+def test_jobs_are_private_to_their_owner(stub_app, use_runner):
+    use_runner(4)
+    stub_app(AsyncStubModel(latency=0))
+    job_id = logged_in_client().post('/api/gemini/analyze/jobs', json={'filename': 'a.pdf'}).get_json()['job_id']
+
+    assert logged_in_client('someone@else.com').get(f"/api/gemini/analyze/jobs/{job_id}").status_code == 404
+    assert main.app.test_client().get(f"/api/gemini/analyze/jobs/{job_id}").status_code == 401
+
+
+def test_load_throughput_scales_with_semaphore_not_threads(stub_app, use_runner):
+    """24 analyses against a model taking 10 s per call, time-scaled 1:20, behind 8 server threads"""
+    latency, server_threads, analyses = 0.5, 8, 24
+    model = AsyncStubModel(latency=latency)
+    stub_app(model)
+    server = ThreadPoolExecutor(max_workers=server_threads)  # gunicorn --threads 8
+    send = lambda request: server.submit(request).result()
+
+    def run(label, max_concurrency, analyze):
+        use_runner(max_concurrency)
+        health = []
+        stop = threading.Event()
+
+        def probe_health():
+            client = main.app.test_client()
+            while not stop.is_set():
+                sent = time.perf_counter()
+                send(lambda: client.get('/health'))
+                health.append(time.perf_counter() - sent)
+                time.sleep(0.05)
+
+        prober = threading.Thread(target=probe_health)
+        prober.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=analyses) as users:
+            results = list(users.map(lambda number: analyze(f"{label} {number}.pdf"), range(analyses)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        prober.join()
+        assert all(result['summary'].startswith('Analyzed') for result in results)
+        print(f"{label:>26}: {elapsed:.2f}s for {analyses} analyses "
+              f"({analyses / elapsed * latency:.1f} per model latency), worst /health {max(health) * 1000:.0f} ms")
+        return elapsed, max(health)
+
+    def blocking(filename):
+        client = logged_in_client()
+        return send(lambda: client.post('/api/gemini/analyze', json={'filename': filename})).get_json()
+
+    def polled(filename):
+        client = logged_in_client()
+        job_id = send(lambda: client.post('/api/gemini/analyze/jobs', json={'filename': filename})).get_json()['job_id']
+        return poll_job(client, job_id, interval=0.02, send=send)[0]['result']
+
+    try:
+        blocking_time, blocking_health = run('blocking, semaphore 24', 24, blocking)
+        polled_small_time, _ = run('jobs, semaphore 8', 8, polled)
+        polled_time, polled_health = run('jobs, semaphore 24', 24, polled)
+    finally:
+        server.shutdown()
+
+    # Blocking requests are bound by the 8 threads; polled jobs by the semaphore
+    assert blocking_time > 2.5 * latency
+    assert polled_small_time > 2.5 * latency
+    assert polled_time < 2 * latency
+    assert polled_health < blocking_health
+    assert model.peak == analyses
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Tests and benchmark for the rules → flash → pro model cascade, using stub models over a labelled filename corpus
+"""
+
+import re
+import json
+import time
+import statistics
+
+import pytest
+
+import main
+import services_enhanced
+from services_enhanced import GeminiService, GeminiAsyncRunner, FolderPathIndex, analysis_result_cache
+from test_gemini_fused import StubResponse, StubModel, make_gemini, make_orchestrator
+
+# Flash answers in ~1.5 s and pro in ~7.5 s, time-scaled 1:50
+FLASH_LATENCY = 0.03
+PRO_LATENCY = 0.15
+
+HUB_FOLDERS = {
+    '01_Brand Assets': ['Company Profiles', 'Logos'],
+    '02_Product Lines & Sub-Brands': ['Spectra', 'Bharat Series', 'Software Platform'],
+    '03_Marketing Campaigns': ['Product Brochures', 'Case Studies'],
+    '04_Sales Enablement': ['Presentations', 'Proposals'],
+    '05_Technical Documentation': ['User Manuals', 'Datasheets'],
+    'General': ['Uploads'],
+}
+
+# (filename, correct folder below the hub, difficulty): 'easy' names spell out what they are,
+# 'medium' ones need a model, 'hard' ones leave the flash model unsure
+CORPUS = [
+    ('Spectra Mining Technical Manual.pdf', '05_Technical Documentation', 'easy'),
+    ('Bharat Series Agriculture Brochure.pdf', '03_Marketing Campaigns → Product Brochures', 'easy'),
+    ('Spectra Company Profile.pdf', '01_Brand Assets → Company Profiles', 'easy'),
+    ('DMO Solar Sales Deck.pptx', '04_Sales Enablement → Presentations', 'easy'),
+    ('Spectra Datasheet Infrastructure.pdf', '05_Technical Documentation', 'easy'),
+    ('Bharat Mining Flyer.pdf', '03_Marketing Campaigns → Product Brochures', 'easy'),
+    ('Spectra Security Pitch.pptx', '04_Sales Enablement → Presentations', 'easy'),
+    ('DMO Software Platform User Guide.pdf', '05_Technical Documentation', 'easy'),
+    ('Q3 Campaign Results Mining Customers.pdf', '03_Marketing Campaigns → Case Studies', 'medium'),
+    ('Drone Survey Accuracy Report.pdf', '03_Marketing Campaigns → Case Studies', 'medium'),
+    ('Partner Onboarding Kit.zip', '04_Sales Enablement → Proposals', 'medium'),
+    ('Highway Inspection Case Study.pdf', '03_Marketing Campaigns → Case Studies', 'medium'),
+    ('Spectra Launch Event Photos.zip', '02_Product Lines & Sub-Brands → Spectra', 'medium'),
+    ('Logo Pack Final.zip', '01_Brand Assets → Logos', 'medium'),
+    ('Bharat Series Price List.xlsx', '04_Sales Enablement → Proposals', 'medium'),
+    ('Solar Farm ROI Calculator.xlsx', '04_Sales Enablement → Proposals', 'medium'),
+    ('IMG_4521_final_v3.jpg', 'General → Uploads', 'hard'),
+    ('Untitled document (7).docx', 'General → Uploads', 'hard'),
+    ('SKY-MKT-2023-Q4-draft.pdf', '03_Marketing Campaigns → Case Studies', 'hard'),
+    ('Board Review Notes.docx', 'General → Uploads', 'hard'),
+]
+LABELS = {filename: f"Marketing Hub → {folder}" for filename, folder, _ in CORPUS}
+
+
+@pytest.fixture(autouse=True)
+def unthrottled_runner(monkeypatch):
+    # An unthrottled runner, so the benchmark measures the models and not the quota
+    runner = GeminiAsyncRunner(max_concurrency=4, requests_per_minute=0)
+    monkeypatch.setattr(services_enhanced, 'gemini_runner', runner)
+    yield
+    runner.stop()
+
+
+def hub_path_index(folders=HUB_FOLDERS):
+    """FolderPathIndex over the two-level hub above"""
+    rows = []
+    for top_number, (top_name, children) in enumerate(folders.items()):
+        top_id = f"top-{top_number}"
+        rows.append({'id': top_id, 'name': top_name, 'parent_id': 'hub-root', 'depth': 1})
+        rows.extend(
+            {'id': f"{top_id}-{number}", 'name': name, 'parent_id': top_id, 'depth': 2}
+            for number, name in enumerate(children)
+        )
+    return FolderPathIndex('hub-root', rows)
+
+
+class CorpusModel:
+    """Answers fused prompts from a table of filename -> (folder, confidence) after a fixed latency"""
+
+    def __init__(self, latency, answers):
+        self.latency = latency
+        self.answers = answers
+        self.calls = 0
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        filename = re.search(r"- Filename: (.+)", prompt).group(1).strip()
+        folder, confidence = self.answers[filename]
+        return StubResponse(json.dumps({
+            'document_type': 'Document',
+            'content_category': 'GENERAL',
+            'confidence_score': confidence,
+            'recommended_folder': folder,
+            'reasoning': f"Stub answer for {filename}",
+            'confidence': confidence
+        }))
+
+
+def flash_model():
+    """Right and sure on easy and medium names; an unsure wrong guess on hard ones"""
+    guess = ('Marketing Hub → 03_Marketing Campaigns → Product Brochures', 60)
+    return CorpusModel(FLASH_LATENCY, {
+        filename: guess if difficulty == 'hard' else (LABELS[filename], 88)
+        for filename, _, difficulty in CORPUS
+    })
+
+
+def pro_model():
+    return CorpusModel(PRO_LATENCY, {filename: (folder, 95) for filename, folder in LABELS.items()})
+
+
+def cascade_service(flash=None, pro=None):
+    pro = pro or pro_model()
+    gemini_service = make_gemini(pro)
+    gemini_service.model_tiers = [
+        (GeminiService.RULES_TIER, None),
+        ('gemini-2.5-flash', flash or flash_model()),
+        (GeminiService.PRO_MODEL, pro),
+    ]
+    return gemini_service
+
+
+def analyze(gemini_service, filename, path_index):
+    return gemini_service.analyze_and_recommend(
+        filename, 'application/octet-stream', 1000, 'rules', 'structure', path_index=path_index
+    )
+
+
+def test_explicit_filename_is_answered_by_rules_without_a_model_call():
+    flash, pro = flash_model(), pro_model()
+    gemini_service = cascade_service(flash, pro)
+
+    content_analysis, folder_recommendation = analyze(gemini_service, 'Spectra Mining Technical Manual.pdf',
+                                                      hub_path_index())
+    standalone = gemini_service.analyze_file_content('Bharat Mining Flyer.pdf', 'application/pdf', 1000, 'rules')
+
+    assert flash.calls == pro.calls == 0
+    assert (content_analysis['content_category'], content_analysis['product_line']) == ('TECH', 'SP')
+    assert folder_recommendation['recommended_folder'] == 'Marketing Hub → 05_Technical Documentation'
+    assert content_analysis['model_tier'] == folder_recommendation['model_tier'] == 'rules'
+    assert standalone['content_category'] == 'MARK' and standalone['model_tier'] == 'rules'
+
+
+def test_rules_answers_are_not_cached_but_model_answers_are():
+    pro = pro_model()
+    cascade = cascade_service(pro=pro)
+    pro_only = make_gemini(pro)
+
+    analyze(cascade, 'Spectra Mining Technical Manual.pdf', hub_path_index())
+    analyze(cascade, 'Logo Pack Final.zip', hub_path_index())
+    _, from_pro = analyze(pro_only, 'Spectra Mining Technical Manual.pdf', hub_path_index())
+    _, from_cache = analyze(pro_only, 'Logo Pack Final.zip', hub_path_index())
+
+    # The pro-only service asks its model instead of reusing the rules answer
+    assert from_pro['model_tier'] == 'gemini-2.5-pro' and pro.calls == 1
+    assert from_cache['model_tier'] == 'gemini-2.5-flash'
+
+
+def test_low_confidence_escalates_to_the_next_tier():
+    flash, pro = flash_model(), pro_model()
+    gemini_service = cascade_service(flash, pro)
+
+    _, medium = analyze(gemini_service, 'Logo Pack Final.zip', hub_path_index())
+    _, hard = analyze(gemini_service, 'IMG_4521_final_v3.jpg', hub_path_index())
+
+    assert medium['model_tier'] == 'gemini-2.5-flash'
+    assert medium['recommended_folder'] == 'Marketing Hub → 01_Brand Assets → Logos'
+    assert hard['model_tier'] == 'gemini-2.5-pro'
+    assert hard['recommended_folder'] == 'Marketing Hub → General → Uploads'
+    assert (flash.calls, pro.calls) == (2, 1)
+    assert GeminiService.tier_stats()['escalations'] == 3
+
+
+def test_folder_missing_from_the_hub_escalates():
+    # The rules folder is not in this hub, and flash confidently names one that is not either
+    without_tech_docs = {name: children for name, children in HUB_FOLDERS.items() if not name.startswith('05')}
+    flash = flash_model()
+    flash.answers['Spectra Mining Technical Manual.pdf'] = ('Marketing Hub → Manuals', 92)
+    pro = pro_model()
+    pro.answers['Spectra Mining Technical Manual.pdf'] = ('Marketing Hub → General → Uploads', 95)
+
+    _, folder_recommendation = analyze(cascade_service(flash, pro), 'Spectra Mining Technical Manual.pdf',
+                                       hub_path_index(without_tech_docs))
+
+    assert folder_recommendation['model_tier'] == 'gemini-2.5-pro'
+    assert folder_recommendation['recommended_folder'] == 'Marketing Hub → General → Uploads'
+    assert (flash.calls, pro.calls) == (1, 1)
+
+
+def test_failing_tier_escalates_and_last_tier_failure_falls_back():
+    class BrokenModel:
+        calls = 0
+
+        def generate_content(self, prompt, **kwargs):
+            BrokenModel.calls += 1
+            raise RuntimeError("model unavailable")
+
+    _, escalated = analyze(cascade_service(flash=BrokenModel()), 'Logo Pack Final.zip', hub_path_index())
+    _, fallback = analyze(cascade_service(flash=BrokenModel(), pro=BrokenModel()), 'Board Review Notes.docx', None)
+
+    assert escalated['model_tier'] == 'gemini-2.5-pro'
+    assert BrokenModel.calls == 3
+    assert 'model_tier' not in fallback
+    assert fallback['reasoning'] == 'Fallback recommendation based on content patterns'
+
+
+def test_single_tier_service_and_tier_configuration():
+    model = StubModel(base_latency=0)
+    content_analysis, _ = make_gemini(model).analyze_and_recommend(
+        'Spectra Mining Technical Manual.pdf', 'application/pdf', 1000, 'rules', 'structure'
+    )
+    gemini_service = make_gemini(model)
+    tiers = gemini_service._build_model_tiers(' rules, gemini-2.5-pro ,')
+
+    assert model.calls == 1
+    assert content_analysis['model_tier'] == 'gemini-2.5-pro'
+    assert tiers == [('rules', None), ('gemini-2.5-pro', model)]
+
+
+def test_workflow_and_status_report_the_answering_tier():
+    orchestrator = make_orchestrator(StubModel(base_latency=0))
+    orchestrator.gemini_service.model_tiers = [('rules', None), ('gemini-2.5-pro', orchestrator.gemini_service.model)]
+
+    result = orchestrator.execute_intelligent_workflow(
+        'Spectra Mining Technical Manual.pdf', 'application/pdf', 3200000, 'hub-root', mode='fused'
+    )
+    status = main.app.test_client().get('/api/status').get_json()
+
+    assert result['model_tiers'] == {'content_analysis': 'rules', 'folder_recommendation': 'rules'}
+    assert status['gemini_tiers']['answered_by'] == {'rules': 1}
+
+
+def test_benchmark_cascade_vs_pro_only_latency_and_call_mix():
+    """Median latency, call mix and accuracy over the labelled corpus, pro only vs the cascade"""
+    path_index = hub_path_index()
+    results = {}
+    for label in ('pro only', 'cascade'):
+        analysis_result_cache.clear()
+        GeminiService.clear_tier_stats()
+        flash, pro = flash_model(), pro_model()
+        gemini_service = make_gemini(pro) if label == 'pro only' else cascade_service(flash, pro)
+        latencies, correct = [], 0
+        for filename, _, _ in CORPUS:
+            started = time.perf_counter()
+            _, folder_recommendation = analyze(gemini_service, filename, path_index)
+            latencies.append(time.perf_counter() - started)
+            correct += folder_recommendation['recommended_folder'] == LABELS[filename]
+        results[label] = {
+            'median': statistics.median(latencies),
+            'accuracy': correct / len(CORPUS),
+            'calls': {'gemini-2.5-flash': flash.calls, 'gemini-2.5-pro': pro.calls},
+            'answered_by': GeminiService.tier_stats()['answered_by'],
+        }
+        print(f"{label:>9}: median {results[label]['median'] * 1000:.0f} ms, "
+              f"accuracy {results[label]['accuracy']:.0%}, model calls {results[label]['calls']}, "
+              f"answered by {results[label]['answered_by']}")
+
+    pro_only, cascade = results['pro only'], results['cascade']
+    assert cascade['accuracy'] == pro_only['accuracy'] == 1.0
+    assert cascade['answered_by'] == {'rules': 8, 'gemini-2.5-flash': 8, 'gemini-2.5-pro': 4}
+    assert cascade['calls'] == {'gemini-2.5-flash': 12, 'gemini-2.5-pro': 4}
+    assert pro_only['calls']['gemini-2.5-pro'] == len(CORPUS)
+    assert cascade['median'] < pro_only['median'] * 0.5
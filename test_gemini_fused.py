@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Tests and benchmark for the fused single-call Gemini analysis mode, using a local stub model
+"""
+
+import json
+import time
+
+from services_enhanced import GeminiService, DriveService, NamingConventionService, IntelligentWorkflowOrchestrator
+
+ANALYSIS_TEXT = """DOCUMENT_TYPE: Technical Manual
+CONTENT_CATEGORY: TECH
+PRODUCT_LINE: SP
+INDUSTRY: Mining
+TARGET_AUDIENCE: Engineers
+BUSINESS_IMPACT: High
+TECHNICAL_COMPLEXITY: Advanced
+CONTENT_DESCRIPTION: Operating manual for the Spectra mining drone
+CONFIDENCE_SCORE: 92"""
+
+RECOMMENDATION_TEXT = """RECOMMENDED_FOLDER: Marketing Hub → 05_Technical Documentation → User Manuals
+REASONING: Technical manual for engineers
+CONFIDENCE: 90
+ALTERNATIVE: Marketing Hub → 02_Product Lines & Sub-Brands → Spectra"""
+
+FUSED_JSON = json.dumps({
+    'document_type': 'Technical Manual',
+    'content_category': 'TECH',
+    'product_line': 'SP',
+    'industry': 'Mining',
+    'target_audience': 'Engineers',
+    'business_impact': 'High',
+    'technical_complexity': 'Advanced',
+    'content_description': 'Operating manual for the Spectra mining drone',
+    'confidence_score': 92,
+    'recommended_folder': 'Marketing Hub → 05_Technical Documentation → User Manuals',
+    'reasoning': 'Technical manual for engineers',
+    'confidence': 90,
+    'alternative': 'Marketing Hub → 02_Product Lines & Sub-Brands → Spectra'
+})
+
+
+def count_tokens(text):
+    """Stub tokenizer: roughly one token per four characters, like Gemini's estimate"""
+    return max(1, len(text) // 4)
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """Answers each prompt kind with a canned response after a fixed base latency plus per-token cost"""
+
+    def __init__(self, base_latency=0.05, per_token_latency=0.00001):
+        self.base_latency = base_latency
+        self.per_token_latency = per_token_latency
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.kwargs = []
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        self.kwargs.append(kwargs)
+        tokens = count_tokens(prompt)
+        self.prompt_tokens += tokens
+        time.sleep(self.base_latency + tokens * self.per_token_latency)
+        if 'JSON object' in prompt:
+            return StubResponse(f"```json\n{FUSED_JSON}\n```")
+        if 'RECOMMENDED_FOLDER' in prompt:
+            return StubResponse(RECOMMENDATION_TEXT)
+        return StubResponse(ANALYSIS_TEXT)
+
+
+def make_gemini(model):
+    gemini_service = GeminiService.__new__(GeminiService)
+    gemini_service.api_key = 'stub'
+    gemini_service.model = model
+    return gemini_service
+
+
+class StubNaming(NamingConventionService):
+    def get_naming_rules(self):
+        return "Format: PREFIX-CATEGORY_description_YYYYMMDD_vNN.ext\n" * 40
+
+    def apply_naming_convention(self, filename, analysis_data, rule_set=None):
+        return filename
+
+
+def make_orchestrator(model):
+    drive_service = DriveService(None)
+    return IntelligentWorkflowOrchestrator(make_gemini(model), drive_service, StubNaming())
+
+
+def test_fused_mode_makes_one_model_call():
+    model = StubModel(base_latency=0)
+    result = make_orchestrator(model).execute_intelligent_workflow(
+        'Spectra Mining Technical Manual.pdf', 'application/pdf', 3200000, 'hub-root', mode='fused'
+    )
+
+    assert model.calls == 1
+    assert result['workflow_mode'] == 'fused'
+    assert result['analysis_data']['content_category'] == 'TECH'
+    assert result['analysis_data']['confidence_score'] == '92'
+    assert result['folder_data']['recommended_folder'] == 'Marketing Hub → 05_Technical Documentation → User Manuals'
+    assert 'fused_analysis' in result['step_timings']
+
+
+def test_fused_and_standard_modes_agree():
+    standard = make_orchestrator(StubModel(base_latency=0)).execute_intelligent_workflow(
+        'Spectra Mining Technical Manual.pdf', 'application/pdf', 3200000, 'hub-root', mode='standard'
+    )
+    fused = make_orchestrator(StubModel(base_latency=0)).execute_intelligent_workflow(
+        'Spectra Mining Technical Manual.pdf', 'application/pdf', 3200000, 'hub-root', mode='fused'
+    )
+
+    assert fused['analysis_data'] == standard['analysis_data']
+    for key in ('recommended_folder', 'reasoning', 'confidence', 'alternative'):
+        assert fused['folder_data'][key] == standard['folder_data'][key]
+
+
+def test_unparseable_fused_response_falls_back():
+    model = StubModel(base_latency=0)
+    model.generate_content = lambda prompt, **kwargs: StubResponse("Sorry, I can't help with that")
+
+    analysis, recommendation = make_gemini(model).analyze_and_recommend(
+        'Company Profile.pdf', 'application/pdf', 1000, 'rules', 'structure'
+    )
+
+    assert analysis['content_category'] == 'BRAND'
+    assert recommendation['recommended_folder'] == "Marketing Hub → 01_Brand Assets → Company Profiles"
+
+
+def test_benchmark_fused_vs_two_call_latency_and_tokens():
+    """Latency and prompt tokens per file for both modes against a stub model with 0.5 s per call"""
+    results = {}
+    for mode in ('standard', 'fused'):
+        model = StubModel(base_latency=0.5)
+        started = time.perf_counter()
+        make_orchestrator(model).execute_intelligent_workflow(
+            'Spectra Mining Technical Manual.pdf', 'application/pdf', 3200000, 'hub-root', mode=mode
+        )
+        results[mode] = (time.perf_counter() - started, model.calls, model.prompt_tokens)
+        print(f"{mode}: {results[mode][0] * 1000:.0f} ms, {model.calls} calls, {model.prompt_tokens} prompt tokens")
+
+    assert results['fused'][1] == 1 and results['standard'][1] == 2
+    assert results['fused'][0] < results['standard'][0] * 0.75
+    assert results['fused'][2] < results['standard'][2]
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Tests for the Gemini rate limiter, retry on retriable errors and circuit breaker, using a fault-injecting model
+"""
+
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import main
+import services_enhanced
+from services_enhanced import GeminiAsyncRunner, CircuitBreaker, CircuitOpenError, TokenBucket
+from test_gemini_fused import FUSED_JSON, StubResponse, make_gemini
+
+
+@pytest.fixture
+def use_runner(monkeypatch):
+    """Swap in a runner with fast backoff for the shared one; stopped after the test"""
+    runners = []
+
+    def use(breaker=None, requests_per_minute=0, burst=1):
+        runner = GeminiAsyncRunner(max_concurrency=4, requests_per_minute=requests_per_minute, burst=burst,
+                                   breaker=breaker or CircuitBreaker('Gemini', failure_threshold=3, reset_timeout=0.2))
+        runner.RETRY_BACKOFF_BASE = 0.01
+        runners.append(runner)
+        monkeypatch.setattr(services_enhanced, 'gemini_runner', runner)
+        monkeypatch.setattr(main, 'gemini_runner', runner)
+        return runner
+
+    yield use
+    for runner in runners:
+        runner.stop()
+
+
+class FaultyModel:
+    """Raises the queued faults in order, then answers normally"""
+
+    def __init__(self, *faults):
+        self.faults = list(faults)
+        self.calls = 0
+
+    def fail_with(self, *faults):
+        self.faults = list(faults)
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        if self.faults:
+            fault = self.faults.pop(0) if len(self.faults) > 1 else self.faults[0]
+            if fault is not None:
+                raise fault
+        return StubResponse(FUSED_JSON)
+
+
+def unavailable():
+    return google_exceptions.ServiceUnavailable("backend unavailable")
+
+
+def test_token_bucket_spaces_calls_after_the_burst():
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    waits = [bucket.reserve() for _ in range(5)]
+
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2:] == pytest.approx([0.1, 0.2, 0.3], abs=0.02)
+    assert bucket.stats()['throttled'] == 3
+    assert TokenBucket(rate=0, capacity=1).reserve() == 0.0
+
+
+def test_runner_holds_calls_to_the_quota(use_runner):
+    runner = use_runner(requests_per_minute=600, burst=2)
+    model = FaultyModel()
+
+    started = time.perf_counter()
+    runner.generate_many(model, [f"prompt {number}" for number in range(6)])
+    elapsed = time.perf_counter() - started
+
+    assert model.calls == 6
+    assert 0.35 <= elapsed < 1.0
+    assert runner.stats()['rate_limiter']['throttled'] == 4
+
+
+def test_rate_limited_call_is_retried_with_backoff(use_runner):
+    runner = use_runner()
+    model = FaultyModel(google_exceptions.ResourceExhausted("quota"), google_exceptions.ResourceExhausted("quota"),
+                        None)
+
+    response = runner.generate(model, 'prompt')
+
+    assert response.text == FUSED_JSON
+    assert model.calls == 3
+    assert runner.stats()['retries'] == 2
+    assert runner.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_non_retriable_errors_fail_on_the_first_attempt(use_runner):
+    runner = use_runner()
+    model = FaultyModel(google_exceptions.InvalidArgument("bad prompt"))
+
+    with pytest.raises(google_exceptions.InvalidArgument):
+        runner.generate(model, 'prompt')
+
+    assert model.calls == 1
+    assert runner.breaker.stats()['failures'] == 0
+
+
+def test_open_circuit_falls_back_without_calling_gemini(use_runner):
+    runner = use_runner()
+    model = FaultyModel(unavailable())
+    gemini_service = make_gemini(model)
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        runner.generate(model, 'prompt')
+    assert model.calls == 3  # retried until the third failure opened the circuit
+    assert runner.breaker.state == CircuitBreaker.OPEN
+
+    started = time.perf_counter()
+    content_analysis = gemini_service.analyze_file_content('Spectra Manual.pdf', 'application/pdf', 1000, 'rules')
+    elapsed = time.perf_counter() - started
+
+    assert model.calls == 3
+    assert elapsed < 0.05
+    assert content_analysis == gemini_service._fallback_content_analysis('Spectra Manual.pdf', 'application/pdf', 1000)
+    with pytest.raises(CircuitOpenError):
+        runner.generate(model, 'prompt')
+    assert runner.stats()['rejected'] == 2
+
+
+def test_half_open_trial_closes_or_reopens_the_circuit(use_runner):
+    runner = use_runner()
+    model = FaultyModel(unavailable())
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        runner.generate(model, 'prompt')
+
+    # Still failing: the single trial call re-opens the circuit at once
+    time.sleep(0.25)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        runner.generate(model, 'prompt')
+    assert model.calls == 4
+    assert runner.breaker.state == CircuitBreaker.OPEN
+
+    # Recovered: the next trial closes it and traffic flows again
+    model.fail_with()
+    time.sleep(0.25)
+    assert runner.generate(model, 'trial').text == FUSED_JSON
+    assert runner.generate(model, 'normal').text == FUSED_JSON
+
+    stats = runner.breaker.stats()
+    assert stats['state'] == CircuitBreaker.CLOSED
+    assert stats['trips'] == 2
+    assert stats['trial_calls'] == 2
+
+
+def test_breaker_state_is_reported_on_status(use_runner):
+    runner = use_runner()
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        runner.generate(FaultyModel(unavailable()), 'prompt')
+
+    status = main.app.test_client().get('/api/status').get_json()
+
+    assert status['gemini_circuit_breaker']['state'] == CircuitBreaker.OPEN
+    assert status['gemini_circuit_breaker']['trips'] == 1
+    assert status['gemini_calls']['retries'] == 2
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared keep-alive transport used for OAuth, upload sessions and Drive clients
+"""
+
+import time
+import threading
+
+import pytest
+from googleapiclient.discovery import build
+from google.oauth2.credentials import Credentials
+
+from fake_google import FakeResumableUploadServer
+from services_enhanced import Deadline, GoogleHttpTransport
+
+
+def drive_client(transport, server):
+    return build('drive', 'v3', http=transport.authorized_http(Credentials(token='ya29.test')),
+                 static_discovery=True, client_options={'api_endpoint': server.url + '/'})
+
+
+def test_session_requests_reuse_one_connection():
+    transport = GoogleHttpTransport(pool_size=4)
+    with FakeResumableUploadServer() as server:
+        for _ in range(10):
+            transport.session.get(f"{server.url}/drive/v3/about").raise_for_status()
+
+    stats = transport.stats()['http']
+    assert stats['requests'] == 10
+    assert stats['connections_opened'] == 1
+    assert stats['reuse_ratio'] == 0.9
+
+
+def test_drive_clients_share_the_thread_connection_across_users_and_requests():
+    transport = GoogleHttpTransport()
+    with FakeResumableUploadServer() as server:
+        for _ in range(5):
+            drive_client(transport, server).about().get(fields='user').execute()
+        build('drive', 'v3', http=transport.authorized_http(Credentials(token='ya29.other-user')),
+              static_discovery=True, client_options={'api_endpoint': server.url + '/'}
+              ).about().get(fields='user').execute()
+
+    assert server.get_requests == 6
+    assert transport.stats()['drive'] == {
+        'requests': 6, 'connections_opened': 1, 'reused_requests': 5, 'reuse_ratio': 0.833
+    }
+
+
+def test_each_thread_gets_its_own_persistent_http():
+    transport = GoogleHttpTransport()
+    seen = []
+    workers = [threading.Thread(target=lambda: seen.append(transport.thread_http())) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len({id(http) for http in seen}) == 3
+    assert transport.thread_http() is transport.thread_http()
+
+
+def test_resumable_308_is_not_followed_as_redirect():
+    transport = GoogleHttpTransport()
+    assert 308 not in transport.thread_http().redirect_codes
+
+
+def test_drive_requests_time_out_at_the_workflow_step_deadline():
+    transport = GoogleHttpTransport()
+    with FakeResumableUploadServer() as server:
+        client = drive_client(transport, server)
+        client.about().get(fields='user').execute()  # open the keep-alive connection first
+
+        server.response_delay = 1.0
+        started = time.perf_counter()
+        with Deadline.bind(time.monotonic() + 0.3):
+            with pytest.raises(TimeoutError):
+                client.about().get(fields='user').execute()
+        elapsed = time.perf_counter() - started
+
+        with Deadline.bind(time.monotonic()):
+            with pytest.raises(TimeoutError):
+                client.about().get(fields='user').execute()
+        requests_sent = server.get_requests
+
+        # Outside a budgeted step the connection waits as long as Drive takes again
+        server.response_delay = 0
+        client.about().get(fields='user').execute()
+
+    assert 0.25 <= elapsed < 0.8
+    assert requests_sent == 2  # an expired deadline sends nothing
+    assert transport.thread_http().timeout is None
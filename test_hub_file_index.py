@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Tests and lookup benchmark for the md5-indexed Marketing Hub file index
+"""
+
+import time
+import hashlib
+
+import main
+from fake_google import FakeDrive, build_marketing_hub, make_drive_service
+from services_enhanced import (
+    DriveChangeEvent, DriveChangeFeed, HubFileIndex, IntelligentWorkflowOrchestrator, hub_file_index
+)
+
+
+def md5_of(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def make_index():
+    """Index subscribed to its own manually polled feed"""
+    feed = DriveChangeFeed(poll_interval=0)
+    index = HubFileIndex(change_feed=feed)
+    feed.subscribe(index.on_drive_change, DriveChangeEvent.FILE_KINDS + DriveChangeEvent.FOLDER_KINDS)
+    return index, feed
+
+
+def make_hub(**hub_options):
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, **hub_options)
+    folder_id = next(item['id'] for item in fake.items.values() if item['parents'] == [root_id])
+    return fake, root_id, folder_id
+
+
+def test_renamed_copy_is_found_by_md5():
+    fake, root_id, folder_id = make_hub(top_level=2, per_folder=1, depth=1)
+    fake.add_file('Spectra Brochure.pdf', folder_id, size='10000', md5Checksum=md5_of('spectra'))
+    index, _ = make_index()
+
+    index.build(root_id, make_drive_service(fake))
+
+    duplicate = index.lookup('brochure-final (2).pdf', 10000, md5_of('spectra').upper())
+    assert duplicate['name'] == 'Spectra Brochure.pdf'
+    assert duplicate['match'] == 'md5'
+    assert index.lookup('Spectra Brochure.pdf', 10200)['match'] == 'name_size'
+    assert index.lookup('Spectra Brochure.pdf', 50000) is None
+
+
+def test_duplicate_result_reports_what_matched():
+    fake, root_id, folder_id = make_hub(top_level=2, per_folder=1, depth=1)
+    fake.add_file('Spectra Brochure.pdf', folder_id, size='10000', md5Checksum=md5_of('spectra'))
+    index, _ = make_index()
+    index.build(root_id, make_drive_service(fake))
+    orchestrator = IntelligentWorkflowOrchestrator(None, None, None)
+
+    by_content = orchestrator._create_duplicate_result(
+        'brochure-final (2).pdf', index.lookup('brochure-final (2).pdf', 10000, md5_of('spectra'))
+    )
+    by_name = orchestrator._create_duplicate_result(
+        'Spectra Brochure.pdf', index.lookup('Spectra Brochure.pdf', 10200)
+    )
+
+    assert 'identical content' in by_content['summary'] and 'same name' not in by_content['summary']
+    assert 'Identical content (MD5)' in by_content['details']
+    assert 'same name and similar size' in by_name['summary']
+
+
+def test_changes_feed_keeps_index_current():
+    fake, root_id, folder_id = make_hub(top_level=2, per_folder=1, depth=1)
+    kept = fake.add_file('Kept.pdf', folder_id, size='100', md5Checksum=md5_of('kept'))
+    trashed = fake.add_file('Trashed.pdf', folder_id, size='100', md5Checksum=md5_of('trashed'))
+    deleted = fake.add_file('Deleted.pdf', folder_id, size='100', md5Checksum=md5_of('deleted'))
+    moved = fake.add_file('Moved.pdf', folder_id, size='100', md5Checksum=md5_of('moved'))
+    index, feed = make_index()
+    index.build(root_id, make_drive_service(fake))
+
+    fake.add_file('New.pdf', folder_id, size='100', md5Checksum=md5_of('new'))
+    fake.add_file('Elsewhere.pdf', 'someone-elses-folder', size='100', md5Checksum=md5_of('elsewhere'))
+    fake.update(kept, name='Kept v2.pdf')
+    fake.update(trashed, trashed=True)
+    fake.delete(deleted)
+    fake.update(moved, parents=['someone-elses-folder'])
+    fake.reset_calls()
+    feed.poll()
+
+    assert fake.calls['files.list'] == 0
+    assert fake.calls['changes.list'] == 1
+    assert index.lookup('x.pdf', 100, md5_of('new'))['name'] == 'New.pdf'
+    assert index.lookup('x.pdf', 100, md5_of('kept'))['name'] == 'Kept v2.pdf'
+    assert index.lookup('Kept.pdf', 100) is None
+    for name in ('trashed', 'deleted', 'moved', 'elsewhere'):
+        assert index.lookup('x.pdf', 100, md5_of(name)) is None
+
+
+def test_files_in_folders_created_after_build_are_indexed():
+    fake, root_id, folder_id = make_hub(top_level=2, per_folder=1, depth=1)
+    index, feed = make_index()
+    index.build(root_id, make_drive_service(fake))
+
+    campaign_id = fake.add_folder('Fresh Campaign', folder_id)
+    fake.add_file('Launch Deck.pdf', campaign_id, size='4096', md5Checksum=md5_of('launch'))
+    fake.max_page_size = 1  # walk the feed a page at a time
+    feed.poll()
+
+    assert index.lookup('Launch Deck.pdf', 4096, md5_of('launch'))['match'] == 'md5'
+
+
+def test_trashing_a_folder_drops_the_files_below_it():
+    fake, root_id, folder_id = make_hub(top_level=2, per_folder=1, depth=2)
+    subfolder_id = next(item['id'] for item in fake.items.values() if item['parents'] == [folder_id])
+    fake.add_file('Deep.pdf', subfolder_id, size='100', md5Checksum=md5_of('deep'))
+    index, feed = make_index()
+    index.build(root_id, make_drive_service(fake))
+
+    fake.update(folder_id, trashed=True)
+    feed.poll()
+
+    assert index.lookup('Deep.pdf', 100, md5_of('deep')) is None
+
+
+def test_changes_during_build_are_replayed_on_top_of_the_listing():
+    fake, root_id, folder_id = make_hub(top_level=2, per_folder=1, depth=1)
+    listed = fake.add_file('Listed.pdf', folder_id, size='100', md5Checksum=md5_of('listed'))
+    drive_service = make_drive_service(fake)
+    index, feed = make_index()
+    original_iter = drive_service.iter_files_in
+
+    def iter_files_in(folder_ids, fields):
+        files = list(original_iter(folder_ids, fields))
+        fake.update(listed, trashed=True)  # lands on the feed while the build is still listing
+        feed.poll()
+        return iter(files)
+
+    drive_service.iter_files_in = iter_files_in
+    index.build(root_id, drive_service)
+
+    assert index.lookup('x.pdf', 100, md5_of('listed')) is None
+
+
+def test_find_duplicates_queries_drive_until_index_is_ready():
+    fake, root_id, folder_id = make_hub(top_level=2, per_folder=1, depth=1)
+    fake.add_file('Renamed.pdf', folder_id, size='10000', md5Checksum=md5_of('brochure'))
+    drive_service = make_drive_service(fake)
+    files = [{'filename': 'Brochure.pdf', 'file_size': 10000, 'md5': md5_of('brochure')}]
+
+    assert drive_service.find_duplicates(files, root_id) == {}  # name query while the build runs
+    deadline = time.time() + 5
+    while not hub_file_index.is_ready(root_id) and time.time() < deadline:
+        time.sleep(0.01)
+
+    fake.reset_calls()
+    duplicates = drive_service.find_duplicates(files, root_id)
+
+    assert duplicates[0]['name'] == 'Renamed.pdf'
+    assert fake.calls['files.list'] == 0
+    assert hub_file_index.stats()['md5_matches'] == 1
+
+
+def test_parse_md5_accepts_only_hex_digests():
+    assert main.parse_md5('D41D8CD98F00B204E9800998ECF8427E') == 'd41d8cd98f00b204e9800998ecf8427e'
+    assert main.parse_md5('not-a-hash') is None
+    assert main.parse_md5(None) is None
+
+
+def test_benchmark_lookup_latency_at_100k_files():
+    fake, root_id, folder_id = make_hub(top_level=2, per_folder=1, depth=1)
+    index, _ = make_index()
+    index.build(root_id, make_drive_service(fake))
+    file_count = 100_000
+    for number in range(file_count):
+        index.on_drive_change(DriveChangeEvent(DriveChangeEvent.FILE_ADDED, f"file{number}", root_id, {
+            'id': f"file{number}", 'name': f"Asset {number}.pdf", 'size': str(1000 + number),
+            'md5Checksum': f"{number:032x}", 'parents': [folder_id]
+        }))
+    assert index.stats()['files'] == file_count
+
+    probes = 20_000
+    started = time.perf_counter()
+    for number in range(probes):
+        index.lookup(f"Upload {number}.pdf", 1000 + number, f"{number * 5:032x}")
+        index.lookup(f"Asset {number * 5}.pdf", 1000 + number * 5)
+    per_lookup = (time.perf_counter() - started) / (probes * 2)
+
+    print(f"Hub index lookup at {file_count} files: {per_lookup * 1e6:.1f} µs")
+    assert per_lookup < 50e-6
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tests for the compiled naming convention rule set and the prompt tokens it saves
+"""
+
+from datetime import datetime
+
+from test_gemini_fused import StubModel, make_gemini, count_tokens
+from services_enhanced import (
+    DriveService, NamingConventionService, NamingRuleSet, IntelligentWorkflowOrchestrator, FALLBACK_NAMING_RULES
+)
+
+# Shaped like the exported Google Doc: prose, headings without colons, mixed bullet styles
+NAMING_DOCUMENT = """Skylark Drones – File Naming Convention (v3)
+
+Why this matters
+Consistent file names make it possible to find the latest approved version of any asset without opening it.
+Every file uploaded to the Marketing Hub must follow the format below. Files that do not follow the format
+will be renamed by the Marketing Ops team during the weekly audit, and links shared externally may break.
+""" + ("Please read the whole document before uploading. Ask in #marketing-ops if anything is unclear. " * 30) + """
+
+Format: PREFIX-CATEGORY_description_YYYYMMDD_vNN.ext
+
+Product line prefixes
+• SP – Spectra Series (Mining & Infrastructure)
+• BS – Bharat Series (Agriculture & General)
+• DMO – Software Platform (Data Management & Operations)
+• MA – Marketing Materials
+
+Content categories
+- TECH: Technical documentation
+- PRES: Presentations
+- BRAND: Brand materials
+- OPS: Operations playbooks
+
+Examples
+SP-TECH_spectra_user_manual_20240126_v01.pdf
+MA-BRAND_corporate_profile_20240126_v03.pdf
+
+Versioning
+Start at v01 and increment for every revision that is shared outside the team. Never overwrite a shared file.
+""" + ("Dates are the date the content was approved, not the upload date. " * 20)
+
+
+def test_parses_prefixes_categories_template_and_examples():
+    rule_set = NamingRuleSet.parse(NAMING_DOCUMENT)
+
+    assert list(rule_set.prefixes) == ['SP', 'BS', 'DMO', 'MA']
+    assert list(rule_set.categories) == ['TECH', 'PRES', 'BRAND', 'OPS']
+    assert rule_set.categories['OPS'] == 'Operations playbooks'
+    assert rule_set.template == 'PREFIX-CATEGORY_description_YYYYMMDD_vNN.ext'
+    assert rule_set.examples == ['SP-TECH_spectra_user_manual_20240126_v01.pdf',
+                                 'MA-BRAND_corporate_profile_20240126_v03.pdf']
+
+
+def test_missing_sections_come_from_fallback_rules():
+    rule_set = NamingRuleSet.parse("PREFIXES:\n- SP: Spectra Series")
+
+    assert list(rule_set.prefixes) == ['SP']
+    assert 'MIN' in rule_set.categories
+    assert rule_set.template == NamingRuleSet.DEFAULT_TEMPLATE
+
+
+def test_filenames_are_deterministic_and_use_document_codes():
+    rule_set = NamingRuleSet.parse(NAMING_DOCUMENT)
+    date = datetime(2024, 3, 5)
+
+    assert rule_set.build_filename('Spectra Brochure.PDF', {'product_line': 'SP', 'content_category': 'SALES'},
+                                   date=date) == 'SP-PRES_spectra_brochure_20240305_v01.pdf'
+    assert rule_set.build_filename('Mine Ops v2.1.docx', {'product_line': 'Spectra (SP)', 'content_category': 'OPS'},
+                                   date=date, version=3) == 'SP-OPS_mine_ops_v2_1_20240305_v03.docx'
+    assert rule_set.build_filename('notes', {'product_line': 'Bharat', 'content_category': 'Technical'},
+                                   date=date) == 'BS-TECH_notes_20240305_v01.pdf'
+    assert rule_set.build_filename('x.pdf', {}, date=date) == 'MA-GEN_x_20240305_v01.pdf'
+
+
+def test_document_template_drives_filename_layout():
+    rule_set = NamingRuleSet.parse("Format: CATEGORY_PREFIX_description_vNN.ext\n" + FALLBACK_NAMING_RULES)
+
+    assert rule_set.build_filename('Deck.pptx', {'product_line': 'BS', 'content_category': 'PRES'}) == \
+        'PRES_BS_deck_v01.pptx'
+
+
+def test_rule_set_is_compiled_once_per_version():
+    first = NamingRuleSet.compile(NAMING_DOCUMENT, '2024-01-01T00:00:01.000Z')
+
+    assert NamingRuleSet.compile(NAMING_DOCUMENT, '2024-01-01T00:00:01.000Z') is first
+    assert NamingRuleSet.compile(NAMING_DOCUMENT, '2024-01-01T00:00:02.000Z') is not first
+
+
+def test_code_table_cuts_prompt_tokens():
+    """Prompt tokens per call with the full naming document versus the compiled code table"""
+    gemini_service = make_gemini(StubModel())
+    code_table = NamingRuleSet.parse(NAMING_DOCUMENT).code_table()
+
+    document_prompt = gemini_service._create_fused_analysis_prompt(
+        'Spectra Brochure.pdf', 'application/pdf', 1000, NAMING_DOCUMENT, 'Marketing Hub → 01_Brand Assets')
+    table_prompt = gemini_service._create_fused_analysis_prompt(
+        'Spectra Brochure.pdf', 'application/pdf', 1000, code_table, 'Marketing Hub → 01_Brand Assets')
+
+    before, after = count_tokens(document_prompt), count_tokens(table_prompt)
+    print(f"Fused prompt tokens: document {before}, code table {after} ({1 - after / before:.0%} fewer)")
+    assert 'Never overwrite' not in table_prompt
+    assert 'OPS=Operations playbooks' in table_prompt
+    assert after < before * 0.5
+
+
+class DocumentNaming(NamingConventionService):
+    def get_naming_rules(self):
+        return NAMING_DOCUMENT
+
+
+def test_workflow_sends_code_table_and_names_file_from_rules():
+    model = StubModel(base_latency=0)
+    orchestrator = IntelligentWorkflowOrchestrator(make_gemini(model), DriveService(None), DocumentNaming())
+
+    result = orchestrator.execute_intelligent_workflow(
+        'Spectra Manual.pdf', 'application/pdf', 1000, 'hub-root', mode='fused'
+    )
+
+    assert model.prompt_tokens < count_tokens(NAMING_DOCUMENT)
+    assert 'SP-TECH_spectra_manual_' in result['destination']
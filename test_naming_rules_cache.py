@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Tests for the process-wide naming convention rules cache and its background poller
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+from fake_google import FakeDrive, make_drive_service
+from services_enhanced import NamingConventionService, NamingRulesCache, naming_rules_cache
+
+
+def make_naming_doc(fake, content='PREFIXES:\n- SP: Spectra Series'):
+    return fake.add_file('Naming Convention', None, mime_type='application/vnd.google-apps.document',
+                         file_id='naming-doc', content=content)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_warm_cache_serves_new_service_instances_without_drive_calls():
+    fake = FakeDrive()
+    make_naming_doc(fake)
+    NamingConventionService(make_drive_service(fake), 'naming-doc').get_naming_rules()
+
+    fake.reset_calls()
+    naming_service = NamingConventionService(make_drive_service(fake), 'naming-doc')
+    rules = naming_service.get_naming_rules()
+
+    assert rules == 'PREFIXES:\n- SP: Spectra Series'
+    assert naming_service.rules_version == fake.items['naming-doc']['modifiedTime']
+    assert sum(fake.calls.values()) == 0
+    assert naming_rules_cache.stats()['hits'] == 1
+
+
+def test_concurrent_cold_requests_export_document_once():
+    fake = FakeDrive(latency=0.05)
+    make_naming_doc(fake)
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(
+            lambda _: NamingConventionService(make_drive_service(fake), 'naming-doc').get_naming_rules(), range(6)
+        ))
+
+    assert set(results) == {'PREFIXES:\n- SP: Spectra Series'}
+    assert fake.calls['files.export'] == 1
+
+
+def test_poller_re_exports_only_when_document_changes():
+    fake = FakeDrive()
+    make_naming_doc(fake)
+    cache = NamingRulesCache(refresh_interval=0.05)
+    try:
+        cache.get_rules('naming-doc', make_drive_service(fake))
+        assert wait_for(lambda: cache.stats()['checks'] >= 3)
+        assert fake.calls['files.export'] == 1
+
+        fake.items['naming-doc']['content'] = 'PREFIXES:\n- BS: Bharat Series'
+        fake.touch('naming-doc')
+        assert wait_for(lambda: cache.stats()['refreshes'] == 2)
+        assert cache.get_rules('naming-doc', None)['rules'] == 'PREFIXES:\n- BS: Bharat Series'
+        assert fake.calls['files.export'] == 2
+    finally:
+        cache.stop()
+
+
+def test_failed_refresh_keeps_serving_cached_rules():
+    fake = FakeDrive()
+    make_naming_doc(fake)
+    drive_service = make_drive_service(fake)
+    naming_rules_cache.get_rules('naming-doc', drive_service)
+
+    fake.fail_next('files.get', RuntimeError('Drive unavailable'))
+    entry = naming_rules_cache.refresh('naming-doc')
+
+    assert entry['rules'] == 'PREFIXES:\n- SP: Spectra Series'
+    assert naming_rules_cache.stats()['errors'] == 1
+
+
+def test_unavailable_drive_falls_back_without_caching():
+    rules = NamingConventionService(None, 'naming-doc').get_naming_rules()
+
+    assert 'PREFIX-CATEGORY_description_YYYYMMDD_vNN.ext' in rules
+    assert naming_rules_cache.stats()['documents'] == {}
+
+
+def test_health_reports_cache_age_and_refresh_counts():
+    fake = FakeDrive()
+    make_naming_doc(fake)
+    naming_rules_cache.get_rules('naming-doc', make_drive_service(fake))
+
+    with main.app.test_client() as client:
+        stats = client.get('/health').get_json()['naming_rules_cache']
+
+    assert stats['refreshes'] == 1
+    assert stats['documents']['naming-doc']['age_seconds'] >= 0
+    assert stats['poller_running'] is True
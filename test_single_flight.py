@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Tests for single-flight coalescing of identical in-flight Drive reads and Gemini prompts
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from fake_google import FakeDrive, build_marketing_hub, make_drive_service
+from test_gemini_fused import FUSED_JSON, StubResponse, make_gemini
+from services_enhanced import Deadline, SingleFlight, single_flight, folder_tree_cache, naming_rules_cache
+
+CALLERS = 8
+
+
+def slowed(fn, seconds=0.2):
+    """Wrap fn so the first caller is still in flight when the others arrive"""
+    def wrapper(*args, **kwargs):
+        time.sleep(seconds)
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def run_together(fn, callers=CALLERS):
+    """Call fn from `callers` threads released at the same moment"""
+    barrier = threading.Barrier(callers)
+
+    def call(_):
+        barrier.wait()
+        return fn()
+
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        return list(pool.map(call, range(callers)))
+
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight()
+    executions = []
+
+    def load():
+        executions.append(1)
+        time.sleep(0.2)
+        return {'value': 42}
+
+    results = run_together(lambda: flight.do('test', 'key', load))
+
+    assert len(executions) == 1
+    assert all(result is results[0] for result in results)
+    stats = flight.stats()['test']
+    assert (stats['calls'], stats['executions'], stats['coalesced'], stats['in_flight']) == (CALLERS, 1, CALLERS - 1, 0)
+
+
+def test_waiters_get_the_leaders_error_and_the_key_is_released():
+    flight = SingleFlight()
+
+    def fail():
+        time.sleep(0.2)
+        raise ConnectionError("Drive unavailable")
+
+    def call():
+        try:
+            return flight.do('test', 'key', fail)
+        except ConnectionError as e:
+            return e
+
+    errors = run_together(call)
+
+    assert all(isinstance(error, ConnectionError) for error in errors)
+    assert flight.stats()['test']['errors'] == 1
+    assert flight.do('test', 'key', lambda: 'recovered') == 'recovered'
+    assert flight.do('test', 'other', lambda: 'separate') == 'separate'
+
+
+def test_waiter_gives_up_at_its_own_deadline():
+    flight = SingleFlight()
+    leader = threading.Thread(target=flight.do, args=('test', 'key', slowed(lambda: 'late', seconds=1)))
+    leader.start()
+    time.sleep(0.05)
+
+    started = time.perf_counter()
+    with Deadline.bind(time.monotonic() + 0.2):
+        with pytest.raises(TimeoutError):
+            flight.do('test', 'key', lambda: 'unused')
+    waited = time.perf_counter() - started
+    leader.join()
+
+    assert waited < 0.5
+
+
+def test_leaders_deadline_timeout_is_not_shared_with_waiters():
+    flight = SingleFlight()
+    calls = []
+
+    def load():
+        calls.append(threading.get_ident())
+        time.sleep(0.2)
+        if len(calls) == 1:
+            raise TimeoutError("Workflow step deadline passed")
+        return 'loaded'
+
+    def call():
+        try:
+            return flight.do('test', 'key', load)
+        except TimeoutError as e:
+            return e
+
+    results = run_together(call)
+
+    assert len(calls) == 2
+    assert sum(isinstance(result, TimeoutError) for result in results) == 1
+    assert results.count('loaded') == CALLERS - 1
+
+
+def test_concurrent_folder_structure_requests_crawl_once():
+    fake = FakeDrive()
+    root_id = build_marketing_hub(fake, top_level=3, per_folder=2, depth=2)
+    drive_service = make_drive_service(fake)
+    crawls = []
+    crawl = drive_service._crawl_folder_tree
+
+    def counted_crawl(*args):
+        crawls.append(1)
+        return crawl(*args)
+
+    drive_service._crawl_folder_tree = slowed(counted_crawl)
+
+    structures = run_together(lambda: drive_service.get_real_folder_structure(root_id))
+
+    assert len(crawls) == 1
+    assert len(set(structures)) == 1
+    assert single_flight.stats()['folder_tree']['coalesced'] >= 1
+    assert folder_tree_cache.stats()['refreshes'] == 1
+
+
+def test_concurrent_cold_naming_rule_loads_export_once():
+    fake = FakeDrive()
+    doc_id = fake.add_file('Naming Convention', None, mime_type='application/vnd.google-apps.document',
+                           file_id='naming-doc', content='PREFIXES:\n- SP: Spectra Series')
+    drive_service = make_drive_service(fake)
+    drive_service.read_document = slowed(drive_service.read_document)
+
+    entries = run_together(lambda: naming_rules_cache.get_rules(doc_id, drive_service))
+
+    assert fake.calls['files.export'] == 1
+    assert all(entry is entries[0] for entry in entries)
+    assert naming_rules_cache.stats()['refreshes'] == 1
+
+
+class CountingModel:
+    def __init__(self, latency=0.2, error=None):
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if self.error:
+            raise self.error
+        return StubResponse(FUSED_JSON)
+
+
+def test_identical_gemini_prompts_make_one_call():
+    model = CountingModel()
+    gemini_service = make_gemini(model)
+
+    results = run_together(lambda: gemini_service.analyze_and_recommend(
+        'Spectra Manual.pdf', 'application/pdf', 1000, 'rules', 'structure'
+    ))
+
+    assert model.calls == 1
+    assert all(result == results[0] for result in results)
+    # Each caller gets its own copy to annotate
+    results[0][0]['product_line'] = 'changed'
+    assert results[1][0]['product_line'] == 'SP'
+    assert single_flight.stats()['gemini']['coalesced'] >= 1
+
+
+def test_gemini_failure_is_shared_and_each_caller_falls_back():
+    model = CountingModel(error=RuntimeError("quota exceeded"))
+    gemini_service = make_gemini(model)
+
+    results = run_together(lambda: gemini_service.analyze_file_content(
+        'Spectra Manual.pdf', 'application/pdf', 1000, 'rules'
+    ))
+
+    assert model.calls == 1
+    assert all(result == results[0] for result in results)
+    assert single_flight.stats()['gemini']['errors'] == 1
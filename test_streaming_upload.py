@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests and memory benchmark for the chunked, streaming Drive upload path
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+from werkzeug.datastructures import FileStorage
+
+from fake_google import FakeResumableUploadServer, SyntheticFile
+from main import upload_to_drive
+
+MB = 1024 * 1024
+
+BENCHMARK_SCRIPT = """
+import json, resource, sys, time
+from werkzeug.datastructures import FileStorage
+from fake_google import FakeResumableUploadServer, SyntheticFile
+from main import upload_to_drive
+
+size, chunk_size = int(sys.argv[1]), int(sys.argv[2])
+with FakeResumableUploadServer() as server:
+    drive = server.drive_service()
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    file_id = upload_to_drive(drive, FileStorage(SyntheticFile(size), content_type='video/mp4'),
+                              'Survey Flight.mp4', 'hub-root', chunk_size=chunk_size)
+    elapsed = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'baseline_kb': baseline_kb, 'peak_kb': peak_kb, 'seconds': elapsed,
+                      'received': server.files[file_id]['size']}))
+"""
+
+
+def test_upload_sends_file_in_chunks():
+    with FakeResumableUploadServer() as server:
+        upload = FileStorage(SyntheticFile(5 * MB), content_type='application/pdf')
+
+        file_id = upload_to_drive(server.drive_service(), upload, 'Brochure.pdf', 'folder-1', chunk_size=MB)
+
+        assert server.files[file_id]['size'] == 5 * MB
+        assert server.files[file_id]['name'] == 'Brochure.pdf'
+        assert server.files[file_id]['parents'] == ['folder-1']
+        assert server.chunk_requests == 5
+
+
+def test_upload_rewinds_stream_read_for_size_check():
+    with FakeResumableUploadServer() as server:
+        stream = SyntheticFile(3 * MB)
+        stream.seek(0, os.SEEK_END)
+
+        file_id = upload_to_drive(server.drive_service(), FileStorage(stream, content_type='image/png'),
+                                  'Logo.png', 'folder-1', chunk_size=MB)
+
+        assert server.files[file_id]['size'] == 3 * MB
+
+
+def test_benchmark_peak_rss_is_bounded_by_chunk_size():
+    """Upload a 1 GB synthetic file in a fresh process and check peak RSS growth stays near the chunk size"""
+    size = int(os.environ.get('UPLOAD_BENCHMARK_BYTES', str(1024 * MB)))
+    chunk_size = 8 * MB
+
+    output = subprocess.run(
+        [sys.executable, '-c', BENCHMARK_SCRIPT, str(size), str(chunk_size)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=dict(os.environ, GEMINI_API_KEY=''),
+        capture_output=True, text=True, timeout=300, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    growth = (result['peak_kb'] - result['baseline_kb']) * 1024
+    print(f"{size / MB:.0f} MB in {result['seconds']:.1f} s, peak RSS growth {growth / MB:.1f} MB")
+
+    assert result['received'] == size
+    assert growth < chunk_size * 6
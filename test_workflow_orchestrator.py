@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Tests for step scheduling inside IntelligentWorkflowOrchestrator, using stub services
+"""
+
+import time
+import threading
+
+import pytest
+
+import services_enhanced
+from services_enhanced import GeminiService, GeminiAsyncRunner, IntelligentWorkflowOrchestrator, NamingConventionService
+from test_gemini_async import AsyncStubModel
+from test_gemini_fused import make_gemini
+
+STEP_LATENCY = 0.2
+
+
+class StubGemini(GeminiService):
+    """Fixed answers after a delay; fallbacks are GeminiService's own"""
+
+    def __init__(self, latency=STEP_LATENCY):
+        self.latency = latency
+
+    def analyze_file_content(self, filename, file_type, file_size, naming_convention_rules=None, rules_version=None):
+        time.sleep(self.latency)
+        assert 'SP=Spectra Series' in naming_convention_rules
+        return {'content_category': 'BRAND', 'product_line': 'MA', 'confidence_score': '90'}
+
+    def recommend_folder_with_structure(self, filename, content_analysis, folder_structure, path_index=None):
+        time.sleep(self.latency)
+        assert folder_structure == 'STRUCTURE'
+        return {'recommended_folder': 'Marketing Hub → 01_Brand Assets', 'reasoning': 'stub', 'confidence': '90'}
+
+
+class StubDrive:
+    def __init__(self, latency=STEP_LATENCY, duplicate=None):
+        self.latency = latency
+        self.duplicate = duplicate
+        self.threads = set()
+
+    def check_file_exists(self, filename, file_size, folder_id=None, md5=None):
+        self.threads.add(threading.get_ident())
+        time.sleep(self.latency)
+        return self.duplicate
+
+    def get_real_folder_structure(self, folder_id, max_depth=3):
+        self.threads.add(threading.get_ident())
+        time.sleep(self.latency)
+        return 'STRUCTURE'
+
+    def _fallback_folder_structure(self):
+        return 'STRUCTURE'
+
+
+class StubNaming(NamingConventionService):
+    def __init__(self, latency=STEP_LATENCY):
+        super().__init__(None, 'naming-doc')
+        self.latency = latency
+
+    def get_naming_rules(self):
+        time.sleep(self.latency)
+        return 'PREFIXES:\n- SP: Spectra Series'
+
+
+def test_independent_steps_run_concurrently():
+    drive = StubDrive()
+    orchestrator = IntelligentWorkflowOrchestrator(StubGemini(), drive, StubNaming())
+
+    started = time.perf_counter()
+    result = orchestrator.execute_intelligent_workflow('Profile.pdf', 'application/pdf', 1000, 'hub-root')
+    elapsed = time.perf_counter() - started
+
+    # max(dup, rules, crawl) + analysis + recommendation, instead of the sum of all five
+    assert elapsed < STEP_LATENCY * 4
+    assert len(drive.threads) == 2
+    assert result['folder_data']['recommended_folder'] == 'Marketing Hub → 01_Brand Assets'
+
+
+def test_result_reports_per_step_timings():
+    orchestrator = IntelligentWorkflowOrchestrator(StubGemini(), StubDrive(), StubNaming())
+
+    result = orchestrator.execute_intelligent_workflow('Profile.pdf', 'application/pdf', 1000, 'hub-root')
+    timings = result['step_timings']
+
+    for step in ('duplicate_check', 'naming_rules', 'folder_structure', 'content_analysis', 'folder_recommendation'):
+        assert timings[step] >= STEP_LATENCY * 1000 * 0.9
+    assert timings['total'] < sum(value for key, value in timings.items() if key != 'total')
+
+
+def test_duplicate_short_circuits_without_waiting_for_gemini():
+    duplicate = {'id': 'dup', 'name': 'Profile.pdf', 'size': 1000, 'created_time': '', 'web_link': ''}
+    orchestrator = IntelligentWorkflowOrchestrator(StubGemini(latency=5), StubDrive(duplicate=duplicate), StubNaming())
+
+    started = time.perf_counter()
+    result = orchestrator.execute_intelligent_workflow('Profile.pdf', 'application/pdf', 1000, 'hub-root')
+
+    assert result['is_duplicate'] is True
+    assert time.perf_counter() - started < 1
+    assert 'duplicate_check' in result['step_timings']
+
+
+def test_progress_updates_stay_in_step_order():
+    updates = []
+    orchestrator = IntelligentWorkflowOrchestrator(StubGemini(latency=0), StubDrive(latency=0), StubNaming(latency=0))
+    orchestrator.set_progress_callback(lambda step, progress, message: updates.append((step, progress)))
+
+    orchestrator.execute_intelligent_workflow('Profile.pdf', 'application/pdf', 1000, 'hub-root')
+
+    assert updates == sorted(updates)
+    assert updates[-1] == (3, 100)
+
+
+def test_slow_drive_steps_are_abandoned_at_their_deadline():
+    orchestrator = IntelligentWorkflowOrchestrator(StubGemini(), StubDrive(latency=5), StubNaming(latency=0))
+
+    started = time.perf_counter()
+    result = orchestrator.execute_intelligent_workflow('Profile.pdf', 'application/pdf', 1000, 'hub-root',
+                                                       deadline_seconds=1)
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 1
+    assert result['degraded_steps'] == ['duplicate_check', 'folder_structure']
+    assert result['folder_data']['recommended_folder'] == 'Marketing Hub → 01_Brand Assets'
+
+
+def test_slow_gemini_degrades_to_fallbacks_within_the_total_deadline():
+    gemini = StubGemini(latency=5)
+    orchestrator = IntelligentWorkflowOrchestrator(gemini, StubDrive(latency=0), StubNaming(latency=0))
+
+    started = time.perf_counter()
+    result = orchestrator.execute_intelligent_workflow('Profile.pdf', 'application/pdf', 1000, 'hub-root',
+                                                       deadline_seconds=1)
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 1.1
+    assert result['degraded_steps'] == ['content_analysis', 'folder_recommendation']
+    content_analysis = gemini._fallback_content_analysis('Profile.pdf', 'application/pdf', 1000)
+    assert result['analysis_data']['content_category'] == content_analysis['content_category']
+    assert result['folder_data']['recommended_folder'] == (
+        gemini._fallback_folder_recommendation('Profile.pdf', content_analysis)['recommended_folder']
+    )
+
+
+def test_no_steps_degrade_within_budget():
+    orchestrator = IntelligentWorkflowOrchestrator(StubGemini(latency=0), StubDrive(latency=0), StubNaming(latency=0))
+
+    result = orchestrator.execute_intelligent_workflow('Profile.pdf', 'application/pdf', 1000, 'hub-root')
+
+    assert result['degraded_steps'] == []
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    runner = GeminiAsyncRunner(max_concurrency=2, requests_per_minute=0)
+    monkeypatch.setattr(services_enhanced, 'gemini_runner', runner)
+    yield runner
+    runner.stop()
+
+
+def test_deadline_cancels_the_gemini_call_in_flight(runner):
+    model = AsyncStubModel(latency=5)
+    orchestrator = IntelligentWorkflowOrchestrator(make_gemini(model), StubDrive(latency=0), StubNaming(latency=0))
+
+    started = time.perf_counter()
+    result = orchestrator.execute_intelligent_workflow('Profile.pdf', 'application/pdf', 1000, 'hub-root',
+                                                       mode='fused', deadline_seconds=0.5)
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.7
+    assert result['degraded_steps'] == ['fused_analysis']
+    # The call is cancelled on the event loop, so it stops holding a concurrency slot
+    deadline = time.time() + 1
+    while runner.stats()['in_flight'] and time.time() < deadline:
+        time.sleep(0.01)
+    stats = runner.stats()
+    assert stats['deadline_cancelled'] == 1
+    assert stats['in_flight'] == 0 and stats['completed'] == 0
+
+
+def test_realistic_model_latency_is_not_degraded_by_default(runner):
+    """A 5 s gemini-2.5-pro call, the fast end of its range, runs to completion with no deadline set"""
+    model = AsyncStubModel(latency=5)
+    orchestrator = IntelligentWorkflowOrchestrator(make_gemini(model), StubDrive(latency=0), StubNaming(latency=0))
+
+    result = orchestrator.execute_intelligent_workflow('Spectra Manual.pdf', 'application/pdf', 1000, 'hub-root',
+                                                       mode='fused')
+
+    assert orchestrator.deadline_seconds == 0
+    assert result['degraded_steps'] == []
+    assert result['analysis_data']['content_category'] == 'TECH'
+    assert result['folder_data']['recommended_folder'].endswith('User Manuals')
+
+
+class VersionedNaming(StubNaming):
+    """Slow naming document at a known version, recording the rule set each filename is built from"""
+
+    def __init__(self, latency):
+        super().__init__(latency)
+        self.naming_rule_sets = []
+
+    def get_naming_rules(self):
+        time.sleep(self.latency)
+        self._cached_modified_time = self._loaded.version = '2024-06-01T00:00:00Z'
+        return 'PREFIXES:\n- SP: Spectra Series\n- OPS: Operations playbooks'
+
+    def apply_naming_convention(self, filename, analysis_data, rule_set=None):
+        self.naming_rule_sets.append(rule_set)
+        return super().apply_naming_convention(filename, analysis_data, rule_set)
+
+
+class RecordingGemini(StubGemini):
+    def analyze_file_content(self, filename, file_type, file_size, naming_convention_rules=None, rules_version=None):
+        self.seen = (naming_convention_rules, rules_version)
+        return super().analyze_file_content(filename, file_type, file_size, naming_convention_rules, rules_version)
+
+
+def test_abandoned_rules_load_does_not_leak_into_the_workflow():
+    naming = VersionedNaming(latency=0.5)
+    gemini = RecordingGemini(latency=0)
+    orchestrator = IntelligentWorkflowOrchestrator(gemini, StubDrive(latency=0), naming)
+
+    result = orchestrator.execute_intelligent_workflow('Profile.pdf', 'application/pdf', 1000, 'hub-root',
+                                                       deadline_seconds=1)
+    time.sleep(0.5)  # the abandoned load finishes and updates the shared service
+
+    assert result['degraded_steps'] == ['naming_rules']
+    rules, rules_version = gemini.seen
+    assert 'OPS=' not in rules and rules_version is None
+    [rule_set] = naming.naming_rule_sets
+    assert rule_set.version is None and rule_set.code_table() == rules
+    assert naming.rules_version == '2024-06-01T00:00:00Z'
+
+
+class ThreadRecordingGemini(StubGemini):
+    def __init__(self, latency=STEP_LATENCY):
+        super().__init__(latency)
+        self.threads = set()
+
+    def analyze_file_content(self, filename, file_type, file_size, naming_convention_rules=None, rules_version=None):
+        self.threads.add(threading.get_ident())
+        return super().analyze_file_content(filename, file_type, file_size, naming_convention_rules, rules_version)
+
+    def recommend_folder_with_structure(self, filename, content_analysis, folder_structure, path_index=None):
+        self.threads.add(threading.get_ident())
+        return super().recommend_folder_with_structure(filename, content_analysis, folder_structure, path_index)
+
+
+def test_gemini_steps_run_on_the_calling_thread_without_a_deadline():
+    gemini = ThreadRecordingGemini(latency=0)
+    orchestrator = IntelligentWorkflowOrchestrator(gemini, StubDrive(latency=0), StubNaming(latency=0))
+
+    orchestrator.execute_intelligent_workflow('Profile.pdf', 'application/pdf', 1000, 'hub-root')
+
+    assert gemini.threads == {threading.get_ident()}
+
+
+def test_concurrent_workflows_share_one_bounded_step_pool(monkeypatch):
+    step_executor = services_enhanced.ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(services_enhanced, 'workflow_step_executor', step_executor)
+    drive = StubDrive(latency=0.05)
+    gemini = ThreadRecordingGemini(latency=0.05)
+    orchestrator = IntelligentWorkflowOrchestrator(gemini, drive, StubNaming(latency=0.05))
+    results = []
+
+    workflows = [
+        threading.Thread(target=lambda: results.append(orchestrator.execute_intelligent_workflow(
+            f'Profile-{index}.pdf', 'application/pdf', 1000, 'hub-root')))
+        for index in range(6)
+    ]
+    for workflow in workflows:
+        workflow.start()
+    for workflow in workflows:
+        workflow.join()
+    step_executor.shutdown()
+
+    assert len(results) == 6
+    assert len(drive.threads) <= 2
+    assert gemini.threads == {workflow.ident for workflow in workflows}